@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+'''Windowed metrics pre-aggregation module
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import logging
+from collections import OrderedDict
+
+from metricol.channels import MetricBatch
+from metricol.inputs import MetricInput
+from metricol.sketch import QuantileSketch
+
+
+LOG = logging.getLogger(__name__)
+
+
+class TimerFold(object):
+    '''Folded timer values (count, sum, min, max)
+    '''
+    __slots__ = ('count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+
+    def add(self, val):
+        '''Adds a value
+        '''
+        self.count += 1
+        self.total += val
+        if val < self.min:
+            self.min = val
+        if val > self.max:
+            self.max = val
+
+
+    def merge(self, other):
+        '''Merges other fold into this one
+        '''
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
+    def iter_values(self):
+        '''Generates (name suffix, value) summary pairs
+        '''
+        if not self.count:
+            return
+        yield 'count', self.count
+        yield 'sum', self.total
+        yield 'min', self.min
+        yield 'max', self.max
+        yield 'mean', self.total / self.count
+
+
+class TimerSketch(TimerFold):
+    '''Folded timer values with their distribution's sketch (emits also
+    percentiles)
+    '''
+    __slots__ = ('sketch', 'percentiles')
+
+    def __init__(self, percentiles=(50.0, 90.0, 99.0), accuracy=0.01):
+        super(TimerSketch, self).__init__()
+        self.percentiles = percentiles
+        self.sketch = QuantileSketch(accuracy)
+
+
+    def add(self, val):
+        super(TimerSketch, self).add(val)
+        self.sketch.add(val)
+
+
+    def merge(self, other):
+        super(TimerSketch, self).merge(other)
+        self.sketch.merge(other.sketch)
+
+
+    def iter_values(self):
+        for suffix, val in super(TimerSketch, self).iter_values():
+            yield suffix, val
+        values = self.sketch.quantiles(
+            [percentile / 100.0 for percentile in self.percentiles])
+        for percentile, val in zip(self.percentiles, values):
+            # estimates are kept within the observed range
+            yield percentile_suffix(percentile), \
+                min(max(val, self.min), self.max)
+
+
+def percentile_suffix(percentile):
+    '''Returns metric name suffix of a percentile (99.9 -> p99_9)
+    '''
+    return 'p' + ('%g' % percentile).replace('.', '_')
+
+
+def new_window():
+    '''Returns empty window aggregates: counters, gauges and timers by key
+    '''
+    return ({}, {}, {})
+
+
+class WindowAggregator(object):
+    '''Aggregates metrics per (key, time window): sums counters, keeps the
+    last gauge value and folds timers
+
+    Windows are closed (emitted as one batch each) once the event time
+    (or, when input is idle, the wall-clock) passed their end by `delay_secs`.
+    Closed windows are retained for `late_secs` (event time): a late point
+    updates the retained aggregates and the window is emitted again, its
+    counters as increments since the last emission (outputs and channels
+    add counters up) and the rest as updated values (overwriting earlier
+    ones); points arriving even later are dropped. Without `use_wall_clock`
+    (replaying old logs) only the event time closes windows.
+    '''
+
+    def __init__(self, window_secs, delay_secs=2.0, late_secs=300.0,
+                 timer_fold=TimerFold, use_wall_clock=True):
+        self.window_secs = window_secs
+        self.delay_secs = delay_secs
+        self.late_secs = late_secs
+        self.timer_fold = timer_fold
+        self.use_wall_clock = use_wall_clock
+        self.windows = {}
+        # closed windows: (aggregates, counters' emitted values) pairs
+        self.retained = OrderedDict()
+        self.dirty = set()
+        # end of the last closed window
+        self.closed_until = 0
+        # the newest event time seen / wall-clock time it was seen at
+        self.max_ts = 0
+        self.seen_ts = 0.0
+        self._stats = {
+            'points_in': 0,
+            'windows_emitted': 0,
+            'windows_reemitted': 0,
+            'late_points': 0,
+            'late_dropped': 0,
+        }
+
+
+    def get_window(self, tstamp):
+        '''Returns aggregates of the window holding tstamp (None when it
+        was already closed and is not retained anymore) and lateness flag
+        '''
+        window_ts = tstamp - tstamp % self.window_secs
+        if window_ts < self.closed_until:
+            retained = self.retained.get(window_ts)
+            if retained is None:
+                return None, True
+            self.dirty.add(window_ts)
+            return retained[0], True
+
+        window = self.windows.get(window_ts)
+        if window is None:
+            window = self.windows[window_ts] = new_window()
+
+        return window, False
+
+
+    def extend(self, metrics, now_ts):
+        '''Adds points from (key, value, type, timestamp) tuples
+        '''
+        counter_type = MetricInput.METRIC_TYPE_COUNTER
+        timer_type = MetricInput.METRIC_TYPE_TIMER
+        window_tstamp = window = None
+        late = False
+        stats = self._stats
+        for key, val, metric_type, tstamp in metrics:
+            if tstamp != window_tstamp:
+                # consecutive points usually share their timestamp
+                window_tstamp = tstamp
+                if tstamp > self.max_ts:
+                    self.max_ts = tstamp
+                window, late = self.get_window(tstamp)
+            stats['points_in'] += 1
+            if late:
+                stats['late_points'] += 1
+                if window is None:
+                    stats['late_dropped'] += 1
+                    continue
+
+            if metric_type == counter_type:
+                counters = window[0]
+                counters[key] = counters.get(key, 0) + val
+            elif metric_type == timer_type:
+                fold = window[2].get(key)
+                if fold is None:
+                    fold = window[2][key] = self.timer_fold()
+                fold.add(val)
+            else:
+                window[1][key] = val
+        self.seen_ts = now_ts
+
+
+    def merge(self, windows, max_ts, points, now_ts):
+        '''Merges partial aggregates (windows of other aggregator, in order
+        of their points)
+        '''
+        for window_ts in sorted(windows):
+            counters, gauges, timers = windows[window_ts]
+            window_points = len(counters) + len(gauges) + len(timers)
+            window, late = self.get_window(window_ts)
+            if late:
+                self._stats['late_points'] += window_points
+                if window is None:
+                    self._stats['late_dropped'] += window_points
+                    continue
+
+            own_counters, own_gauges, own_timers = window
+            for key, val in counters.items():
+                own_counters[key] = own_counters.get(key, 0) + val
+            own_gauges.update(gauges)
+            for key, fold in timers.items():
+                own_fold = own_timers.get(key)
+                if own_fold is None:
+                    own_timers[key] = fold
+                else:
+                    own_fold.merge(fold)
+        self._stats['points_in'] += points
+        if max_ts > self.max_ts:
+            self.max_ts = max_ts
+        self.seen_ts = now_ts
+
+
+    def make_batch(self, window_ts, window, emitted):
+        '''Returns compacted batch of window's aggregates, counters as
+        increments since their values in `emitted` (updated)
+        '''
+        counter_type = MetricInput.METRIC_TYPE_COUNTER
+        gauge_type = MetricInput.METRIC_TYPE_GAUGE
+        counters, gauges, timers = window
+        batch = MetricBatch(window_ts)
+        for key, val in counters.items():
+            delta = val - emitted.get(key, 0)
+            if delta:
+                batch.add(key, delta, counter_type)
+                emitted[key] = val
+        for key, val in gauges.items():
+            batch.add(key, val, gauge_type)
+        for key, fold in timers.items():
+            # summaries are not samples (not to be summarized again as
+            # timers): count is a counter, the rest of them are gauges
+            for suffix, val in fold.iter_values():
+                name = key + '.' + suffix
+                if suffix != 'count':
+                    batch.add(name, val, gauge_type)
+                    continue
+                delta = val - emitted.get(name, 0)
+                if delta:
+                    batch.add(name, delta, counter_type)
+                    emitted[name] = val
+
+        return batch
+
+
+    def flush(self, now_ts, force=False):
+        '''Closes windows which are due (all when forced), returns their
+        (and updated retained windows') batches
+        '''
+        watermark = self.max_ts
+        if self.use_wall_clock and now_ts - self.seen_ts >= self.delay_secs:
+            # input is idle: time passes on the wall-clock
+            watermark = max(watermark, now_ts)
+        batches = []
+        for window_ts in sorted(self.dirty):
+            if window_ts in self.retained:
+                window, emitted = self.retained[window_ts]
+                batches.append(self.make_batch(window_ts, window, emitted))
+                self._stats['windows_reemitted'] += 1
+        self.dirty.clear()
+
+        for window_ts in sorted(self.windows):
+            window_end = window_ts + self.window_secs
+            if not force and window_end + self.delay_secs > watermark:
+                break
+            window = self.windows.pop(window_ts)
+            emitted = {}
+            batches.append(self.make_batch(window_ts, window, emitted))
+            self._stats['windows_emitted'] += 1
+            self.retained[window_ts] = (window, emitted)
+            self.closed_until = max(self.closed_until, window_end)
+
+        while self.retained:
+            window_ts = next(iter(self.retained))
+            if window_ts + self.window_secs + self.late_secs > watermark:
+                break
+            del self.retained[window_ts]
+
+        return batches
+
+
+    def stats(self):
+        '''Returns aggregator counters
+        '''
+        stats = dict(self._stats)
+        stats['windows_open'] = len(self.windows)
+        stats['windows_retained'] = len(self.retained)
+
+        return stats
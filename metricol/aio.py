@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+'''asyncio execution engine module
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import asyncio
+import logging
+import ssl
+import time
+from urllib.parse import urlsplit
+
+from metricol.commons import ManageableThread
+from metricol.scheduler import next_tick
+
+
+LOG = logging.getLogger(__name__)
+
+FETCH_ERRORS = (
+    OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError)
+
+
+async def http_get(url, headers=None, timeout=10.0):
+    '''Fetches URL (HTTP/1.1 GET), returns status code and body
+    '''
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(
+        parts.hostname, port,
+        ssl=ssl.create_default_context() if secure else None), timeout)
+    try:
+        req_headers = {
+            'Host': parts.netloc,
+            'Accept-Encoding': 'identity',
+            'Connection': 'close',
+        }
+        req_headers.update(headers or {})
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        writer.write(bytes('GET %s HTTP/1.1\r\n%s\r\n' % (path, ''.join(
+            '%s: %s\r\n' % item for item in req_headers.items())),
+            encoding='latin-1'))
+        return await asyncio.wait_for(read_http_response(reader), timeout)
+    finally:
+        writer.close()
+
+
+async def read_http_response(reader):
+    '''Reads HTTP response, returns status code and body
+    '''
+    status_line = await reader.readline()
+    if len(status_line.split()) < 2:
+        raise ValueError('Bad status line: %s' % repr(status_line))
+    status = int(status_line.split()[1])
+    resp_headers = {}
+    while True:
+        line = (await reader.readline()).strip()
+        if not line:
+            break
+        key, val = str(line, encoding='latin-1').split(':', 1)
+        resp_headers[key.strip().lower()] = val.strip()
+
+    if resp_headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        return status, b''.join(chunks)
+
+    if 'content-length' in resp_headers:
+        return status, await reader.readexactly(
+            int(resp_headers['content-length']))
+
+    return status, await reader.read()
+
+
+class AsyncEngine(ManageableThread):
+    '''Polls periodic inputs concurrently on a single asyncio event loop
+    '''
+    LATE_SECS = 1.0
+
+    def __init__(self):
+        super(AsyncEngine, self).__init__(name='asyncio')
+        self.plugins = []
+        self.loop = None
+        self._stopped = None
+        self._stats = {
+            'ticks': 0,
+            'late': 0,
+            'skipped': 0,
+            'failed': 0,
+        }
+
+
+    def add(self, plugin):
+        '''Adds (not yet prepared) input plugin
+        '''
+        self.plugins.append(plugin)
+
+
+    def prepare_things(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._stopped = asyncio.Event()
+        for plugin in self.plugins:
+            plugin.prepare_things()
+        LOG.info('Polled inputs: %s', len(self.plugins))
+
+
+    def stop_things(self):
+        for plugin in self.plugins:
+            plugin.keep_running = False
+            plugin.stop_things()
+        if self.loop and self._stopped:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+
+    def stats(self):
+        '''Returns engine counters
+        '''
+        return dict(self._stats)
+
+
+    async def get_metrics(self, plugin, now_ts):
+        '''Fetches and publishes input's metrics (logs failures)
+        '''
+        try:
+            await plugin.async_get_metrics(now_ts)
+        except Exception as exc:  # pylint: disable=broad-except
+            self._stats['failed'] += 1
+            LOG.error('%s @ %s', repr(exc), plugin.getName())
+
+
+    async def poll(self, plugin):
+        '''Polls input at wall-clock aligned period boundaries (a tick is
+        skipped while the previous poll is still running)
+        '''
+        due_ts = next_tick(time.time(), plugin.period)
+        task = None
+        while self.keep_running and not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._stopped.wait(), max(0.0, due_ts - time.time()))
+                break
+            except asyncio.TimeoutError:
+                pass
+
+            now_ts = time.time()
+            self._stats['ticks'] += 1
+            if now_ts - due_ts > self.LATE_SECS:
+                self._stats['late'] += 1
+                LOG.warning(
+                    '%s: late tick: %.3fs', plugin.getName(), now_ts - due_ts)
+            if task is not None and not task.done():
+                # not cancelled: fetch_data may still run in an executor
+                self._stats['skipped'] += 1
+                LOG.warning(
+                    '%s: skipped tick: previous poll running', plugin.getName())
+            else:
+                task = self.loop.create_task(
+                    self.get_metrics(plugin, int(due_ts)))
+                await asyncio.wait([task], timeout=plugin.period)
+
+            now_ts = time.time()
+            missed = int((now_ts - due_ts) // plugin.period)
+            if missed:
+                self._stats['skipped'] += missed
+                LOG.warning('%s: skipped ticks: %s', plugin.getName(), missed)
+            due_ts += (missed + 1) * plugin.period
+
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+    async def poll_all(self):
+        '''Polls all inputs until stopped
+        '''
+        await asyncio.gather(*[self.poll(plugin) for plugin in self.plugins])
+
+
+    def run(self):
+        self.prepare_things()
+        try:
+            self.loop.run_until_complete(self.poll_all())
+        finally:
+            self.loop.close()
+
+        LOG.info('%s thread exiting...', self.getName())
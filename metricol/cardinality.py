@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+'''Metric series cardinality limiting module
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import heapq
+import logging
+import time
+from operator import itemgetter
+
+
+LOG = logging.getLogger(__name__)
+
+OTHER_VALUE = '_other'
+
+
+class CardinalityLimiter(object):
+    '''Keeps the top-K (heavy hitter) values of a field, the rest of them
+    is folded into a single `_other` value
+
+    Values' frequencies are estimated with Misra-Gries summary of (bounded)
+    `tracked` counters. A value is let through when it was already admitted
+    or there is a free slot and it was seen at least `min_count` times
+    (values may be counted in bulk: pre-aggregated occurrences).
+    Every `decay_secs` the admitted values are re-elected (the top-K of the
+    summary) and the counters are halved, so values which stop being
+    frequent are evicted.
+    '''
+
+    def __init__(self, max_values=100, tracked=0, min_count=2,
+                 decay_secs=600.0):
+        self.max_values = max_values
+        self.tracked = tracked or 4 * max_values
+        self.min_count = min_count
+        self.decay_secs = decay_secs
+        self.counts = {}
+        self.admitted = set()
+        self.decay_ts = time.time() + decay_secs
+        self._stats = {
+            'values_in': 0,
+            'values_other': 0,
+            'evicted': 0,
+        }
+
+
+    def count(self, value, occurrences=1):
+        '''Counts value's occurrences (weighted Misra-Gries), returns its
+        estimate
+        '''
+        counts = self.counts
+        cnt = counts.get(value)
+        if cnt is not None:
+            counts[value] = cnt + occurrences
+            return cnt + occurrences
+        counts[value] = occurrences
+        if len(counts) <= self.tracked:
+            return occurrences
+
+        # summary is full: decrement all counters by the smallest one
+        # (amortized O(1) for single occurrences)
+        dec = min(counts.values())
+        for key, cnt in list(counts.items()):
+            if cnt > dec:
+                counts[key] = cnt - dec
+            else:
+                del counts[key]
+
+        return counts.get(value, 0)
+
+
+    def limit(self, value, occurrences=1):
+        '''Returns the value itself (when admitted) or `_other`
+        '''
+        self._stats['values_in'] += occurrences
+        cnt = self.count(value, occurrences)
+        if value in self.admitted:
+            return value
+        if len(self.admitted) < self.max_values and cnt >= self.min_count:
+            self.admitted.add(value)
+            return value
+
+        self._stats['values_other'] += occurrences
+        return OTHER_VALUE
+
+
+    def decay(self, now_ts):
+        '''Re-elects admitted values and halves counters (when due)
+        '''
+        if now_ts < self.decay_ts:
+            return
+        self.decay_ts = now_ts + self.decay_secs
+
+        top_values = heapq.nlargest(
+            self.max_values,
+            (item for item in self.counts.items()
+             if item[1] >= self.min_count),
+            key=itemgetter(1))
+        admitted = set(value for value, _ in top_values)
+        self._stats['evicted'] += len(self.admitted - admitted)
+        self.admitted = admitted
+        self.counts = {
+            value: cnt // 2 for value, cnt in self.counts.items() if cnt > 1}
+
+
+    def stats(self):
+        '''Returns limiter counters
+        '''
+        stats = dict(self._stats)
+        stats['admitted'] = len(self.admitted)
+        stats['tracked'] = len(self.counts)
+
+        return stats
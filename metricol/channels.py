@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+'''Metrics channels module
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import logging
+import sys
+import threading
+from array import array
+from collections import deque
+
+
+LOG = logging.getLogger(__name__)
+
+METRIC_TYPES = ('g', 'c', 'ms')
+TYPE_CODES = {_type: _code for _code, _type in enumerate(METRIC_TYPES)}
+
+
+class MetricBatch(object):
+    '''Columnar batch of metrics published by a single input poll
+
+    Points are kept as a list of interned keys (shared by batches, released
+    with the last batch referencing them), values in `array('d')` and one
+    type code byte per point; all points share a single timestamp. Batch
+    should not be modified once it was put on a channel.
+    '''
+    __slots__ = ('tstamp', 'keys', 'values', 'types')
+
+    def __init__(self, tstamp, metrics=()):
+        self.tstamp = tstamp
+        self.keys = []
+        self.values = array('d')
+        self.types = bytearray()
+        self.extend(metrics)
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def __iter__(self):
+        '''Iterates over (key, value, type code) points
+        '''
+        return zip(self.keys, self.values, self.types)
+
+
+    @property
+    def points(self):
+        '''Returns number of points in batch
+        '''
+        return len(self.values)
+
+
+    def add(self, key, val, metric_type):
+        '''Adds a point
+        '''
+        try:
+            self.values.append(val)
+        except TypeError:
+            LOG.warning('Not a number: %s @ %s', repr(val), repr(key))
+            return
+        self.keys.append(sys.intern(key))
+        self.types.append(TYPE_CODES[metric_type])
+
+
+    def extend(self, metrics):
+        '''Adds points from (key, value, type, ...) tuples
+        '''
+        for metric_data in metrics:
+            self.add(metric_data[0], metric_data[1], metric_data[2])
+
+
+def coalesce_batches(batches):
+    '''Merges batches: sums counters and keeps the last value of gauges by
+    key (stamped with the newest timestamp), keeps all timers (grouped by
+    their original timestamps); returns a list of batches
+    '''
+    counter_code = TYPE_CODES['c']
+    gauge_code = TYPE_CODES['g']
+    counters = {}
+    gauges = {}
+    timers = {}
+    for batch in batches:
+        for key, val, type_code in batch:
+            if type_code == counter_code:
+                counters[key] = counters.get(key, 0.0) + val
+            elif type_code == gauge_code:
+                gauges[key] = val
+            else:
+                merged = timers.get(batch.tstamp)
+                if merged is None:
+                    merged = timers[batch.tstamp] = MetricBatch(batch.tstamp)
+                merged.keys.append(key)
+                merged.values.append(val)
+                merged.types.append(type_code)
+    merged = MetricBatch(max(batch.tstamp for batch in batches))
+    for type_code, values_dc in (
+            (counter_code, counters), (gauge_code, gauges)):
+        for key, val in values_dc.items():
+            merged.keys.append(key)
+            merged.values.append(val)
+            merged.types.append(type_code)
+
+    return [batch for batch in list(timers.values()) + [merged] if batch]
+
+
+class BatchChannel(object):
+    '''Inputs to outputs broadcast channel passing whole batches of metrics
+
+    Every output reads shared (not copied) batches through its own cursor,
+    batches are released once all cursors passed them. Channel retains up
+    to `capacity` points (0: unbounded); when full, new batch is handled
+    according to the policy: block (the producer), drop_newest, drop_oldest
+    or coalesce (merge pending batches, then drop oldest). A cursor
+    lagging more than its `max_lag` points skips the oldest batches, so a slow
+    output does not stall the others.
+    '''
+    POLICIES = ('block', 'drop_newest', 'drop_oldest', 'coalesce')
+    WAIT_SECS = 1.0
+
+    def __init__(self, capacity=0, policy='block'):
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown channel policy: %s' % repr(policy))
+        self.capacity = capacity
+        self.policy = policy
+        self.closed = False
+        self.cursors = []
+        self._batches = deque()
+        # cumulative points count at the end of each retained batch
+        self._ends = deque()
+        self._base_seq = 0
+        self._base_points = 0
+        self._total_points = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'batches_in': 0,
+            'points_in': 0,
+            'batches_dropped': 0,
+            'points_dropped': 0,
+            'points_coalesced': 0,
+            'blocked': 0,
+        }
+
+
+    @property
+    def tail_seq(self):
+        '''Returns sequence number of the next published batch
+        '''
+        return self._base_seq + len(self._batches)
+
+
+    def points_before(self, seq):
+        '''Returns cumulative points count before batch with seq
+        '''
+        if seq <= self._base_seq:
+            return self._base_points
+        return self._ends[seq - self._base_seq - 1]
+
+
+    def subscribe(self, name, max_lag=0):
+        '''Returns a new cursor (positioned at the oldest retained batch)
+        '''
+        with self._cond:
+            cursor = ChannelCursor(self, name, self._base_seq, max_lag)
+            self.cursors.append(cursor)
+
+        return cursor
+
+
+    def is_full(self, batch):
+        '''Checks if batch does not fit (non-empty channel)
+        '''
+        return self.capacity and self._batches and self._total_points - \
+            self._base_points + batch.points > self.capacity
+
+
+    def drop_first(self):
+        '''Releases the oldest retained batch (moves cursors past it)
+        '''
+        batch = self._batches.popleft()
+        self._base_points = self._ends.popleft()
+        self._base_seq += 1
+        dropped = False
+        for cursor in self.cursors:
+            if cursor.seq < self._base_seq:
+                cursor.seq = self._base_seq
+                cursor.stats_dc['batches_dropped'] += 1
+                cursor.stats_dc['points_dropped'] += batch.points
+                dropped = True
+        if dropped:
+            self._stats['batches_dropped'] += 1
+            self._stats['points_dropped'] += batch.points
+
+
+    def trim(self):
+        '''Releases batches read by all cursors
+        '''
+        if not self.cursors:
+            return
+        min_seq = min(cursor.seq for cursor in self.cursors)
+        while self._batches and self._base_seq < min_seq:
+            self.drop_first()
+
+
+    def coalesce(self):
+        '''Merges retained batches between cursors' positions (so every
+        cursor still reads all of its pending points, in fewer batches)
+        '''
+        bounds = sorted(set(
+            [self._base_seq, self.tail_seq] +
+            [cursor.seq for cursor in self.cursors]))
+        batches = []
+        new_seqs = {}
+        for start, end in zip(bounds, bounds[1:]):
+            new_seqs[start] = self._base_seq + len(batches)
+            run = [self._batches[seq - self._base_seq]
+                   for seq in range(start, end)]
+            if len(run) < 2:
+                batches.extend(run)
+                continue
+            merged = coalesce_batches(run)
+            self._stats['points_coalesced'] += \
+                sum(batch.points for batch in run) - \
+                sum(batch.points for batch in merged)
+            batches.extend(merged)
+        new_seqs[self.tail_seq] = self._base_seq + len(batches)
+        for cursor in self.cursors:
+            cursor.seq = new_seqs[cursor.seq]
+
+        self._batches = deque(batches)
+        self._ends = deque()
+        self._total_points = self._base_points
+        for batch in batches:
+            self._total_points += batch.points
+            self._ends.append(self._total_points)
+
+
+    def put(self, batch):
+        '''Publishes a batch
+        '''
+        if not batch:
+            return
+
+        with self._cond:
+            if not self.closed and self.is_full(batch):
+                if self.policy == 'block':
+                    self._stats['blocked'] += 1
+                    while not self.closed and self.is_full(batch):
+                        self._cond.wait(self.WAIT_SECS)
+                elif self.policy == 'drop_newest':
+                    self._stats['batches_dropped'] += 1
+                    self._stats['points_dropped'] += batch.points
+                    return
+                elif self.policy == 'coalesce':
+                    self.coalesce()
+                while self.is_full(batch):
+                    self.drop_first()
+            self._batches.append(batch)
+            self._total_points += batch.points
+            self._ends.append(self._total_points)
+            self._stats['batches_in'] += 1
+            self._stats['points_in'] += batch.points
+            for cursor in self.cursors:
+                while cursor.max_lag and cursor.seq < self.tail_seq - 1 and \
+                        self._total_points - self.points_before(cursor.seq) > \
+                        cursor.max_lag:
+                    skipped = self._batches[cursor.seq - self._base_seq]
+                    cursor.seq += 1
+                    cursor.stats_dc['batches_dropped'] += 1
+                    cursor.stats_dc['points_dropped'] += skipped.points
+            self.trim()
+            self._cond.notify_all()
+
+
+    def read(self, cursor, timeout=None, max_points=0):
+        '''Returns cursor's pending batches, all of them or whole ones up to
+        max_points (at least one), optionally waits for the first one
+        '''
+        with self._cond:
+            if cursor.seq >= self.tail_seq and timeout:
+                self._cond.wait(timeout)
+            batches = []
+            points = 0
+            while cursor.seq < self.tail_seq:
+                batch = self._batches[cursor.seq - self._base_seq]
+                if max_points and batches and \
+                        points + batch.points > max_points:
+                    break
+                batches.append(batch)
+                points += batch.points
+                cursor.seq += 1
+            cursor.stats_dc['batches_out'] += len(batches)
+            cursor.stats_dc['points_out'] += points
+            if batches:
+                self.trim()
+                self._cond.notify_all()
+
+        return batches
+
+
+    def close(self):
+        '''Closes channel (producers will not be blocked anymore)
+        '''
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+    def stats(self):
+        '''Returns channel counters
+        '''
+        with self._cond:
+            stats = dict(self._stats)
+            stats['batches_pending'] = len(self._batches)
+            stats['points_pending'] = self._total_points - self._base_points
+            stats['capacity'] = self.capacity
+            stats['cursors'] = len(self.cursors)
+
+        return stats
+
+
+    def cursor_stats(self, cursor):
+        '''Returns cursor counters
+        '''
+        with self._cond:
+            stats = dict(cursor.stats_dc)
+            stats['lag_points'] = \
+                self._total_points - self.points_before(cursor.seq)
+
+        return stats
+
+
+class ChannelCursor(object):
+    '''Output's (reading) cursor of a broadcast channel
+    '''
+
+    def __init__(self, channel, name, seq, max_lag=0):
+        self.channel = channel
+        self.name = name
+        self.seq = seq
+        self.max_lag = max_lag
+        self.stats_dc = {
+            'batches_out': 0,
+            'points_out': 0,
+            'batches_dropped': 0,
+            'points_dropped': 0,
+        }
+
+
+    def get_batches(self, timeout=None, max_points=0):
+        '''Returns pending batches (see: BatchChannel.read)
+        '''
+        return self.channel.read(self, timeout, max_points)
+
+
+    def stats(self):
+        '''Returns cursor counters
+        '''
+        return self.channel.cursor_stats(self)
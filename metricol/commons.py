@@ -11,18 +11,27 @@ from __future__ import (
     with_statement,
 )
 
+import calendar
 import importlib
 import inspect
 import logging
 import sys
 import threading
 import time
+from collections import OrderedDict
 
 import dateutil.parser as du_parser
 
 
 LOG = logging.getLogger(__name__)
 
+STATS_PROVIDERS = {}
+
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+
 
 class ManageableThread(threading.Thread):
     '''Manageable thread class
@@ -74,6 +83,64 @@ class ManageableThread(threading.Thread):
         LOG.info('%s thread exiting...', self.getName())
 
 
+class NameCache(object):
+    '''Bounded (LRU) cache of metric names
+    '''
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._names = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __len__(self):
+        return len(self._names)
+
+
+    def get(self, name_key):
+        '''Returns cached name (or None)
+        '''
+        try:
+            name = self._names[name_key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._names.move_to_end(name_key)
+        self.hits += 1
+        return name
+
+
+    def put(self, name_key, name):
+        '''Caches name (evicts least recently used ones) and returns it
+        '''
+        self._names[name_key] = name
+        if len(self._names) > self.maxsize:
+            self._names.popitem(last=False)
+            self.evictions += 1
+
+        return name
+
+
+    def stats(self):
+        '''Returns cache counters
+        '''
+        return {
+            'size': len(self._names),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def register_stats(name, provider):
+    '''Registers self-metrics provider (a callable returning dict of numbers)
+    '''
+    STATS_PROVIDERS[name] = provider
+
+
 def get_method_by_path(method_path):
     '''Returns method by path (root_module.sub_module.(...).a_method)
     '''
@@ -94,10 +161,283 @@ def get_method_by_path(method_path):
     return None
 
 
-def decode_time(value):
-    '''Decodes time representation
+def match_groups(match):
+    '''Returns named groups of a (str or bytes pattern's) match as strings
+    '''
+    data = match.groupdict()
+    if isinstance(match.re.pattern, bytes):
+        for key, val in data.items():
+            if val is not None:
+                data[key] = str(val, encoding='utf-8', errors='replace')
+
+    return data
+
+
+def parse_time(value):
+    '''Parses time representation of any format (slow, using dateutil)
     '''
     try:
         return int(du_parser.parse(value).timestamp())
     except (OverflowError, ValueError) as exc:
         LOG.warning('%s @ %s', repr(exc), repr(value))
+
+
+def parse_tz_offset(value):
+    '''Parses UTC offset (Z, +HHMM or +HH:MM), returns seconds
+    '''
+    if value == 'Z':
+        return 0
+    if value[0] not in '+-':
+        raise ValueError(value)
+    digits = value[1:].replace(':', '')
+    if len(digits) != 4:
+        raise ValueError(value)
+    offset = int(digits[:2]) * 3600 + int(digits[2:]) * 60
+
+    return -offset if value[0] == '-' else offset
+
+
+def utc_day_start(days, key, year, month, day):
+    '''Returns (memoized) timestamp of the UTC midnight of a day
+    '''
+    day_ts = days.get(key)
+    if day_ts is None:
+        if len(days) > 1024:
+            days.clear()
+        day_ts = days[key] = calendar.timegm(
+            (year, month, day, 0, 0, 0, 0, 0, 0))
+
+    return day_ts
+
+
+def parse_time_local(value, days):
+    '''Parses nginx $time_local (17/Oct/2026:10:00:00 +0200)
+    '''
+    if len(value) != 26 or value[2] != '/' or value[6] != '/' or \
+            value[11] != ':':
+        raise ValueError(value)
+    day_ts = utc_day_start(
+        days, value[:11], int(value[7:11]), MONTHS[value[3:6]], int(value[:2]))
+
+    return day_ts + int(value[12:14]) * 3600 + int(value[15:17]) * 60 + \
+        int(value[18:20]) - parse_tz_offset(value[21:])
+
+
+def parse_iso8601(value, days):
+    '''Parses nginx $time_iso8601 / ISO 8601 (2026-10-17T10:00:00+02:00,
+    fractions of seconds are ignored, local time when no offset given)
+    '''
+    if len(value) < 19 or value[4] != '-' or value[7] != '-' or \
+            value[10] not in 'T ' or value[13] != ':' or value[16] != ':':
+        raise ValueError(value)
+    tz_str = value[19:]
+    if tz_str[:1] in ('.', ','):
+        tz_str = tz_str[1:].lstrip('0123456789')
+    year, month, day = int(value[:4]), int(value[5:7]), int(value[8:10])
+    secs = int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+    if not tz_str:
+        return int(time.mktime(
+            (year, month, day, 0, 0, secs, 0, 0, -1)))
+
+    return utc_day_start(days, value[:10], year, month, day) + secs - \
+        parse_tz_offset(tz_str)
+
+
+def parse_syslog(value, _):
+    '''Parses syslog (RFC 3164) local time (Oct 17 10:00:00, the most
+    recent past year is assumed)
+    '''
+    if len(value) != 15 or value[3] != ' ' or value[9] != ':' or \
+            value[12] != ':':
+        raise ValueError(value)
+    tm_tuple = [
+        time.localtime().tm_year, MONTHS[value[:3]], int(value[4:6]),
+        int(value[7:9]), int(value[10:12]), int(value[13:15]), 0, 0, -1]
+    tstamp = time.mktime(tuple(tm_tuple))
+    if tstamp > time.time() + 86400:
+        tm_tuple[0] -= 1
+        tstamp = time.mktime(tuple(tm_tuple))
+
+    return int(tstamp)
+
+
+def parse_nginx_error(value, _):
+    '''Parses nginx error log local time (2026/10/17 10:00:00)
+    '''
+    if len(value) != 19 or value[4] != '/' or value[7] != '/' or \
+            value[13] != ':':
+        raise ValueError(value)
+
+    return int(time.mktime((
+        int(value[:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]),
+        int(value[14:16]), int(value[17:19]), 0, 0, -1)))
+
+
+TIME_FORMATS = OrderedDict([
+    ('time_local', parse_time_local),
+    ('iso8601', parse_iso8601),
+    ('syslog', parse_syslog),
+    ('nginx_error', parse_nginx_error),
+])
+
+
+class TimeDecoder(object):
+    '''Decodes timestamps of a fixed (or detected) format by slicing them
+    at fixed offsets; the last decoded (seconds' level) value is memoized as
+    consecutive log lines usually share it. Falls back to dateutil.
+    '''
+
+    def __init__(self, time_format='auto'):
+        if time_format == 'auto':
+            self.formats = list(TIME_FORMATS)
+        elif time_format in TIME_FORMATS:
+            self.formats = [time_format]
+        else:
+            raise ValueError('Unknown time format: %s' % repr(time_format))
+        self._last = (None, None)
+        self._days = {}
+        self.fallbacks = 0
+
+
+    def __call__(self, value):
+        last_value, last_tstamp = self._last
+        if value == last_value:
+            return last_tstamp
+
+        # bytes values are memoized as such, decoded on a miss only
+        str_value = value
+        if isinstance(value, bytes):
+            str_value = str(value, encoding='utf-8', errors='replace')
+        for idx, format_name in enumerate(self.formats):
+            try:
+                tstamp = TIME_FORMATS[format_name](str_value, self._days)
+            except (KeyError, ValueError, OverflowError):
+                continue
+            if idx:
+                # the detected format is tried first from now on
+                self.formats.insert(0, self.formats.pop(idx))
+            break
+        else:
+            self.fallbacks += 1
+            tstamp = parse_time(str_value)
+
+        self._last = (value, tstamp)
+        return tstamp
+
+
+DEFAULT_TIME_DECODER = TimeDecoder()
+
+
+def decode_time(value):
+    '''Decodes time representation
+    '''
+    return DEFAULT_TIME_DECODER(value)
+
+
+class RouteNode(object):
+    '''Route trie node
+    '''
+    __slots__ = ('children', 'param', 'label', 'rest')
+
+    def __init__(self):
+        # literal segment -> node, placeholder (any segment) node
+        self.children = {}
+        self.param = None
+        # labels of the route ending here / of the route matching any rest
+        self.label = None
+        self.rest = None
+
+
+def route_label(segments):
+    '''Returns default label of a route (its segments, placeholders' names
+    joined with underscores)
+    '''
+    label = '_'.join(
+        segment.strip('<>') for segment in segments if segment != '*')
+
+    return label.replace('.', '_') or 'root'
+
+
+class UriClassifier(object):
+    '''Classifies URIs by a route table compiled into a prefix trie: route
+    segments are literals, `<name>` placeholders (matching any segment) or
+    a trailing `*` (matching any rest); literals take precedence. Labels of
+    URIs' paths are memoized in a bounded (LRU) cache.
+    '''
+
+    def __init__(self, routes, cache_size=4096, default='_other'):
+        self.root = RouteNode()
+        self.routes = 0
+        self.default = default
+        self.cache = NameCache(cache_size)
+        for route in routes:
+            if not route.strip():
+                continue
+            route, _, label = route.partition('=')
+            self.add_route(route.strip(), label.strip() or None)
+
+
+    def add_route(self, route, label=None):
+        '''Adds route (e.g. `/api/v2/users/<id>`) with its label (derived
+        from the route by default)
+        '''
+        segments = [segment for segment in route.split('/') if segment]
+        if label is None:
+            label = route_label(segments)
+        node = self.root
+        for idx, segment in enumerate(segments):
+            if segment == '*':
+                if idx + 1 != len(segments):
+                    raise ValueError('Not a trailing `*`: %s' % repr(route))
+                node.rest = label
+                break
+            if segment.startswith('<') and segment.endswith('>'):
+                if node.param is None:
+                    node.param = RouteNode()
+                node = node.param
+            else:
+                node = node.children.setdefault(segment, RouteNode())
+        else:
+            node.label = label
+        self.routes += 1
+
+
+    def match(self, node, segments, idx=0):
+        '''Returns label of the route matching segments (from idx) or None
+        '''
+        if idx == len(segments):
+            return node.label or node.rest
+
+        child = node.children.get(segments[idx])
+        if child is not None:
+            label = self.match(child, segments, idx + 1)
+            if label is not None:
+                return label
+        if node.param is not None:
+            label = self.match(node.param, segments, idx + 1)
+            if label is not None:
+                return label
+
+        return node.rest
+
+
+    def __call__(self, uri):
+        path = uri.partition('?')[0]
+        label = self.cache.get(path)
+        if label is None:
+            label = self.match(
+                self.root, [segment for segment in path.split('/') if segment])
+            label = self.cache.put(path, label or self.default)
+
+        return label
+
+
+    def stats(self):
+        '''Returns classifier counters
+        '''
+        stats = self.cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        stats['routes'] = self.routes
+
+        return stats
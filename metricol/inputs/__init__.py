@@ -11,10 +11,12 @@ from __future__ import (
     with_statement,
 )
 
+import asyncio
 import logging
 import time
 
-from metricol.commons import ManageableThread
+from metricol.channels import MetricBatch
+from metricol.commons import ManageableThread, NameCache
 
 
 LOG = logging.getLogger(__name__)
@@ -37,6 +39,7 @@ class MetricInput(ManageableThread):
         self.queue = queue
         self.cfg = {}
         self.data_parser = lambda data: data
+        self.names = NameCache()
         super(MetricInput, self).__init__(name=self._section.name)
 
 
@@ -44,6 +47,8 @@ class MetricInput(ManageableThread):
         for field in self.options:
             self.cfg[field] = self._section.get(field)
         self.period = int(self._section.get('period', self.period))
+        self.names.maxsize = int(
+            self._section.get('name_cache_size', self.names.maxsize))
         for field in ['absolute_keys', 'counter_keys', 'kv_keys', 'timer_keys']:
             if field not in self._section:
                 continue
@@ -51,8 +56,8 @@ class MetricInput(ManageableThread):
                 self, field, [_key.strip() for _key in self._section[field].split(',')])
 
 
-    def do_things(self):
-        self.get_metrics()
+    def do_things(self, tstamp=None):
+        self.get_metrics(tstamp)
 
 
     def stop_things(self):
@@ -74,17 +79,59 @@ class MetricInput(ManageableThread):
         return self.data_parser(data)
 
 
+    def metric_name(self, *parts):
+        '''Returns (cached) prefixed metric name built from its parts
+        '''
+        name = self.names.get(parts)
+        if name is None:
+            name = self.names.put(parts, self.cfg['prefix'] + '.'.join(
+                str(part) for part in parts).replace(' ', '_'))
+
+        return name
+
+
     def iter_metrics(self, key, val, now_ts):
         '''Generates metrics
         '''
         raise NotImplementedError
 
 
-    def get_metrics(self):
+    def get_metrics(self, now_ts=None):
         '''Returns a list of metrics
         '''
-        now_ts = time.time()
-        data = self.fetch_data()
+        if now_ts is None:
+            now_ts = time.time()
+        self.put_metrics(self.fetch_data(), now_ts)
+
+
+    async def async_fetch_data(self):
+        '''Fetches data from service without blocking the event loop
+        (by default runs `fetch_data` in the loop's executor)
+        '''
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.fetch_data)
+
+
+    async def async_get_metrics(self, now_ts):
+        '''Fetches (asynchronously) and publishes metrics (from the loop's
+        executor, so a full channel blocks a worker thread, not the loop)
+        '''
+        batch = self.make_batch(await self.async_fetch_data(), now_ts)
+        await asyncio.get_event_loop().run_in_executor(
+            None, self.queue.put, batch)
+
+
+    def make_batch(self, data, now_ts):
+        '''Parses fetched data into metrics batch
+        '''
+        batch = MetricBatch(now_ts)
         for key, val in self.parse_data(data).items():
-            for metric_data in self.iter_metrics(key, val, now_ts):
-                self.queue.put(metric_data)
+            batch.extend(self.iter_metrics(key, val, now_ts))
+
+        return batch
+
+
+    def put_metrics(self, data, now_ts):
+        '''Parses fetched data and publishes metrics batch
+        '''
+        self.queue.put(self.make_batch(data, now_ts))
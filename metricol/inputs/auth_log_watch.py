@@ -23,6 +23,9 @@ LOG = logging.getLogger(__name__)
 class AuthLogWatch(LogWatch):
     '''Auth logs watcher
     '''
+    # sessions are counted across lines
+    parallel_parsing = False
+
     def __init__(self, section, queue):
         super(AuthLogWatch, self).__init__(section, queue)
         self.prev_values = {}
@@ -46,9 +49,10 @@ class AuthLogWatch(LogWatch):
                 cnt = 0
             self.prev_values[user] = cnt
             yield (
-                self.cfg['prefix'] + user, cnt, MetricInput.METRIC_TYPE_GAUGE, tstamp)
+                self.metric_name(user), cnt, MetricInput.METRIC_TYPE_GAUGE,
+                tstamp)
         else:
             # attempts
             yield (
-                self.cfg['prefix'] + val['method'] + '.' + user, 1,
+                self.metric_name(val['method'], user), 1,
                 MetricInput.METRIC_TYPE_COUNTER, tstamp)
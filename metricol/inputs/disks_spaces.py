@@ -80,4 +80,5 @@ class DisksSpaces(MetricInput):
 
 
     def iter_metrics(self, key, val, tstamp):
-        yield (self.cfg['prefix'] + key, val, MetricInput.METRIC_TYPE_GAUGE, tstamp)
+        yield (
+            self.metric_name(key), val, MetricInput.METRIC_TYPE_GAUGE, tstamp)
@@ -62,5 +62,5 @@ class LoadInfo(MetricInput):
 
     def iter_metrics(self, key, val, tstamp):
         yield (
-            self.cfg['prefix'] + key, val, MetricInput.METRIC_TYPE_GAUGE,
+            self.metric_name(key), val, MetricInput.METRIC_TYPE_GAUGE,
             tstamp)
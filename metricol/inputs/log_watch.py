@@ -11,90 +11,315 @@ from __future__ import (
     with_statement,
 )
 
+import configparser
+import functools
+import inspect
 import logging
+import multiprocessing
 import re
-import select
-import shlex
-import subprocess
+import time
+from collections import deque
 
-from metricol.commons import get_method_by_path
+from metricol.aggregation import TimerFold, TimerSketch, WindowAggregator
+from metricol.cardinality import CardinalityLimiter
+from metricol.channels import MetricBatch
+from metricol.commons import (
+    get_method_by_path, register_stats, TimeDecoder, UriClassifier)
 from metricol.inputs import MetricInput
+from metricol.tailer import LogFollower, split_chunks, split_lines
 
 
 LOG = logging.getLogger(__name__)
 
+# parser plugin instance of a parsing worker process
+PARSER = None
+
+
+def init_parser(plug_cls, section_name, section_items):
+    '''Initializes parsing worker process
+    '''
+    global PARSER  # pylint: disable=global-statement
+    cfg = configparser.ConfigParser(interpolation=None, strict=False)
+    cfg.read_dict({section_name: section_items})
+    PARSER = plug_cls(cfg[section_name], None)
+    PARSER.prepare_parser()
+    if PARSER.kv_limiters:
+        # kv_keys' values are limited by the parent (see: limit_parsed)
+        PARSER.kv_limiters = {}
+        PARSER.kv_names = {}
+
+
+def parse_chunk(chunk, label_parts=()):
+    '''Parses chunk of lines in a worker process, returns its partial
+    aggregates: windows, the newest time, number of points, kv_keys' metric
+    names (when limited) and parser's counters
+    '''
+    aggregator = PARSER.new_aggregator()
+    PARSER.label_parts = label_parts
+    if PARSER.kv_names is not None:
+        PARSER.kv_names = {}
+    for key, (tstamp, val) in PARSER.parse_data([chunk]):
+        aggregator.extend(PARSER.iter_metrics(key, val, tstamp), 0.0)
+
+    return (
+        aggregator.windows, aggregator.max_ts,
+        aggregator.stats()['points_in'], PARSER.kv_names,
+        PARSER.take_counters())
+
 
 class LogWatch(MetricInput):
     '''Logs watcher
     '''
     options = ['log_fpath', 'parser', 'pattern', 'method', 'prefix']
-    TAIL_CMD_FMT = '/usr/bin/tail --follow=name --quiet --retry %s'
+    WAIT_SECS = 0.1
+    # lines can be parsed (and aggregated) independently in worker processes
+    parallel_parsing = True
 
     def __init__(self, section, queue):
         super(LogWatch, self).__init__(section, queue)
-        self.sel_poll = select.poll()
-        self.proc = None
+        self.follower = None
+        # metric name parts of the file being parsed (its label) and labels
+        # of files read without the follower (replayed)
+        self.label_parts = ()
+        self.file_labels = {}
+        self.time_decoder = None
+        self.uri_classifier = None
+        # the largest URI cache of parsing workers
+        self.workers_cache_size = 0
+        self.kv_limiters = {}
+        # kv_keys' metric names -> (label parts, field, value), recorded
+        # by parsing workers
+        self.kv_names = None
+        self.aggregator = None
+        # (the newest event time, read positions) after each read
+        self.read_positions = deque()
+        self.checkpoint_secs = 1.0
+        self.pool = None
+        # (async result of parsed chunk, read positions after it) in read
+        # order
+        self.parsing = deque()
+        self.chunk_bytes = 1024 * 1024
+        self.max_parsing = 0
 
 
-    def prepare_things(self):
-        super(LogWatch, self).prepare_things()
-        cmd = self.TAIL_CMD_FMT % self.cfg['log_fpath']
-        pattern = re.compile(self.cfg['pattern'])
-        pattern_fn = getattr(pattern, self.cfg['method'])
+    def prepare_parser(self):
+        '''Prepares lines' parser
+        '''
+        MetricInput.prepare_things(self)
         parse_log_lines = get_method_by_path(self.cfg['parser'])
-        self.data_parser = lambda lines: parse_log_lines(
-            lines, pattern_fn)
-
-        try:
-            self.proc = subprocess.Popen(
-                shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                shell=False, close_fds=False)
-            self.sel_poll.register(
-                self.proc.stdout, select.POLLIN | select.POLLPRI)
-            self.sel_poll.register(
-                self.proc.stderr, select.POLLIN | select.POLLPRI)
-        except OSError as exc:
-            LOG.error('%s @ %s', repr(exc), repr(cmd))
-
-
-    def stop_things(self):
-        super(LogWatch, self).stop_things()
-        if not self.proc:
+        parser_kwargs = {}
+        parser_params = inspect.signature(parse_log_lines).parameters
+        if 'decode_time' in parser_params:
+            self.time_decoder = TimeDecoder(
+                self._section.get('time_format', 'auto'))
+            parser_kwargs['decode_time'] = self.time_decoder
+        if 'log_format' in parser_params and self._section.get('log_format'):
+            parser_kwargs['log_format'] = self._section['log_format']
+        if 'classify_uri' in parser_params and self._section.get('uri_routes'):
+            self.uri_classifier = UriClassifier(
+                self._section['uri_routes'].replace('\n', ',').split(','),
+                cache_size=int(self._section.get('uri_cache_size', 4096)))
+            parser_kwargs['classify_uri'] = self.uri_classifier
+        if self._section.getboolean('bytes_pattern', False):
+            # lines are matched as bytes, only matched groups get decoded
+            pattern = re.compile(bytes(self.cfg['pattern'], encoding='utf-8'))
+            pattern_fn = getattr(pattern, self.cfg['method'])
+            self.data_parser = lambda blocks: parse_log_lines(
+                split_lines(blocks), pattern_fn, **parser_kwargs)
+        else:
+            pattern = re.compile(self.cfg['pattern'])
+            pattern_fn = getattr(pattern, self.cfg['method'])
+            self.data_parser = lambda blocks: parse_log_lines((
+                str(line, encoding='utf-8', errors='replace')
+                for line in split_lines(blocks)), pattern_fn, **parser_kwargs)
+        self.prepare_limiters()
+
+
+    def prepare_limiters(self):
+        '''Prepares kv_keys' values cardinality limiters (if configured)
+        '''
+        max_values = int(self._section.get('kv_max_values', 0))
+        if max_values <= 0:
             return
 
-        self.proc.kill()
-        self.sel_poll.unregister(self.proc.stdout)
-        self.sel_poll.unregister(self.proc.stderr)
+        for field in self.kv_keys:
+            self.kv_limiters[field] = CardinalityLimiter(
+                max_values,
+                tracked=int(self._section.get('kv_tracked_values', 0)),
+                min_count=int(self._section.get('kv_min_count', 2)),
+                decay_secs=float(self._section.get('kv_decay_secs', 600.0)))
+
+
+    def take_counters(self):
+        '''Returns time decoder's and URI classifier's counters since the
+        last call (reported by parsing workers)
+        '''
+        counters = {}
+        if self.time_decoder:
+            counters['time_fallbacks'] = self.time_decoder.fallbacks
+            self.time_decoder.fallbacks = 0
+        if self.uri_classifier:
+            cache = self.uri_classifier.cache
+            counters.update({
+                'uri_cache.size': len(cache),
+                'uri_cache.hits': cache.hits,
+                'uri_cache.misses': cache.misses,
+                'uri_cache.evictions': cache.evictions,
+            })
+            cache.hits = cache.misses = cache.evictions = 0
+
+        return counters
+
+
+    def add_counters(self, counters):
+        '''Adds parsing worker's counters (see: take_counters) to own ones
+        '''
+        if self.time_decoder:
+            self.time_decoder.fallbacks += counters.get('time_fallbacks', 0)
+        if self.uri_classifier:
+            cache = self.uri_classifier.cache
+            cache.hits += counters.get('uri_cache.hits', 0)
+            cache.misses += counters.get('uri_cache.misses', 0)
+            cache.evictions += counters.get('uri_cache.evictions', 0)
+            self.workers_cache_size = max(
+                self.workers_cache_size, counters.get('uri_cache.size', 0))
+
+
+    def decay_limiters(self, now_ts):
+        '''Lets limiters re-elect their values (when due)
+        '''
+        for limiter in self.kv_limiters.values():
+            limiter.decay(now_ts)
+
+
+    def new_aggregator(self):
+        '''Returns windowed aggregator (or None when not configured)
+        '''
+        aggregate_secs = int(self._section.get('aggregate_secs', 0))
+        if aggregate_secs <= 0:
+            return None
+
+        timer_fold = TimerFold
+        percentiles = self._section.get('timer_percentiles', '50,90,99')
+        if percentiles.strip():
+            timer_fold = functools.partial(
+                TimerSketch,
+                sorted(float(val) for val in percentiles.split(',')),
+                float(self._section.get('timer_accuracy', 0.01)))
+
+        return WindowAggregator(
+            aggregate_secs,
+            delay_secs=float(self._section.get('aggregate_delay', 2.0)),
+            late_secs=float(self._section.get('aggregate_late_secs', 300.0)),
+            timer_fold=timer_fold)
+
+
+    def prepare_pool(self):
+        '''Starts parsing worker processes (if configured)
+        '''
+        workers = int(self._section.get('parse_workers', 0))
+        if workers <= 0:
+            return
+        if not self.aggregator or not self.parallel_parsing:
+            LOG.warning(
+                '%s: parse_workers needs (stateless) aggregation, ignored',
+                self.getName())
+            return
+
+        self.chunk_bytes = int(
+            self._section.get('parse_chunk_bytes', self.chunk_bytes))
+        self.max_parsing = 4 * workers
+        self.pool = multiprocessing.get_context('spawn').Pool(
+            workers, init_parser, (
+                type(self), self._section.name,
+                dict(self._section.parser.items(self._section.name))))
+
+
+    def prepare_things(self):
+        self.prepare_parser()
+        self.checkpoint_secs = float(
+            self._section.get('checkpoint_secs', self.checkpoint_secs))
+        self.follower = LogFollower(
+            [fpath.strip() for fpath in self.cfg['log_fpath'].split(',')],
+            checkpoint_dir=self._section.get('checkpoint_dir'),
+            name=self.getName(),
+            start_at_end=self._section.getboolean('start_at_end', True),
+            use_inotify=self._section.getboolean('inotify', True),
+            scan_secs=float(self._section.get('scan_secs', 1.0)),
+            block_size=int(self._section.get('read_block_size', 1024 * 1024)),
+            max_read_bytes=int(
+                self._section.get('max_read_bytes', 16 * 1024 * 1024)))
+        self.follower.open()
+        self.aggregator = self.new_aggregator()
+        self.prepare_pool()
+        register_stats('log_watch.' + self.getName().split(':', 1)[-1],
+                       self.stats)
+
+
+    def stats(self):
+        '''Returns watcher counters
+        '''
+        stats = self.follower.stats()
+        if self.time_decoder:
+            stats['time_fallbacks'] = self.time_decoder.fallbacks
+        if self.uri_classifier:
+            for key, val in self.uri_classifier.stats().items():
+                stats['uri_cache.' + key] = val
+            if self.pool:
+                stats['uri_cache.size'] = self.workers_cache_size
+        if self.aggregator:
+            for key, val in self.aggregator.stats().items():
+                stats['aggregator.' + key] = val
+        for field, limiter in self.kv_limiters.items():
+            for key, val in limiter.stats().items():
+                stats['kv_limiter.%s.%s' % (field, key)] = val
+
+        return stats
 
 
     def fetch_data(self):
-        fetched_data = []
-        for fileno, _ in self.sel_poll.poll(100):
-            if fileno == self.proc.stdout.fileno():
-                line = str(self.proc.stdout.readline().strip(), encoding='utf-8')
-                if line:
-                    fetched_data.append(line)
-            elif fileno == self.proc.stderr.fileno():
-                line = self.proc.stderr.readline().strip()
-                if line:
-                    LOG.warning('ERR: %s', repr(line))
+        return self.follower.read_files(self.WAIT_SECS)
+
+
+    def file_label(self, fpath):
+        '''Returns metric name parts of file's label (derived from its name
+        when matched by a glob pattern)
+        '''
+        label = self.file_labels.get(fpath)
+        if label is None and self.follower:
+            label = self.follower.label(fpath)
+        if label is None:
+            return ()
 
-        return fetched_data
+        return (label,)
+
+
+    def metric_name(self, *parts):
+        if self.label_parts:
+            parts = self.label_parts + parts
+
+        return super(LogWatch, self).metric_name(*parts)
 
 
     def iter_metrics(self, _, val, tstamp):
         metric_data_dc = {}
         for _key, _val in val.items():
-            key = _key
             metric_type = MetricInput.METRIC_TYPE_GAUGE
-            if _key in self.counter_keys:
-                metric_type = MetricInput.METRIC_TYPE_COUNTER
-            elif _key in self.kv_keys:
+            if _key in self.kv_keys:
                 metric_type = MetricInput.METRIC_TYPE_COUNTER
-                key += '.' + _val
+                limiter = self.kv_limiters.get(_key)
+                if limiter:
+                    _val = limiter.limit(_val)
+                key = self.metric_name(_key, _val)
+                if self.kv_names is not None:
+                    self.kv_names[key] = (self.label_parts, _key, _val)
                 _val = 1
-            elif _key in self.timer_keys:
-                metric_type = MetricInput.METRIC_TYPE_TIMER
+            else:
+                key = self.metric_name(_key)
+                if _key in self.counter_keys:
+                    metric_type = MetricInput.METRIC_TYPE_COUNTER
+                elif _key in self.timer_keys:
+                    metric_type = MetricInput.METRIC_TYPE_TIMER
 
             md_key = (key, metric_type)
             if md_key in metric_data_dc:
@@ -106,13 +331,136 @@ class LogWatch(MetricInput):
                 metric_data_dc[md_key] = _val
 
         for (_key, metric_type), _val in metric_data_dc.items():
-            yield (self.cfg['prefix'] + _key, _val, metric_type, tstamp)
+            yield (_key, _val, metric_type, tstamp)
 
 
-    def get_metrics(self):
+    def get_metrics(self, now_ts=None):
         '''Returns a list of metrics
         '''
         data = self.fetch_data()
-        for key, (now_ts, val) in self.parse_data(data):
-            for metric_data in self.iter_metrics(key, val, now_ts):
-                self.queue.put(metric_data)
+        self.decay_limiters(time.time())
+        self.publish_data(data)
+
+
+    def publish_data(self, data):
+        '''Parses (path, blocks) pairs of read lines, publishes their metrics
+        (aggregated when configured)
+        '''
+        if self.aggregator:
+            self.aggregate_metrics(data)
+            return
+
+        batches = {}
+        for fpath, blocks in data:
+            self.label_parts = self.file_label(fpath)
+            for key, (now_ts, val) in self.parse_data(blocks):
+                batch = batches.get(now_ts)
+                if batch is None:
+                    batch = batches[now_ts] = MetricBatch(now_ts)
+                batch.extend(self.iter_metrics(key, val, now_ts))
+        for batch in batches.values():
+            self.queue.put(batch)
+        # lines are checkpointed only once their metrics are published
+        if self.follower:
+            self.follower.save_checkpoints(self.checkpoint_secs)
+
+
+    def aggregate_metrics(self, data, force=False):
+        '''Aggregates metrics per window, publishes closed windows' batches
+        '''
+        aggregator = self.aggregator
+        if self.pool:
+            self.merge_parsed(data, wait=force)
+        elif data:
+            now_ts = time.time()
+            for fpath, blocks in data:
+                self.label_parts = self.file_label(fpath)
+                for key, (tstamp, val) in self.parse_data(blocks):
+                    aggregator.extend(
+                        self.iter_metrics(key, val, tstamp), now_ts)
+            if self.follower:
+                self.read_positions.append(
+                    (aggregator.max_ts, self.follower.positions()))
+        for batch in aggregator.flush(time.time(), force):
+            self.queue.put(batch)
+        if not self.follower:
+            return
+
+        # lines are checkpointed only once their windows are published
+        positions = None
+        if aggregator.windows or self.parsing:
+            while self.read_positions and \
+                    self.read_positions[0][0] < aggregator.closed_until:
+                positions = self.read_positions.popleft()[1]
+            if positions is None:
+                return
+        else:
+            self.read_positions.clear()
+        self.follower.save_checkpoints(self.checkpoint_secs, positions)
+
+
+    def merge_parsed(self, data, wait=False):
+        '''Sends read lines to parsing workers (in chunks), merges their
+        partial aggregates (in read order)
+        '''
+        if data:
+            results = []
+            for fpath, blocks in data:
+                label_parts = self.file_label(fpath)
+                for chunk in split_chunks(blocks, self.chunk_bytes):
+                    results.append(self.pool.apply_async(
+                        parse_chunk, (chunk, label_parts)))
+            for result in results[:-1]:
+                self.parsing.append((result, None))
+            self.parsing.append((
+                results[-1], self.follower and self.follower.positions()))
+
+        while self.parsing:
+            result, positions = self.parsing[0]
+            if not wait and not result.ready() and \
+                    len(self.parsing) <= self.max_parsing:
+                break
+            self.parsing.popleft()
+            try:
+                windows, max_ts, points, kv_names, counters = result.get()
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.error('%s @ %s', repr(exc), self.getName())
+            else:
+                self.add_counters(counters)
+                if kv_names:
+                    self.limit_parsed(windows, kv_names)
+                self.aggregator.merge(windows, max_ts, points, time.time())
+            if positions:
+                self.read_positions.append((self.aggregator.max_ts, positions))
+
+
+    def limit_parsed(self, windows, kv_names):
+        '''Applies kv_keys' limiters to workers' partial aggregates (so the
+        limits hold across all the workers)
+        '''
+        label_parts = self.label_parts
+        for window_ts in sorted(windows):
+            counters = windows[window_ts][0]
+            for key in [key for key in counters if key in kv_names]:
+                self.label_parts, field, value = kv_names[key]
+                limiter = self.kv_limiters.get(field)
+                if limiter is None:
+                    continue
+                limited = limiter.limit(value, int(counters[key]))
+                if limited != value:
+                    other_key = self.metric_name(field, limited)
+                    counters[other_key] = \
+                        counters.get(other_key, 0) + counters.pop(key)
+        self.label_parts = label_parts
+
+
+    def run(self):
+        super(LogWatch, self).run()
+        if self.aggregator:
+            self.aggregate_metrics(None, force=True)
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+        if self.follower:
+            self.follower.save_checkpoints()
+            self.follower.close()
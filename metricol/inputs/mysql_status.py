@@ -13,6 +13,7 @@ from __future__ import (
 
 import logging
 import re
+import threading
 
 from mysql.connector import connect, Error
 
@@ -21,72 +22,193 @@ from metricol.inputs import MetricInput
 
 LOG = logging.getLogger(__name__)
 
-STATUS_QUERY = 'SELECT * FROM `information_schema`.`global_status`'
-METRICS_RE = re.compile(
-    r'(ABORTED|BYTES|COM|CREATED|DELAYED|HANDLER|INNODB_BUFFER_POOL|INNODB_DATA'
-    r'|INNODB_LOG|INNODB_OS_LOG|INNODB_PAGES|INNODB_ROW_LOCK|INNODB_ROWS|KEY'
-    r'|OPEN|OPENED|QCACHE|SELECT|SLOW|SORT|TABLE_LOCKS|THREADS)_|CONNECTIONS'
-    r'|MAX_USED_CONNECTIONS|NOT_FLUSHED_DELAYED_ROWS|QUERIES|QUESTIONS')
+STATUS_TABLE = '`information_schema`.`global_status`'
+# status variables' families (name prefixes) and single variables
+METRIC_FAMILIES = [
+    'ABORTED', 'BYTES', 'COM', 'CREATED', 'DELAYED', 'HANDLER',
+    'INNODB_BUFFER_POOL', 'INNODB_DATA', 'INNODB_LOG', 'INNODB_OS_LOG',
+    'INNODB_PAGES', 'INNODB_ROW_LOCK', 'INNODB_ROWS', 'KEY', 'OPEN', 'OPENED',
+    'QCACHE', 'SELECT', 'SLOW', 'SORT', 'TABLE_LOCKS', 'THREADS',
+]
+METRIC_VARIABLES = [
+    'CONNECTIONS', 'MAX_USED_CONNECTIONS', 'NOT_FLUSHED_DELAYED_ROWS',
+    'QUERIES', 'QUESTIONS',
+]
+NAME_RE = re.compile(r'^[A-Z][A-Z0-9_]*$')
+
+
+def status_query(families, variables):
+    '''Returns status query selecting (server-side) only variables of
+    families and the single ones
+    '''
+    for name in families + variables:
+        if not NAME_RE.match(name):
+            raise ValueError('Invalid status variable: %s' % repr(name))
+    conditions = [
+        'VARIABLE_NAME LIKE \'%s!_%%\' ESCAPE \'!\'' % family.replace('_', '!_')
+        for family in families]
+    if variables:
+        conditions.append('VARIABLE_NAME IN (%s)' % ', '.join(
+            '\'%s\'' % name for name in variables))
+
+    return 'SELECT VARIABLE_NAME, VARIABLE_VALUE FROM %s WHERE %s' % (
+        STATUS_TABLE, ' OR '.join(conditions))
 
 
 class MysqlStatus(MetricInput):
     '''mysql status fetcher / parser class
+
+    Keeps one connection (reconnects after a failure, closes it when
+    stopped), status variables are filtered server-side.
     '''
     options = ['db_sock', 'db_host', 'db_port', 'db_user', 'db_pass', 'prefix']
 
     def __init__(self, section, queue):
         super(MysqlStatus, self).__init__(section, queue)
         self.prev_values = {}
+        self.conn = None
+        # guards the connection: stopping closes it from another thread
+        self._lock = threading.Lock()
+        self.families = METRIC_FAMILIES
+        self.query = status_query(METRIC_FAMILIES, METRIC_VARIABLES)
+        self.metrics_re = None
+        # status variable -> metric name ('' if skipped)
+        self.metric_names = {}
+
+
+    def prepare_things(self):
+        super(MysqlStatus, self).prepare_things()
+        if self._section.get('status_families'):
+            self.families = [
+                family.strip().upper()
+                for family in self._section['status_families'].split(',')]
+        self.query = status_query(self.families, METRIC_VARIABLES)
+        self.metrics_re = re.compile(
+            r'(%s)_|%s' % ('|'.join(self.families), '|'.join(METRIC_VARIABLES)))
+
+
+    def connect(self):
+        '''Opens connection
+        '''
+        db_sock = self.cfg['db_sock']
+        if db_sock:
+            conn = connect(
+                unix_socket=db_sock, user=self.cfg['db_user'],
+                use_unicode=True, get_warnings=True)
+        else:
+            conn = connect(
+                host=self.cfg['db_host'], port=self.cfg['db_port'],
+                user=self.cfg['db_user'], password=self.cfg['db_pass'],
+                use_unicode=True, get_warnings=True)
+        # status is read outside of (long) transactions
+        conn.autocommit = True
 
+        return conn
 
-    def fetch_data(self):
-        '''Fetches data from service
+
+    def stop_things(self):
+        super(MysqlStatus, self).stop_things()
+        self.close()
+
+
+    def close(self):
+        '''Closes connection
         '''
-        conn = cur = None
+        with self._lock:
+            self._close()
+
+
+    def _close(self):
+        '''Closes connection (lock held)
+        '''
+        if self.conn is None:
+            return
         try:
-            db_sock = self.cfg['db_sock']
-            if db_sock:
-                conn = connect(
-                    unix_socket=db_sock, user=self.cfg['db_user'],
-                    use_unicode=True, get_warnings=True)
-            else:
-                conn = connect(
-                    host=self.cfg['db_host'], port=self.cfg['db_port'],
-                    user=self.cfg['db_user'], password=self.cfg['db_pass'],
-                    use_unicode=True, get_warnings=True)
+            self.conn.close()
         except Error as exc:
-            LOG.warning('%s @ %s', repr(exc), repr(self.cfg))
-        else:
-            cur = conn.cursor()
-            cur.execute(STATUS_QUERY)
-            output = {}
-            for key, val in cur.fetchall():
-                try:
-                    output[key] = int(val) if val.isdigit() else float(val)
-                except ValueError:
-                    pass
-            return output
+            LOG.warning('%s @ %s', repr(exc), repr(self.cfg['prefix']))
+        self.conn = None
+
+
+    def query_status(self):
+        '''Runs status query (connects first, if not connected), returns its
+        rows
+        '''
+        if self.conn is None:
+            if not self.keep_running:
+                # stopped meanwhile, not to leave a new connection open
+                return None
+            self.conn = self.connect()
+        cur = self.conn.cursor()
+        try:
+            cur.execute(self.query)
+            return cur.fetchall()
         finally:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
+            cur.close()
 
 
-    def iter_metrics(self, key, val, tstamp):
-        match = METRICS_RE.match(key)
+    def fetch_data(self):
+        '''Fetches data from service
+        '''
+        rows = None
+        with self._lock:
+            for _ in range(2):
+                reused = self.conn is not None
+                try:
+                    rows = self.query_status()
+                    break
+                except Error as exc:
+                    LOG.warning(
+                        '%s @ %s', repr(exc), repr(self.cfg['prefix']))
+                    self._close()
+                    # kept connection could have been dropped: reconnect once
+                    if not reused:
+                        break
+        if rows is None:
+            return None
+
+        output = {}
+        for key, val in rows:
+            try:
+                output[key] = int(val) if val.isdigit() else float(val)
+            except ValueError:
+                pass
+        return output
+
+
+    def get_metric(self, key):
+        '''Returns (precomputed) metric name for status variable (or '' if
+        skipped)
+        '''
+        metric = self.metric_names.get(key)
+        if metric is not None:
+            return metric
+
+        name = key.upper()
+        match = self.metrics_re.match(name)
         if not match:
-            return
-        subkey = match.group(1)
-        if subkey is None:
-            metric = key.lower()
+            metric = ''
         else:
-            metric = subkey.lower() + '.' + key[len(subkey) + 1:].lower()
+            subkey = match.group(1)
+            if subkey is None:
+                metric = self.cfg['prefix'] + name.lower()
+            else:
+                metric = self.cfg['prefix'] + subkey.lower() + '.' + \
+                    name[len(subkey) + 1:].lower()
+        self.metric_names[key] = metric
+
+        return metric
+
+
+    def iter_metrics(self, key, val, tstamp):
+        metric = self.get_metric(key)
+        if not metric:
+            return
 
         prev_val = self.prev_values.get(metric)
         self.prev_values[metric] = val
         if prev_val is not None and val >= prev_val:
             val -= prev_val
             yield (
-                self.cfg['prefix'] + metric, val,
+                metric, val,
                 MetricInput.METRIC_TYPE_COUNTER, tstamp)
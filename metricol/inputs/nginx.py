@@ -16,6 +16,7 @@ import re
 
 from requests import codes, RequestException, Session
 
+from metricol.aio import FETCH_ERRORS, http_get
 from metricol.inputs import MetricInput
 
 
@@ -72,6 +73,18 @@ class NginxStatus(MetricInput):
         return ''
 
 
+    async def async_fetch_data(self):
+        try:
+            status, body = await http_get(
+                self.url, self.req_session.headers, timeout=self.period)
+            if status == codes['ok']:
+                return str(body, encoding='utf-8')
+        except FETCH_ERRORS as exc:
+            LOG.warning('%s @ %s', repr(exc), repr(self.url))
+
+        return ''
+
+
     def iter_metrics(self, key, val, tstamp):
         prev_val = val = int(val) if val.isdigit() else float(val)
         metric_type = MetricInput.METRIC_TYPE_GAUGE
@@ -83,4 +96,4 @@ class NginxStatus(MetricInput):
                 val -= prev_val
 
         if prev_val is not None:
-            yield (self.cfg['prefix'] + key, val, metric_type, tstamp)
+            yield (self.metric_name(key), val, metric_type, tstamp)
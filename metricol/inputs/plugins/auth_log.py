@@ -13,13 +13,13 @@ from __future__ import (
 
 import logging
 
-from metricol.commons import decode_time
+from metricol.commons import decode_time, match_groups
 
 
 LOG = logging.getLogger(__name__)
 
 
-def parse_log_lines(lines, pattern_fn):
+def parse_log_lines(lines, pattern_fn, decode_time=decode_time):
     '''Parses log line using pattern
     '''
     for idx, line in enumerate(lines):
@@ -27,13 +27,13 @@ def parse_log_lines(lines, pattern_fn):
         if not match:
             continue
 
-        data = match.groupdict()
+        data = match_groups(match)
         if 'time' in data:
             data['time'] = decode_time(data['time'])
         if 'user' in data:
             data['user'] = data['user'].replace('.', '_')
 
-        LOG.debug('DATA: %s', repr(data))
+        LOG.debug('DATA: %r', data)
 
         time = data.pop('time')
         if time:
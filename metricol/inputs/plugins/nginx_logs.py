@@ -11,13 +11,51 @@ from __future__ import (
     with_statement,
 )
 
+import functools
 import logging
+import re
 
-from metricol.commons import decode_time
+from metricol.commons import decode_time, match_groups
 
 
 LOG = logging.getLogger(__name__)
 
+INT_FIELDS = ['rbytes', 'bbytes', 'creqs']
+FLOAT_FIELDS = ['rtime', 'uctim', 'uhtim', 'urtim', 'gzip']
+# log_format variables -> fields (as named in the bundled patterns)
+VARIABLE_FIELDS = {
+    'time_local': 'time',
+    'time_iso8601': 'time',
+    'request_method': 'method',
+    'request_uri': 'uri',
+    'uri': 'uri',
+    'server_protocol': 'http',
+    'bytes_sent': 'rbytes',
+    'body_bytes_sent': 'bbytes',
+    'upstream_connect_time': 'uctim',
+    'upstream_header_time': 'uhtim',
+    'upstream_response_time': 'urtim',
+    'request_time': 'rtime',
+    'gzip_ratio': 'gzip',
+    'connection_requests': 'creqs',
+}
+FIXED_WIDTHS = {
+    'time_local': 26,
+    'time_iso8601': 25,
+}
+# numbers of spaces in variables' values
+SPACES = {
+    'time_local': 1,
+    'request': 2,
+}
+# prefixes of variables (free text) which may contain any number of spaces
+FREE_TEXT_PREFIXES = ('http_', 'sent_http_', 'cookie_', 'arg_', 'request_body')
+KNOWN_FIELDS = \
+    set(VARIABLE_FIELDS.values()) | set(['status', 'request', 'pipe'])
+VARIABLE_RE = re.compile(r'\$(?:\{(\w+)\}|(\w+))')
+(FIELD_STR, FIELD_INT, FIELD_FLOAT, FIELD_TIME, FIELD_REQUEST, FIELD_HTTP,
+ FIELD_URI, FIELD_PIPE) = range(8)
+
 
 def clean_uri(uri):
     '''Cleans URI
@@ -30,41 +68,307 @@ def clean_uri(uri):
     return '_other'
 
 
-def parse_log_lines(lines, pattern_fn):
-    '''Parses log line using pattern
+def field_kind(field):
+    '''Returns conversion kind of a field
     '''
-    for idx, line in enumerate(lines):
-        match = pattern_fn(line)
-        if not match:
-            continue
+    if field in INT_FIELDS:
+        return FIELD_INT
+    if field in FLOAT_FIELDS:
+        return FIELD_FLOAT
 
-        data = match.groupdict()
-        if 'time' in data:
-            data['time'] = decode_time(data['time'])
-        if 'uri' in data:
-            data['uri'] = clean_uri(data['uri'])
-        if 'http' in data:
-            data['http'] = data['http'].replace('.', '_')
+    return {
+        'time': FIELD_TIME,
+        'request': FIELD_REQUEST,
+        'http': FIELD_HTTP,
+        'uri': FIELD_URI,
+        'pipe': FIELD_PIPE,
+    }.get(field, FIELD_STR)
 
-        for field in ['rbytes', 'bbytes', 'creqs']:
-            if field not in data:
-                continue
-            data[field] = int(data[field])
 
-        for field in ['rtime', 'uctim', 'uhtim', 'urtim', 'gzip']:
-            if field not in data:
-                continue
-            if data[field] == '-':
-                del data[field]
+def literal(value, as_bytes):
+    '''Returns source code of a str (or bytes) literal
+    '''
+    return repr(bytes(value, encoding='utf-8') if as_bytes else value)
+
+
+def text(expr, as_bytes):
+    '''Returns source code of an expression's value as str
+    '''
+    if as_bytes:
+        return 'str(%s, \'utf-8\', \'replace\')' % expr
+
+    return expr
+
+
+def literal_size(value, as_bytes):
+    '''Returns size of a literal (in characters or bytes)
+    '''
+    return len(bytes(value, encoding='utf-8') if as_bytes else value)
+
+
+def request_code(as_bytes):
+    '''Returns source code lines converting request's method, uri and http
+    '''
+    return [
+        'if not http.startswith(%s):' % literal('HTTP/', as_bytes),
+        '    raise ValueError(line)',
+        'data[\'method\'] = %s' % text('method', as_bytes),
+        'data[\'uri\'] = clean_uri(%s)' % text('uri[1:]', as_bytes),
+        'data[\'http\'] = %s.replace(\'.\', \'_\')' % text(
+            'http[5:]', as_bytes),
+    ]
+
+
+def field_code(field, kind, value='value', as_bytes=False):
+    '''Returns source code lines converting (a variable holding) value of
+    a field
+    '''
+    if kind in (FIELD_FLOAT, FIELD_INT):
+        return [
+            'if %s != %s:' % (value, literal('-', as_bytes)),
+            '    data[%r] = %s(%s)' % (
+                field, 'float' if kind == FIELD_FLOAT else 'int', value)]
+    if kind == FIELD_TIME:
+        # TimeDecoder takes bytes values too (memoized before decoding)
+        return ['data[%r] = decode_time(%s)' % (field, value)]
+    if kind == FIELD_REQUEST:
+        return ['method, uri, http = %s.split(%s)' % (
+            value, literal(' ', as_bytes))] + request_code(as_bytes)
+    if kind == FIELD_HTTP:
+        return ['data[%r] = %s.replace(\'.\', \'_\')' % (
+            field, text(value + '[5:]', as_bytes))]
+    if kind == FIELD_URI:
+        return ['data[%r] = clean_uri(%s)' % (
+            field, text(value + '[1:]', as_bytes))]
+    if kind == FIELD_PIPE:
+        return [
+            'if %s == %s:' % (value, literal('p', as_bytes)),
+            '    data[%r] = \'p\'' % field]
+
+    return ['data[%r] = %s' % (field, text(value, as_bytes))]
+
+
+def parse_log_format(log_format):
+    '''Returns log_format's literals and variables (literals[i] precedes
+    variables[i], the last literal follows the last variable)
+    '''
+    parts = VARIABLE_RE.split(log_format)
+    literals = parts[0::3]
+    variables = [
+        braced or plain for braced, plain in zip(parts[1::3], parts[2::3])]
+
+    return literals, variables
+
+
+def split_tokens(literals, variables):
+    '''Returns space separated tokens of log_format (lists of literals
+    and variables) with numbers of line's tokens each one spans
+    '''
+    tokens = [[[], 1]]
+    for idx, literal in enumerate(literals):
+        for piece_idx, piece in enumerate(literal.split(' ')):
+            if piece_idx:
+                tokens.append([[], 1])
+            if piece:
+                tokens[-1][0].append(('', piece))
+        if idx < len(variables):
+            tokens[-1][0].append((variables[idx], None))
+            tokens[-1][1] += SPACES.get(variables[idx], 0)
+
+    return tokens
+
+
+def split_tokenizer_code(literals, variables, as_bytes=False):
+    '''Returns tokenizer's code splitting line at spaces (and its tokens
+    at separators), or None when log_format has free text variables
+    '''
+    for variable in variables:
+        if variable.startswith(FREE_TEXT_PREFIXES):
+            return None
+
+    tokens = split_tokens(literals, variables)
+    code = [
+        '    parts = line.split(%s)' % literal(' ', as_bytes),
+        '    if len(parts) != %d:' % sum(span for _, span in tokens),
+        '        raise ValueError(line)',
+        '    data = {}',
+    ]
+    pos = 0
+    for elements, span in tokens:
+        token_vars = [name for name, literal in elements if literal is None]
+        fields = [VARIABLE_FIELDS.get(name, name) for name in token_vars]
+        prefix = elements[0][1] if elements and elements[0][1] else ''
+        suffix = ''
+        if len(elements) > 1 and elements[-1][1]:
+            suffix = elements[-1][1]
+        prefix_size = literal_size(prefix, as_bytes)
+        suffix_size = literal_size(suffix, as_bytes)
+        inner = elements[int(bool(prefix)):len(elements) - int(bool(suffix))]
+        separators = set(literal for _, literal in inner if literal is not None)
+        if not any(field in KNOWN_FIELDS for field in fields):
+            pass
+        elif token_vars == ['request']:
+            code.extend([
+                '    method = parts[%d][%d:]' % (pos, prefix_size),
+                '    uri = parts[%d]' % (pos + 1),
+                '    http = parts[%d][:%d]' % (
+                    pos + 2, -suffix_size or 2 ** 16),
+            ])
+            code.extend('    ' + line for line in request_code(as_bytes))
+        elif len(separators) > 1 or 'request' in token_vars or \
+                (len(token_vars) > 1 and not separators):
+            return None
+        else:
+            token = 'parts[%d]' % pos
+            if span > 1:
+                token = '%s.join(parts[%d:%d])' % (
+                    literal(' ', as_bytes), pos, pos + span)
+            if prefix or suffix:
+                token = '%s[%d:%s]' % (
+                    token, prefix_size, -suffix_size if suffix else '')
+            if len(token_vars) == 1:
+                values = ['value']
+                code.append('    value = %s' % token)
             else:
-                data[field] = float(data[field])
+                values = ['value%d' % idx for idx in range(len(token_vars))]
+                code.append('    %s = %s.split(%s)' % (
+                    ', '.join(values), token,
+                    literal(separators.pop(), as_bytes)))
+            for value, field in zip(values, fields):
+                if field in KNOWN_FIELDS:
+                    code.extend('    ' + line for line in field_code(
+                        field, field_kind(field), value, as_bytes))
+        pos += span
+    code.append('    return data')
+
+    return code
+
+
+def index_tokenizer_code(literals, variables, as_bytes=False):
+    '''Returns tokenizer's code looking up literal separators (or fixed
+    widths of fields) one by one
+    '''
+    code = [
+        '    if not line.startswith(%s):' % literal(literals[0], as_bytes),
+        '        raise ValueError(line)',
+        '    data = {}',
+        '    pos = %d' % literal_size(literals[0], as_bytes),
+    ]
+    for idx, variable in enumerate(variables):
+        separator = literals[idx + 1]
+        width = FIXED_WIDTHS.get(variable, 0)
+        last = idx + 1 == len(variables)
+        if not separator and not width and not last:
+            raise ValueError('Variables not separated: %s' % repr(variables))
+        field = VARIABLE_FIELDS.get(variable, variable)
+        if width:
+            code.extend([
+                '    end = pos + %d' % width,
+                '    if not line.startswith(%s, end):' % literal(
+                    separator, as_bytes),
+                '        raise ValueError(line)'])
+        elif separator:
+            code.append('    end = line.index(%s, pos)' % literal(
+                separator, as_bytes))
+        else:
+            code.append('    end = len(line)')
+        if field in KNOWN_FIELDS:
+            code.append('    value = line[pos:end]')
+            code.extend('    ' + line for line in field_code(
+                field, field_kind(field), as_bytes=as_bytes))
+        if not last:
+            code.append(
+                '    pos = end + %d' % literal_size(separator, as_bytes))
+    code.append('    return data')
+
+    return code
+
+
+@functools.lru_cache(maxsize=16)
+def compile_log_format(log_format, as_bytes=False):
+    '''Compiles nginx `log_format` into a tokenizer: a function splitting
+    lines at spaces and separators (or at offsets of literal separators when
+    the format has free text variables) and converting fields to their types
+    directly (no regex); raises ValueError for malformed lines. Only fields
+    known to the metrics (see VARIABLE_FIELDS) are kept. Tokenizer compiled
+    `as_bytes` takes bytes lines and decodes only the kept text fields.
+    '''
+    literals, variables = parse_log_format(log_format)
+    code = split_tokenizer_code(literals, variables, as_bytes) or \
+        index_tokenizer_code(literals, variables, as_bytes)
+    code.insert(0, 'def tokenize(line, decode_time, clean_uri=clean_uri):')
+
+    namespace = {'clean_uri': clean_uri}
+    exec('\n'.join(code), namespace)  # pylint: disable=exec-used
+    tokenize = namespace['tokenize']
+    tokenize.source = '\n'.join(code)
+
+    return tokenize
 
-        if 'pipe' in data:
-            if data['pipe'] != 'p':
-                del data['pipe']
 
-        LOG.debug('DATA: %s', repr(data))
+def convert_fields(data, decode_time=decode_time, classify_uri=clean_uri):
+    '''Converts fields matched by pattern
+    '''
+    if 'time' in data:
+        data['time'] = decode_time(data['time'])
+    if 'uri' in data:
+        data['uri'] = classify_uri(data['uri'])
+    if 'http' in data:
+        data['http'] = data['http'].replace('.', '_')
+
+    for field in INT_FIELDS:
+        if field not in data:
+            continue
+        data[field] = int(data[field])
+
+    for field in FLOAT_FIELDS:
+        if field not in data:
+            continue
+        if data[field] == '-':
+            del data[field]
+        else:
+            data[field] = float(data[field])
+
+    if 'pipe' in data:
+        if data['pipe'] != 'p':
+            del data['pipe']
+
+    return data
+
+
+def parse_log_lines(lines, pattern_fn, decode_time=decode_time, log_format=None,
+                    classify_uri=clean_uri):
+    '''Parses log line using log_format tokenizer (when given) or pattern
+    (also for lines not matching the log_format); URIs are labelled with
+    classify_uri (e.g. commons.UriClassifier)
+    '''
+    tokenizer = bytes_tokenizer = None
+    if log_format:
+        tokenizer = compile_log_format(log_format)
+        bytes_tokenizer = compile_log_format(log_format, as_bytes=True)
+    debug = LOG.isEnabledFor(logging.DEBUG)
+    for idx, line in enumerate(lines):
+        data = None
+        if tokenizer:
+            try:
+                if isinstance(line, str):
+                    data = tokenizer(line, decode_time, classify_uri)
+                else:
+                    # bytes (or memoryview) lines are not decoded as whole
+                    data = bytes_tokenizer(
+                        bytes(line), decode_time, classify_uri)
+            except ValueError:
+                data = None
+        if data is None:
+            match = pattern_fn(line)
+            if not match:
+                continue
+            data = convert_fields(
+                match_groups(match), decode_time, classify_uri)
+
+        if debug:
+            LOG.debug('DATA: %r', data)
 
-        time = data.pop('time')
+        time = data.pop('time', None)
         if time:
             yield (idx, (time, data))
@@ -11,11 +11,14 @@ from __future__ import (
     with_statement,
 )
 
+import asyncio
 import logging
+import os
 import re
 
 import redis
 
+from metricol.aio import FETCH_ERRORS
 from metricol.inputs import MetricInput
 
 
@@ -69,47 +72,186 @@ METRICS_MAP = {
     'used_cpu_sys_children': 'cpu',
     'used_cpu_user_children': 'cpu',
 }
+# only INFO sections holding the metrics are requested
+INFO_SECTIONS = sorted(set(METRICS_MAP.values())) + ['keyspace']
+
+
+def info_command(section):
+    '''Returns encoded `INFO section` command
+    '''
+    section = bytes(section, encoding='ascii')
+    return b'*2\r\n$4\r\nINFO\r\n$%d\r\n%s\r\n' % (len(section), section)
+
+
+INFO_CMDS = b''.join(info_command(section) for section in INFO_SECTIONS)
+
+
+def get_value(value):
+    '''Converts INFO value to number (if possible)
+    '''
+    for conv in (int, float):
+        try:
+            return conv(value)
+        except ValueError:
+            pass
+
+    return value
+
+
+def parse_info(buf):
+    '''Parses INFO output
+    '''
+    info = {}
+    for line in buf.splitlines():
+        if not line or line.startswith('#') or ':' not in line:
+            continue
+        key, val = line.split(':', 1)
+        if KEYSPACE_RE.match(key):
+            info[key] = {
+                _key: get_value(_val)
+                for _key, _val in (_kv.split('=', 1) for _kv in val.split(','))}
+        else:
+            info[key] = get_value(val)
+
+    return info
+
+
+def socket_label(sock_path):
+    '''Returns metric name label of a socket (its file name without
+    extension)
+    '''
+    return os.path.splitext(os.path.basename(sock_path))[0].replace('.', '_')
 
 
 class RedisInfo(MetricInput):
     '''redis info fetcher / parser class
+
+    Polls one or more (comma separated) sockets over persistent connections,
+    INFO sections are requested in a pipeline; metrics of several sockets
+    are labelled by sockets' names.
     '''
     options = ['socket', 'prefix']
 
     def __init__(self, section, queue):
         super(RedisInfo, self).__init__(section, queue)
         self.prev_values = {}
+        self.timeout = 5.0
+        # socket path -> label, (pooled) client, asyncio streams
+        self.labels = {}
+        self.clients = {}
+        self.streams = {}
+
+
+    def prepare_things(self):
+        super(RedisInfo, self).prepare_things()
+        self.timeout = float(self._section.get('timeout', self.timeout))
+        sock_paths = [
+            sock_path.strip() for sock_path in self.cfg['socket'].split(',')]
+        for sock_path in sock_paths:
+            self.labels[sock_path] = \
+                socket_label(sock_path) if len(sock_paths) > 1 else None
+
+
+    def get_client(self, sock_path):
+        '''Returns (cached) socket's client, its connection is kept in
+        client's pool between polls
+        '''
+        cli = self.clients.get(sock_path)
+        if cli is None:
+            cli = self.clients[sock_path] = redis.StrictRedis(
+                unix_socket_path=sock_path, socket_timeout=self.timeout,
+                socket_connect_timeout=self.timeout)
+
+        return cli
 
 
     def fetch_data(self):
         '''Fetches data from service
         '''
-        sock_path = self.cfg['socket']
+        data = {}
+        for sock_path, label in self.labels.items():
+            try:
+                pipe = self.get_client(sock_path).pipeline(transaction=False)
+                for section in INFO_SECTIONS:
+                    pipe.info(section)
+                info = {}
+                for section_info in pipe.execute():
+                    info.update(section_info)
+            except redis.exceptions.RedisError as exc:
+                LOG.warning('%s @ %s', repr(exc), repr(sock_path))
+                continue
+            data[label] = info
+
+        return data
+
+
+    async def async_fetch_info(self, sock_path):
+        '''Fetches INFO sections (in a pipeline) over socket's persistent
+        connection
+        '''
+        streams = self.streams.get(sock_path)
+        if streams is None:
+            streams = self.streams[sock_path] = await asyncio.wait_for(
+                asyncio.open_unix_connection(sock_path), self.timeout)
+        reader, writer = streams
         try:
-            cli = redis.StrictRedis(unix_socket_path=sock_path)
-            return cli.info()
-        except redis.exceptions.RedisError as exc:
-            LOG.warning('%s @ %s', repr(exc), repr(sock_path))
+            writer.write(INFO_CMDS)
+            info = {}
+            for _ in INFO_SECTIONS:
+                header = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not header.startswith(b'$'):
+                    raise ValueError(header)
+                buf = await reader.readexactly(int(header[1:]) + 2)
+                info.update(parse_info(str(buf, encoding='utf-8')))
+        except FETCH_ERRORS:
+            del self.streams[sock_path]
+            writer.close()
+            raise
+
+        return info
+
+
+    async def async_fetch_data(self):
+        data = {}
+        for sock_path, label in self.labels.items():
+            try:
+                data[label] = await self.async_fetch_info(sock_path)
+            except FETCH_ERRORS as exc:
+                LOG.warning('%s @ %s', repr(exc), repr(sock_path))
+
+        return data
 
 
     def iter_metrics(self, key, val, tstamp):
+        # key: socket's label, val: its INFO
+        label_parts = (key,) if key else ()
+        for info_key, info_val in val.items():
+            for metric in self.iter_info_metrics(
+                    label_parts, info_key, info_val, tstamp):
+                yield metric
+
+
+    def iter_info_metrics(self, label_parts, key, val, tstamp):
+        '''Generates metrics of INFO key
+        '''
         match = KEYSPACE_RE.match(key)
         if match:
             for subkey in ['keys', 'expires', 'avg_ttl']:
                 yield (
-                    self.cfg['prefix'] + 'keyspace.' + key + '.' + subkey,
+                    self.metric_name(*label_parts + ('keyspace', key, subkey)),
                     val[subkey], MetricInput.METRIC_TYPE_GAUGE, tstamp)
         elif key in METRICS_MAP and isinstance(val, (int, float)):
             metric_type = MetricInput.METRIC_TYPE_GAUGE
             prev_val = val
             if key in self.absolute_keys:
                 metric_type = MetricInput.METRIC_TYPE_COUNTER
-                prev_val = self.prev_values.get(key)
-                self.prev_values[key] = val
+                prev_key = label_parts + (key,)
+                prev_val = self.prev_values.get(prev_key)
+                self.prev_values[prev_key] = val
                 if prev_val is not None and val >= prev_val:
                     val -= prev_val
 
             if prev_val is not None:
                 yield (
-                    self.cfg['prefix'] + METRICS_MAP[key] + '.' + key,
+                    self.metric_name(*label_parts + (METRICS_MAP[key], key)),
                     val, metric_type, tstamp)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+'''Collector's own metrics input module
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import logging
+
+from metricol.commons import STATS_PROVIDERS
+from metricol.inputs import MetricInput
+
+
+LOG = logging.getLogger(__name__)
+
+
+class SelfStats(MetricInput):
+    '''Collector's self-metrics fetcher class
+    '''
+    options = ['prefix']
+
+    def fetch_data(self):
+        '''Fetches data from registered stats providers
+        '''
+        fetched_data = {}
+        for name, provider in list(STATS_PROVIDERS.items()):
+            try:
+                provider_data = provider()
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.error('%s @ %s', repr(exc), name)
+                continue
+            for key, val in provider_data.items():
+                fetched_data[name + '.' + key] = val
+
+        return fetched_data
+
+
+    def iter_metrics(self, key, val, tstamp):
+        yield (
+            self.metric_name(key), val, MetricInput.METRIC_TYPE_GAUGE, tstamp)
@@ -69,4 +69,6 @@ class SysClassNet(MetricInput):
         self.prev_values[key] = val
         if prev_val is not None and val >= prev_val:
             val -= prev_val
-            yield (self.cfg['prefix'] + key, val, MetricInput.METRIC_TYPE_COUNTER, tstamp)
+            yield (
+                self.metric_name(key), val, MetricInput.METRIC_TYPE_COUNTER,
+                tstamp)
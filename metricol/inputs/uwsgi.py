@@ -11,10 +11,12 @@ from __future__ import (
     with_statement,
 )
 
+import json
 import logging
 
 from requests import codes, RequestException, Session
 
+from metricol.aio import FETCH_ERRORS, http_get
 from metricol.inputs import MetricInput
 
 
@@ -85,10 +87,22 @@ class UwsgiStats(MetricInput):
         return {}
 
 
+    async def async_fetch_data(self):
+        try:
+            status, body = await http_get(
+                self.url, self.req_session.headers, timeout=self.period)
+            if status == codes['ok']:
+                return json.loads(str(body, encoding='utf-8'))
+        except FETCH_ERRORS as exc:
+            LOG.warning('%s @ %s', repr(exc), repr(self.url))
+
+        return {}
+
+
     def iter_metrics(self, key, val, tstamp):
         if key in STRAIGHT_METRICS:
             yield (
-                self.cfg['prefix'] + key, val, MetricInput.METRIC_TYPE_GAUGE,
+                self.metric_name(key), val, MetricInput.METRIC_TYPE_GAUGE,
                 tstamp)
 
         elif key == 'locks':
@@ -96,26 +110,25 @@ class UwsgiStats(MetricInput):
                 for _key, _val in lock.items():
                     if _key not in LOCK_METRICS:
                         continue
-                    mkey = key + '.' + _key.replace(' ', '_')
+                    mkey = self.metric_name(key, _key)
                     prev_val = self.prev_values.get(mkey)
                     self.prev_values[mkey] = _val
                     if prev_val is not None and _val >= prev_val:
                         _val -= prev_val
                         yield (
-                            self.cfg['prefix'] + mkey, _val,
+                            mkey, _val,
                             MetricInput.METRIC_TYPE_COUNTER, tstamp)
 
         elif key == 'sockets':
             for idx, socket in enumerate(val):
                 for _key in ['queue', 'shared']:
                     yield (
-                        self.cfg['prefix'] + key + '.' + str(idx) + '.' + _key,
+                        self.metric_name(key, idx, _key),
                         socket[_key], MetricInput.METRIC_TYPE_GAUGE, tstamp)
 
         elif key == 'workers':
             for worker in val:
                 for _key in WORKER_METRICS:
                     yield (
-                        self.cfg['prefix'] + key + '.' + str(worker['id']) +
-                        '.' + _key,
+                        self.metric_name(key, worker['id'], _key),
                         worker[_key], MetricInput.METRIC_TYPE_GAUGE, tstamp)
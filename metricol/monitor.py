@@ -17,8 +17,10 @@ import logging
 import os
 import signal
 import time
-from queue import Queue
 
+from metricol.aio import AsyncEngine
+from metricol.channels import BatchChannel
+from metricol.commons import register_stats
 from metricol.inputs.auth_log_watch import AuthLogWatch
 from metricol.inputs.disks_spaces import DisksSpaces
 from metricol.inputs.load_info import LoadInfo
@@ -27,10 +29,13 @@ from metricol.inputs.memory import MemInfo
 from metricol.inputs.mysql_status import MysqlStatus
 from metricol.inputs.nginx import NginxStatus
 from metricol.inputs.redis import RedisInfo
+from metricol.inputs.self_stats import SelfStats
 from metricol.inputs.sys_class_net import SysClassNet
 from metricol.inputs.uwsgi import UwsgiStats
+from metricol.outputs.graphite import Graphite
 from metricol.outputs.graphite_gw import GraphiteGateway
 from metricol.outputs.statsite import Statsite
+from metricol.scheduler import Scheduler
 from metricol.sinks.graphite_gw import GraphiteGateway as GraphiteGatewaySink
 
 
@@ -40,6 +45,7 @@ SINK_PLUGINS = {
     'graphite_gw': GraphiteGatewaySink,
 }
 OUTPUT_PLUGINS = {
+    'graphite': Graphite,
     'graphite_gw': GraphiteGateway,
     'statsite': Statsite,
 }
@@ -52,16 +58,20 @@ INPUT_PLUGINS = {
     'mysql_status': MysqlStatus,
     'nginx_status': NginxStatus,
     'redis_info': RedisInfo,
+    'self_stats': SelfStats,
     'sys_class_net': SysClassNet,
     'uwsgi_stats': UwsgiStats,
 }
 THREADS = []
+CHANNELS = []
 
 
 def signal_recv(signum, _):
     '''Signal receiver
     '''
     LOG.info('Signal received: %s', signum)
+    for channel in CHANNELS:
+        channel.close()
     while THREADS:
         thr = THREADS.pop()
         thr.stop()
@@ -124,8 +134,22 @@ def main():
     '''
     cfg = pre_setup()
 
-    output_queue = Queue()
-
+    output_queue = BatchChannel(
+        capacity=int(cfg['DEFAULT'].get('channel_capacity', 0)),
+        policy=cfg['DEFAULT'].get('channel_policy', 'block'))
+    register_stats('channel', output_queue.stats)
+    CHANNELS.append(output_queue)
+
+    engine = cfg['DEFAULT'].get('engine', 'threads')
+    scheduler = None
+    if engine == 'scheduler':
+        scheduler = Scheduler(int(cfg['DEFAULT'].get('scheduler_workers', 4)))
+    elif engine == 'asyncio':
+        scheduler = AsyncEngine()
+    if scheduler:
+        register_stats(engine, scheduler.stats)
+
+    plugins = []
     for section_name, section_proxy in cfg.items():
         if not section_name.startswith('output:') and \
                 not section_name.startswith('input:'):
@@ -134,18 +158,38 @@ def main():
         plug_name = section_proxy['plugin']
         if plug_name in OUTPUT_PLUGINS:
             plug_cls = OUTPUT_PLUGINS[plug_name]
+            # every output reads all the metrics via its own cursor
+            out_name = section_name.split(':', 1)[1]
+            queue = output_queue.subscribe(
+                out_name, max_lag=int(section_proxy.get('max_lag', 0)))
+            register_stats('channel.' + out_name, queue.stats)
         elif plug_name in INPUT_PLUGINS:
             plug_cls = INPUT_PLUGINS[plug_name]
+            queue = output_queue
         else:
             raise RuntimeError('Unknown plugin: %s' % repr(plug_name))
 
         LOG.debug('Plugin: %s', plug_cls.__name__)
-        plug_obj = plug_cls(section_proxy, output_queue)
+        plug_obj = plug_cls(section_proxy, queue)
+        if scheduler and plug_name in INPUT_PLUGINS and \
+                int(section_proxy.get('period', plug_obj.period)) > 0:
+            scheduler.add(plug_obj)
+            continue
+
+        plugins.append(plug_obj)
+
+    # all outputs are subscribed before any input starts
+    for plug_obj in plugins:
         plug_obj.daemon = False
         plug_obj.start()
 
         THREADS.append(plug_obj)
 
+    if scheduler:
+        scheduler.daemon = False
+        scheduler.start()
+        THREADS.append(scheduler)
+
     threads_num = len(THREADS)
 
     LOG.info('Started threads: %s', threads_num)
@@ -14,12 +14,20 @@ from __future__ import (
 import logging
 
 
-from metricol.commons import ManageableThread
+from metricol.commons import ManageableThread, NameCache
 
 
 LOG = logging.getLogger(__name__)
 
 
+def format_value(val):
+    '''Formats metric value (integral floats without fraction part)
+    '''
+    if val.is_integer():
+        return '%d' % val
+    return repr(val)
+
+
 class MetricOutput(ManageableThread):
     '''Metrics pusher class
     '''
@@ -29,6 +37,7 @@ class MetricOutput(ManageableThread):
         self._section = section
         self.queue = queue
         self.cfg = {}
+        self.names = NameCache()
         super(MetricOutput, self).__init__(name=self._section.name)
 
 
@@ -36,6 +45,8 @@ class MetricOutput(ManageableThread):
         for field in self.options:
             self.cfg[field] = self._section[field]
         self.period = int(self._section.get('period', self.period))
+        self.names.maxsize = int(
+            self._section.get('name_cache_size', self.names.maxsize))
 
 
     def do_things(self):
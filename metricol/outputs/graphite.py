@@ -12,83 +12,254 @@ from __future__ import (
 )
 
 import logging
-from queue import Empty
+import pickle
+import socket
+import ssl
+import struct
+import time
+from collections import deque
 
-from requests import (
-    codes,
-    RequestException,
-    Session,
-)
-
-from metricol.outputs import MetricOutput
+from metricol.channels import TYPE_CODES
+from metricol.commons import register_stats
+from metricol.inputs import MetricInput
+from metricol.outputs import format_value, MetricOutput
 
 
 LOG = logging.getLogger(__name__)
 
+TYPE_SEGMENTS = {
+    TYPE_CODES[MetricInput.METRIC_TYPE_GAUGE]: 'gauges.',
+    TYPE_CODES[MetricInput.METRIC_TYPE_COUNTER]: 'counts.',
+    TYPE_CODES[MetricInput.METRIC_TYPE_TIMER]: 'timers.',
+}
+PICKLE_HDR = struct.Struct('!L')
+
+
+def create_ssl_context(cafile=None, certfile=None, keyfile=None):
+    '''Creates client SSL context (see: misc/graphite_ssl.py)
+    '''
+    if hasattr(ssl, 'TLSVersion'):
+        cli_ctx = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_CLIENT)
+        cli_ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    else:
+        # Python < 3.7: negotiate the highest version, but TLSv1.2 at least
+        cli_ctx = ssl.SSLContext(protocol=ssl.PROTOCOL_SSLv23)
+        cli_ctx.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 | \
+            ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+    cli_ctx.verify_mode = ssl.CERT_REQUIRED
+    cli_ctx.check_hostname = True
+    cli_ctx.verify_flags = ssl.VERIFY_X509_STRICT
+    if hasattr(ssl, 'VERIFY_X509_TRUSTED_FIRST'):
+        cli_ctx.verify_flags |= getattr(ssl, 'VERIFY_X509_TRUSTED_FIRST', 0)
+    for opt in ['OP_NO_COMPRESSION', 'OP_SINGLE_DH_USE', 'OP_SINGLE_ECDH_USE']:
+        cli_ctx.options |= getattr(ssl, opt, 0)
+
+    cli_ctx.load_default_certs(purpose=ssl.Purpose.SERVER_AUTH)
+    if cafile:
+        cli_ctx.load_verify_locations(cafile=cafile)
+    if certfile and keyfile:
+        cli_ctx.load_cert_chain(certfile, keyfile=keyfile)
+
+    cli_ctx.set_ciphers(
+        'ECDH+AESGCM:DH+AESGCM:ECDH+AES256:DH+AES256:'
+        'ECDH+AES128:DH+AES:RSA+AESGCM:RSA+AES:!aNULL:!MD5:!DSS')
+
+    return cli_ctx
 
-class GraphiteGateway(MetricOutput):
-    '''Graphite pusher class
+
+class Graphite(MetricOutput):
+    '''Graphite (carbon plaintext / pickle protocol) pusher class
     '''
-    options = [
-        'scheme', 'host', 'port', 'uri', 'hostname', 'prefix',
-        'cafile', 'cli_certfile', 'cli_keyfile']
+    options = ['host', 'port', 'prefix']
+    WAIT_SECS = 1.0
+    BACKOFF_MIN_SECS = 1.0
+    BACKOFF_MAX_SECS = 60.0
 
     def __init__(self, section, queue):
-        super(GraphiteGateway, self).__init__(section, queue)
-        self.req_session = Session()
-        self.url = 'http://localhost/'
+        super(Graphite, self).__init__(section, queue)
+        self.sock = None
+        self.ssl_ctx = None
+        self.protocol = 'plaintext'
+        self.timeout = 10.0
+        self.max_points = 1000
+        self.max_pending_points = 100000
+        self.pending = deque()
+        self.pending_points = 0
+        self.backoff = 0.0
+        self.connect_ts = 0.0
+        self._stats = {
+            'connects': 0,
+            'connect_errors': 0,
+            'send_errors': 0,
+            'points_sent': 0,
+            'bytes_sent': 0,
+            'points_dropped': 0,
+        }
 
 
     def prepare_things(self):
-        super(GraphiteGateway, self).prepare_things()
-        self.url = '%(scheme)s://%(host)s:%(port)s%(uri)s' % self.cfg
-        self.req_session.headers = {'Host': self.cfg['hostname']}
-        self.req_session.stream = False
-        self.req_session.allow_redirects = True
-        self.req_session.verify = self.cfg['cafile']
-        self.req_session.cert = (
-            self.cfg['cli_certfile'], self.cfg['cli_keyfile'])
-
-
-    def _create_socket(self, cfg):
-        '''Creates a socket and connects to the service
+        super(Graphite, self).prepare_things()
+        # the channel is waited on, no sleeping between sends
+        self.period = 0
+        self.protocol = self._section.get('protocol', self.protocol)
+        if self.protocol not in ('plaintext', 'pickle'):
+            raise ValueError('Unknown protocol: %s' % repr(self.protocol))
+        self.timeout = float(self._section.get('timeout', self.timeout))
+        self.max_points = int(
+            self._section.get('max_batch_points', self.max_points))
+        self.max_pending_points = int(
+            self._section.get('max_pending_points', self.max_pending_points))
+        if self._section.getboolean('tls', False):
+            self.ssl_ctx = create_ssl_context(
+                self._section.get('cafile'), self._section.get('cli_certfile'),
+                self._section.get('cli_keyfile'))
+        register_stats(
+            'graphite.' + self.getName().split(':', 1)[-1], self.stats)
+
+
+    def stats(self):
+        '''Returns output counters
+        '''
+        stats = dict(self._stats)
+        stats['points_pending'] = self.pending_points
+        stats['connected'] = int(self.sock is not None)
+
+        return stats
+
+
+    def get_metric_name(self, key, type_code):
+        '''Returns (cached) output metric name (encoded, followed by a space
+        for plaintext protocol)
+        '''
+        name = self.names.get((key, type_code))
+        if name is not None:
+            return name
+
+        if type_code not in TYPE_SEGMENTS:
+            LOG.warning('Unknown metric type: %s @ %s', type_code, key)
+            return None
+
+        name = self.cfg['prefix'] + TYPE_SEGMENTS[type_code] + key
+        if self.protocol == 'plaintext':
+            name = bytes(name + ' ', encoding='utf-8')
+
+        return self.names.put((key, type_code), name)
+
+
+    def iter_chunks(self, metrics_batch):
+        '''Yields encoded chunks (up to max_points) of metrics batch
+        '''
+        tstamp = metrics_batch.tstamp
+        if self.protocol == 'plaintext':
+            tstamp = bytes(' ' + str(tstamp) + '\n', encoding='ascii')
+        chunk = []
+        for key, val, type_code in metrics_batch:
+            name = self.get_metric_name(key, type_code)
+            if not name:
+                continue
+            if self.protocol == 'plaintext':
+                chunk.append(
+                    name + bytes(format_value(val), encoding='ascii') + tstamp)
+            else:
+                chunk.append((name, (tstamp, val)))
+            if len(chunk) >= self.max_points:
+                yield self.encode_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield self.encode_chunk(chunk)
+
+
+    def encode_chunk(self, chunk):
+        '''Encodes chunk of metrics
+        '''
+        if self.protocol == 'plaintext':
+            return b''.join(chunk)
+
+        payload = pickle.dumps(chunk, protocol=2)
+        return PICKLE_HDR.pack(len(payload)) + payload
+
+
+    def connect(self):
+        '''(Re)connects to carbon (respecting backoff), returns True on success
         '''
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        now_ts = time.time()
+        if now_ts < self.connect_ts:
+            return False
+
+        host, port = self.cfg['host'], int(self.cfg['port'])
         try:
-            sock.connect((self.cfg['host'], int(self.cfg['port'])))
-        except (IOError, OSError, socket.timeout, socket.error) as exc:
-            LOG.error(
-                'Failed to connect to %s @ %s:%s', repr(exc), self.cfg['host'],
-                self.cfg['port'])
-            sock = None
+            sock = socket.create_connection((host, port), timeout=self.timeout)
+            if self.ssl_ctx:
+                sock = self.ssl_ctx.wrap_socket(
+                    sock, server_hostname=self._section.get('hostname', host))
+        except (IOError, OSError) as exc:
+            self._stats['connect_errors'] += 1
+            self.backoff = min(
+                max(self.backoff * 2, self.BACKOFF_MIN_SECS),
+                self.BACKOFF_MAX_SECS)
+            self.connect_ts = now_ts + self.backoff
+            LOG.warning(
+                'Failed to connect: %s @ %s:%s (retry in %ss)', repr(exc), host,
+                port, self.backoff)
+            return False
 
-        return sock
+        self._stats['connects'] += 1
+        self.backoff = 0.0
+        self.sock = sock
+        return True
 
 
-    def do_things(self):
-        batch = []
-        while True:
+    def close(self):
+        '''Closes connection
+        '''
+        if not self.sock:
+            return
+        try:
+            self.sock.close()
+        except (IOError, OSError) as exc:
+            LOG.warning('Failed to close connection: %s', repr(exc))
+        self.sock = None
+
+
+    def send_pending(self):
+        '''Sends pending batches (oldest first)
+        '''
+        while self.pending:
+            if not self.sock and not self.connect():
+                return
+            metrics_batch = self.pending[0]
             try:
-                batch.append(self.queue.get(block=False))
-            except Empty:
-                break
+                for chunk in self.iter_chunks(metrics_batch):
+                    self.sock.sendall(chunk)
+                    self._stats['bytes_sent'] += len(chunk)
+            except (IOError, OSError) as exc:
+                # whole batch is resent after reconnect
+                self._stats['send_errors'] += 1
+                LOG.warning(
+                    'Failed to write metrics: %s @ %s:%s', repr(exc),
+                    self.cfg['host'], self.cfg['port'])
+                self.close()
+                self.connect_ts = time.time() + self.BACKOFF_MIN_SECS
+                continue
+            self.pending.popleft()
+            self.pending_points -= metrics_batch.points
+            self._stats['points_sent'] += metrics_batch.points
+
+
+    def do_things(self):
+        for metrics_batch in self.queue.get_batches(self.WAIT_SECS):
+            self.pending.append(metrics_batch)
+            self.pending_points += metrics_batch.points
+        while len(self.pending) > 1 and \
+                self.pending_points > self.max_pending_points:
+            dropped = self.pending.popleft()
+            self.pending_points -= dropped.points
+            self._stats['points_dropped'] += dropped.points
+        self.send_pending()
 
-        if not batch:
-            return
 
-        statsite_cfg = cfg['statsite']
-        buf = bytes('\n'.join(metrics) + '\n', encoding='utf-8')
-        sock = None
-        for _ in range(4):
-            if sock:
-                try:
-                    sock.sendall(buf)
-                    break
-                except (IOError, OSError, socket.timeout, socket.error) as exc:
-                    LOG.error(
-                        'Failed to write metric: %s @ %s', repr(exc),
-                        repr(metrics))
-            sock = _create_socket(statsite_cfg)
-
-        if sock:
-            sock.close()
+    def run(self):
+        super(Graphite, self).run()
+        self.connect_ts = 0.0
+        self.do_things()
+        self.close()
@@ -11,12 +11,10 @@ from __future__ import (
     with_statement,
 )
 
-import gzip
-import linecache
 import logging
-import os
-import tracemalloc
-from queue import Empty
+import time
+import zlib
+from collections import deque
 
 from requests import (
     codes,
@@ -24,41 +22,20 @@ from requests import (
     Session,
 )
 
+from metricol.channels import TYPE_CODES
+from metricol.commons import register_stats
 from metricol.inputs import MetricInput
-from metricol.outputs import MetricOutput
+from metricol.outputs import format_value, MetricOutput
+from metricol.spool import Spool
 
 
-tracemalloc.start()
-
 LOG = logging.getLogger(__name__)
 
-
-def display_top(snapshot, key_type='lineno', limit=10):
-    '''Logs limited top of tracemalloc snapshot
-    '''
-    snapshot = snapshot.filter_traces((
-        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
-        tracemalloc.Filter(False, '<unknown>'),
-    ))
-    top_stats = snapshot.statistics(key_type)
-
-    LOG.warning('Top %s lines', limit)
-    for index, stat in enumerate(top_stats[:limit], 1):
-        frame = stat.traceback[0]
-        # replace '/path/to/module/file.py' with 'module/file.py'
-        filename = os.sep.join(frame.filename.split(os.sep)[-2:])
-        LOG.warning(
-            '#%s: %s:%s: %.1f KiB', index, filename, frame.lineno, stat.size / 1024)
-        line = linecache.getline(frame.filename, frame.lineno).strip()
-        if line:
-            LOG.warning('    %s', line)
-
-    other = top_stats[limit:]
-    if other:
-        size = sum(stat.size for stat in other)
-        LOG.warning('%s other: %.1f KiB', len(other), size / 1024)
-    total = sum(stat.size for stat in top_stats)
-    LOG.warning('Total allocated size: %.1f KiB', total / 1024)
+TYPE_SEGMENTS = {
+    TYPE_CODES[MetricInput.METRIC_TYPE_GAUGE]: 'gauges.',
+    TYPE_CODES[MetricInput.METRIC_TYPE_COUNTER]: 'counts.',
+    TYPE_CODES[MetricInput.METRIC_TYPE_TIMER]: 'timers.',
+}
 
 
 class GraphiteGateway(MetricOutput):
@@ -67,12 +44,27 @@ class GraphiteGateway(MetricOutput):
     options = [
         'scheme', 'host', 'port', 'uri', 'hostname', 'prefix', 'gzip_level',
         'cafile', 'cli_certfile', 'cli_keyfile']
+    WAIT_SECS = 1.0
+    REPLAY_RETRY_SECS = 10.0
 
     def __init__(self, section, queue):
         super(GraphiteGateway, self).__init__(section, queue)
         self.req_session = Session()
         self.url = 'http://localhost/'
         self.gzip_level = 0
+        self.chunk_size = 64 * 1024
+        self.max_points = 20000
+        self.max_bytes = 1024 * 1024
+        self.max_linger = 0.0
+        self.pending = deque()
+        self.pending_points = 0
+        self.pending_ts = 0.0
+        self.line_bytes = 64.0
+        self.spool = None
+        self.replay_rate = 1.0
+        self.replay_ts = 0.0
+        self.flush_period = 0
+        self.flush_ts = 0.0
 
 
     def prepare_things(self):
@@ -89,48 +81,250 @@ class GraphiteGateway(MetricOutput):
         self.req_session.verify = self.cfg['cafile']
         self.req_session.cert = (
             self.cfg['cli_certfile'], self.cfg['cli_keyfile'])
+        self.max_points = int(
+            self._section.get('max_batch_points', self.max_points))
+        self.max_bytes = int(
+            self._section.get('max_batch_bytes', self.max_bytes))
+        self.max_linger = float(
+            self._section.get('max_linger', self.max_linger))
+        self.chunk_size = int(self._section.get('chunk_size', self.chunk_size))
+        if self._section.get('spool_dir'):
+            self.spool = Spool(
+                self._section['spool_dir'],
+                max_bytes=int(self._section.get(
+                    'spool_max_bytes', 256 * 1024 * 1024)),
+                segment_bytes=int(self._section.get(
+                    'spool_segment_bytes', 4 * 1024 * 1024)))
+            self.replay_rate = float(
+                self._section.get('spool_replay_rate', self.replay_rate))
+            register_stats(
+                'spool.' + self.getName().split(':', 1)[-1], self.spool.stats)
+        if self.max_linger:
+            # flushing driven by blocking waits on the channel
+            self.period = 0
+        elif self.spool is not None and self.period > 0:
+            # own flush timer, so the spool is replayed between flushes
+            self.flush_period = self.period
+            self.period = 0
 
 
-    def get_metric_line(self, metric_data):
-        '''Converts metric data tuple to metric line
+    def get_metric_name(self, key, type_code):
+        '''Returns (cached) encoded output metric name followed by a space
         '''
-        _key, _val, _type, _ts = metric_data
-        _line = _key + ' ' + str(_val) + ' ' + str(_ts)
-        if _type == MetricInput.METRIC_TYPE_GAUGE:
-            return self.cfg['prefix'] + 'gauges.' + _line
-        elif _type == MetricInput.METRIC_TYPE_COUNTER:
-            return self.cfg['prefix'] + 'counts.' + _line
-        elif _type == MetricInput.METRIC_TYPE_TIMER:
-            return self.cfg['prefix'] + 'timers.' + _line
+        name = self.names.get((key, type_code))
+        if name is not None:
+            return name
 
-        LOG.warning('Unknown metric type: %s @ %s', _type, _line)
+        if type_code not in TYPE_SEGMENTS:
+            LOG.warning('Unknown metric type: %s @ %s', type_code, key)
+            return None
 
+        return self.names.put((key, type_code), bytes(
+            self.cfg['prefix'] + TYPE_SEGMENTS[type_code] + key + ' ',
+            encoding='utf-8'))
 
-    def do_things(self):
-        batch = []
-        while True:
+
+    def get_metric_line(self, key, val, type_code, tstamp):
+        '''Converts metric batch point to (encoded) metric line
+        '''
+        name = self.get_metric_name(key, type_code)
+        if name:
+            return name + bytes(format_value(val), encoding='ascii') + tstamp
+
+
+    def add_batches(self, batches):
+        '''Queues metrics batches for sending
+        '''
+        for metrics_batch in batches:
+            if not metrics_batch:
+                continue
+            if not self.pending:
+                self.pending_ts = time.time()
+            self.pending.append([metrics_batch, 0])
+            self.pending_points += metrics_batch.points
+
+
+    def iter_lines(self, sent):
+        '''Yields (and consumes) pending metric lines up to batch limits,
+        records (metrics batch, start, end) spans of consumed points in sent
+        '''
+        count = size = 0
+        while self.pending:
+            metrics_batch, start = self.pending[0]
+            tstamp = bytes(' ' + str(metrics_batch.tstamp), encoding='ascii')
+            keys, values, types = \
+                metrics_batch.keys, metrics_batch.values, metrics_batch.types
+            idx = start
             try:
-                metric_data = self.queue.get(block=False)
-                metric_line = self.get_metric_line(metric_data)
+                while idx < len(values):
+                    metric_line = self.get_metric_line(
+                        keys[idx], values[idx], types[idx], tstamp)
+                    if metric_line:
+                        if count and (
+                                count >= self.max_points or
+                                size + len(metric_line) + 1 > self.max_bytes):
+                            return
+                        count += 1
+                        size += len(metric_line) + 1
+                    idx += 1
+                    self.pending_points -= 1
+                    if metric_line:
+                        yield metric_line
+            finally:
+                if idx > start:
+                    sent.append((metrics_batch, start, idx))
+                self.pending[0][1] = idx
+                if count:
+                    self.line_bytes = size / count
+            self.pending.popleft()
+
+
+    def iter_span_lines(self, spans):
+        '''Yields metric lines of (metrics batch, start, end) spans
+        '''
+        for metrics_batch, start, end in spans:
+            tstamp = bytes(' ' + str(metrics_batch.tstamp), encoding='ascii')
+            for idx in range(start, end):
+                metric_line = self.get_metric_line(
+                    metrics_batch.keys[idx], metrics_batch.values[idx],
+                    metrics_batch.types[idx], tstamp)
                 if metric_line:
-                    batch.append(metric_line)
-            except Empty:
-                break
+                    yield metric_line
 
-        if not batch:
-            return
 
-        payload = '\n'.join(batch)
+    def iter_body(self, lines):
+        '''Yields (optionally gzip compressed) payload chunks
+        '''
+        compressor = None
         if self.gzip_level:
-            payload = gzip.compress(
-                bytes(payload, encoding='utf-8'), compresslevel=self.gzip_level)
+            compressor = zlib.compressobj(
+                self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        buf = []
+        size = 0
+        for metric_line in lines:
+            buf.append(metric_line)
+            size += len(metric_line) + 1
+            if size < self.chunk_size:
+                continue
+            chunk = b'\n'.join(buf) + b'\n'
+            buf = []
+            size = 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+        chunk = b'\n'.join(buf) + b'\n' if buf else b''
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
 
+
+    def flush(self, force=False):
+        '''Posts pending points in bounded chunks (only full ones unless forced)
+        '''
+        while self.pending and (
+                force or self.pending_points >= self.max_points or
+                self.pending_points * self.line_bytes >= self.max_bytes):
+            self.post()
+
+
+    def sleep_until(self, until_ts):
+        '''Sleeps until the time given (or the shutdown)
+        '''
+        while self.keep_running:
+            wait_secs = until_ts - time.time()
+            if wait_secs <= 0:
+                return
+            time.sleep(min(wait_secs, self.WAIT_SECS))
+
+
+    def do_things(self):
+        if not self.max_linger:
+            if time.time() < self.flush_ts:
+                return
+            # once per period: drain the channel (in bounded posts)
+            batches = True
+            while batches:
+                batches = self.queue.get_batches(max_points=self.max_points)
+                self.add_batches(batches)
+                self.flush(force=True)
+            if self.flush_period:
+                self.flush_ts = time.time() + self.flush_period
+                self.replay(self.flush_ts)
+                self.sleep_until(self.flush_ts)
+            else:
+                self.replay(time.time())
+            return
+
+        timeout = self.max_linger
+        if self.pending:
+            timeout = max(0.0, self.pending_ts + self.max_linger - time.time())
+        if self.pending_points < self.max_points:
+            self.add_batches(self.queue.get_batches(
+                min(timeout, self.WAIT_SECS),
+                max_points=self.max_points - self.pending_points))
+        self.flush(force=bool(
+            self.pending and time.time() - self.pending_ts >= self.max_linger))
+        until_ts = time.time() + self.WAIT_SECS
+        if self.pending:
+            until_ts = min(until_ts, self.pending_ts + self.max_linger)
+        self.replay(until_ts)
+
+
+    def run(self):
+        super(GraphiteGateway, self).run()
+        self.add_batches(self.queue.get_batches())
+        self.flush(force=True)
+        if self.spool is not None:
+            self.spool.close()
+
+
+    def send(self, body):
+        '''Posts payload, returns True on success
+        '''
         try:
-            resp = self.req_session.post(self.url, data=payload)
-            if resp.status_code != codes['ok']:
-                LOG.warning('Code %s @ %s', resp.status_code, repr(self.url))
+            resp = self.req_session.post(self.url, data=body)
+            if resp.status_code == codes['ok']:
+                return True
+            LOG.warning('Code %s @ %s', resp.status_code, repr(self.url))
         except RequestException as exc:
             LOG.warning('%s @ %s', repr(exc), repr(self.url))
 
-        snapshot = tracemalloc.take_snapshot()
-        display_top(snapshot)
+        return False
+
+
+    def post(self):
+        '''Posts (streams) a bounded batch of pending metric lines,
+        spools them on failure
+        '''
+        sent = []
+        lines = self.iter_lines(sent)
+        if not self.send(self.iter_body(lines)):
+            # consume the rest of the batch so it is spooled / dropped as whole
+            for _ in lines:
+                pass
+            if self.spool is not None:
+                self.spool.append(self.iter_span_lines(sent))
+            self.replay_ts = time.time() + self.REPLAY_RETRY_SECS
+
+
+    def replay(self, until_ts):
+        '''Replays spooled batches (oldest first) at the replay rate until
+        the spool is empty, a post fails or the time given
+        '''
+        while self.spool is not None and self.keep_running:
+            if time.time() < self.replay_ts:
+                if self.replay_ts >= until_ts:
+                    return
+                self.sleep_until(self.replay_ts)
+                continue
+            record = self.spool.read()
+            if record is None:
+                return
+            if not self.send(self.iter_body(iter(record.split(b'\n')))):
+                self.replay_ts = time.time() + self.REPLAY_RETRY_SECS
+                return
+            self.spool.commit()
+            self.replay_ts = time.time() + 1.0 / self.replay_rate
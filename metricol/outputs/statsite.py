@@ -12,42 +12,117 @@ from __future__ import (
 )
 
 import logging
-from queue import Empty
-
-from statsd.client import StatsClient
+import socket
 
+from metricol.channels import TYPE_CODES
+from metricol.commons import register_stats
 from metricol.inputs import MetricInput
-from metricol.outputs import MetricOutput
+from metricol.outputs import format_value, MetricOutput
 
 
 LOG = logging.getLogger(__name__)
 
+TYPE_SUFFIXES = {
+    TYPE_CODES[MetricInput.METRIC_TYPE_GAUGE]: b'|g',
+    TYPE_CODES[MetricInput.METRIC_TYPE_COUNTER]: b'|c',
+    TYPE_CODES[MetricInput.METRIC_TYPE_TIMER]: b'|ms',
+}
+
 
 class Statsite(MetricOutput):
-    '''Statsite pusher class
+    '''Statsite pusher class (packs statsd lines into UDP datagrams)
     '''
     options = ['host', 'port']
 
     def __init__(self, section, queue):
         super(Statsite, self).__init__(section, queue)
-        self.client = None
+        self.sock = None
+        self.addr = None
+        self.max_datagram_size = 1432
+        self.datagram = []
+        self.datagram_size = 0
+        self._stats = {
+            'datagrams_sent': 0,
+            'bytes_sent': 0,
+            'send_errors': 0,
+        }
 
 
     def prepare_things(self):
         super(Statsite, self).prepare_things()
-        self.client = StatsClient(
-            host=self.cfg['host'], port=int(self.cfg['port']), maxudpsize=1024)
+        self.max_datagram_size = int(
+            self._section.get('max_datagram_size', self.max_datagram_size))
+        family, _, _, _, self.addr = socket.getaddrinfo(
+            self.cfg['host'], int(self.cfg['port']), 0, socket.SOCK_DGRAM)[0]
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        register_stats(
+            'statsite.' + self.getName().split(':', 1)[-1], self.stats)
+
+
+    def stop_things(self):
+        super(Statsite, self).stop_things()
+        if self.sock:
+            self.sock.close()
+
+
+    def stats(self):
+        '''Returns output counters
+        '''
+        return dict(self._stats)
+
+
+    def get_metric_name(self, key):
+        '''Returns (cached) encoded metric name followed by a colon
+        '''
+        name = self.names.get(key)
+        if name is None:
+            name = self.names.put(key, bytes(key + ':', encoding='utf-8'))
+
+        return name
+
+
+    def add_lines(self, *lines):
+        '''Adds statsd lines to the same datagram (sends the full one first)
+        '''
+        size = sum(len(line) + 1 for line in lines)
+        if self.datagram and \
+                self.datagram_size + size > self.max_datagram_size:
+            self.send_datagram()
+        self.datagram.extend(lines)
+        self.datagram_size += size
+
+
+    def send_datagram(self):
+        '''Sends the datagram
+        '''
+        if not self.datagram:
+            return
+
+        payload = b'\n'.join(self.datagram)
+        self.datagram = []
+        self.datagram_size = 0
+        try:
+            self.sock.sendto(payload, self.addr)
+            self._stats['datagrams_sent'] += 1
+            self._stats['bytes_sent'] += len(payload)
+        except (IOError, OSError) as exc:
+            self._stats['send_errors'] += 1
+            LOG.warning('%s @ %s', repr(exc), repr(self.addr))
 
 
     def do_things(self):
-        while True:
-            try:
-                _key, _val, _type, _ = self.queue.get(block=False)
-                if _type == MetricInput.METRIC_TYPE_GAUGE:
-                    self.client.gauge(_key, _val)
-                elif _type == MetricInput.METRIC_TYPE_COUNTER:
-                    self.client.incr(_key, count=_val)
-                elif _type == MetricInput.METRIC_TYPE_TIMER:
-                    self.client.timing(_key, _val)
-            except Empty:
-                break
+        gauge_code = TYPE_CODES[MetricInput.METRIC_TYPE_GAUGE]
+        for batch in self.queue.get_batches():
+            for key, _val, type_code in batch:
+                if type_code not in TYPE_SUFFIXES:
+                    continue
+                name = self.get_metric_name(key)
+                line = name + bytes(format_value(_val), encoding='ascii') + \
+                    TYPE_SUFFIXES[type_code]
+                if type_code == gauge_code and _val < 0:
+                    # negative value would be taken as a delta, the reset
+                    # has to go in the same (unordered UDP) datagram
+                    self.add_lines(name + b'0|g', line)
+                else:
+                    self.add_lines(line)
+        self.send_datagram()
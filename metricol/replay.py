@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Log files replay (backfill) script
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import argparse
+import glob
+import gzip
+import logging
+import mmap
+import os
+import re
+import time
+
+from metricol.channels import BatchChannel
+from metricol.monitor import (
+    config_logger, INPUT_PLUGINS, load_config, OUTPUT_PLUGINS)
+from metricol.inputs.log_watch import LogWatch
+from metricol.tailer import glob_label, glob_regex
+
+
+LOG = logging.getLogger(__name__)
+
+# suffixes of rotated log files: .1, -20261017, .gz
+ROTATED_SUFFIX = re.compile(r'(\.[0-9]+|-[0-9]{8,10})?(\.gz)?\Z')
+REPORT_SECS = 10.0
+DRAIN_SECS = 60.0
+
+
+def iter_blocks(fpath, block_bytes):
+    '''Yields blocks (of about block_bytes, ending with a newline) of
+    a (gzipped) file
+    '''
+    if fpath.endswith('.gz'):
+        with gzip.open(fpath, 'rb') as fd_obj:
+            partial = b''
+            while True:
+                data = fd_obj.read(block_bytes)
+                if not data:
+                    break
+                end = data.rfind(b'\n') + 1
+                if not end:
+                    partial += data
+                    continue
+                yield partial + data[:end]
+                partial = data[end:]
+            if partial:
+                yield partial
+        return
+
+    with open(fpath, 'rb') as fd_obj:
+        if not os.fstat(fd_obj.fileno()).st_size:
+            return
+        data = mmap.mmap(fd_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        except (AttributeError, OSError):
+            pass
+        try:
+            pos = 0
+            size = len(data)
+            while pos < size:
+                end = size
+                if pos + block_bytes < size:
+                    end = data.find(b'\n', pos + block_bytes) + 1 or size
+                yield data[pos:end]
+                pos = end
+        finally:
+            data.close()
+
+
+def file_label(fpaths, fpath):
+    '''Returns label of a (rotated) file matched by one of (live) paths'
+    glob patterns (or None)
+    '''
+    fname = ROTATED_SUFFIX.sub('', os.path.basename(fpath))
+    for pattern in fpaths:
+        if glob.has_magic(pattern):
+            label = glob_label(glob_regex(os.path.basename(pattern)), fname)
+            if label:
+                return label
+
+    return None
+
+
+class Replay(object):
+    '''Replays log files through an input section's parser, aggregation
+    and the outputs (original lines' timestamps are kept)
+    '''
+
+    def __init__(self, plug_obj, channel, max_lines_rate=0.0,
+                 block_bytes=4 * 1024 * 1024, cursor=None):
+        self.plug_obj = plug_obj
+        self.channel = channel
+        # drained after each block (when there are no outputs)
+        self.cursor = cursor
+        self.max_lines_rate = max_lines_rate
+        self.block_bytes = block_bytes
+        self.lines = 0
+        self.bytes = 0
+        self.start_ts = 0.0
+        self.report_ts = 0.0
+
+
+    def prepare(self):
+        '''Prepares input's parser, aggregator and parsing workers
+        '''
+        plug_obj = self.plug_obj
+        plug_obj.prepare_parser()
+        plug_obj.aggregator = plug_obj.new_aggregator()
+        if plug_obj.aggregator:
+            # windows are closed by lines' time only
+            plug_obj.aggregator.use_wall_clock = False
+            plug_obj.prepare_pool()
+
+
+    def throttle(self):
+        '''Sleeps to keep lines' rate (if limited)
+        '''
+        if not self.max_lines_rate:
+            return
+        ahead_secs = \
+            self.lines / self.max_lines_rate - (time.time() - self.start_ts)
+        if ahead_secs > 0:
+            time.sleep(ahead_secs)
+
+
+    def report(self, force=False):
+        '''Logs replay throughput
+        '''
+        now_ts = time.time()
+        if not force and now_ts < self.report_ts:
+            return
+        self.report_ts = now_ts + REPORT_SECS
+        elapsed = max(now_ts - self.start_ts, 1e-9)
+        points = self.channel.stats()['points_in']
+        LOG.info(
+            'Replayed: %d lines (%.1f MB), %d points in %.1fs: '
+            '%.0f lines/s, %.0f points/s', self.lines, self.bytes / 1e6,
+            points, elapsed, self.lines / elapsed, points / elapsed)
+
+
+    def replay_file(self, fpath, label=None):
+        '''Replays a file
+        '''
+        LOG.info('Replaying: %s (label: %s)', fpath, label)
+        if label:
+            self.plug_obj.file_labels[fpath] = label
+        for block in iter_blocks(fpath, self.block_bytes):
+            self.plug_obj.decay_limiters(time.time())
+            self.plug_obj.publish_data([(fpath, [block])])
+            if self.cursor:
+                self.cursor.get_batches()
+            self.lines += block.count(b'\n')
+            self.bytes += len(block)
+            self.report()
+            self.throttle()
+
+
+    def run(self, fpaths, labels=None):
+        '''Replays files (in order), flushes the aggregates
+        '''
+        self.start_ts = self.report_ts = time.time()
+        self.report_ts += REPORT_SECS
+        for fpath in fpaths:
+            self.replay_file(fpath, (labels or {}).get(fpath))
+        if self.plug_obj.aggregator:
+            self.plug_obj.aggregate_metrics(None, force=True)
+        if self.plug_obj.pool:
+            self.plug_obj.pool.shutdown()
+        if self.cursor:
+            self.cursor.get_batches()
+        self.report(force=True)
+
+
+def parse_args():
+    '''Parses command line arguments
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('config', help='config file')
+    parser.add_argument(
+        'section', help='log_watch input section name (e.g. input:access_log)')
+    parser.add_argument(
+        'fpaths', nargs='+', metavar='fpath',
+        help='log file (plain or .gz) to replay, the oldest first')
+    parser.add_argument(
+        '-r', '--max-lines-rate', type=float, default=0.0,
+        help='replay at most that many lines per second (default: no limit)')
+    parser.add_argument(
+        '-b', '--block-bytes', type=int, default=4 * 1024 * 1024,
+        help='bytes parsed at a time (default: %(default)s)')
+    parser.add_argument(
+        '-n', '--no-outputs', action='store_true',
+        help='parse only (benchmark), do not push to outputs')
+
+    return parser.parse_args()
+
+
+def start_outputs(cfg, channel):
+    '''Starts (all configured) outputs, returns them
+    '''
+    outputs = []
+    for section_name, section_proxy in cfg.items():
+        if not section_name.startswith('output:'):
+            continue
+        plug_name = section_proxy['plugin']
+        if plug_name not in OUTPUT_PLUGINS:
+            raise RuntimeError('Unknown plugin: %s' % repr(plug_name))
+        # no max_lag: lagging outputs slow the replay down instead
+        queue = channel.subscribe(section_name.split(':', 1)[1])
+        outputs.append(OUTPUT_PLUGINS[plug_name](section_proxy, queue))
+    for plug_obj in outputs:
+        plug_obj.daemon = False
+        plug_obj.start()
+
+    return outputs
+
+
+def stop_outputs(outputs, channel):
+    '''Waits (a while) for outputs to read all batches, stops them
+    '''
+    stop_ts = time.time() + DRAIN_SECS
+    while time.time() < stop_ts and \
+            any(cursor.stats()['lag_points'] for cursor in channel.cursors):
+        time.sleep(0.1)
+    channel.close()
+    for plug_obj in outputs:
+        plug_obj.stop()
+    for plug_obj in outputs:
+        plug_obj.join()
+
+
+def main():
+    '''Main method
+    '''
+    args = parse_args()
+    config_logger(logging.INFO)
+    cfg = load_config(args.config)
+    section_name = args.section
+    if section_name not in cfg:
+        section_name = 'input:' + section_name
+    section_proxy = cfg[section_name]
+    plug_cls = INPUT_PLUGINS.get(section_proxy.get('plugin'))
+    if plug_cls is None or not issubclass(plug_cls, LogWatch):
+        raise RuntimeError('Not a log_watch section: %s' % repr(args.section))
+
+    cursor = None
+    outputs = []
+    if args.no_outputs:
+        channel = BatchChannel()
+        cursor = channel.subscribe('replay')
+    else:
+        # outputs slow the replay down (instead of losing metrics)
+        channel = BatchChannel(
+            capacity=int(cfg['DEFAULT'].get('channel_capacity', 0)) or 1000000,
+            policy='block')
+        outputs = start_outputs(cfg, channel)
+
+    plug_obj = plug_cls(section_proxy, channel)
+    replay = Replay(
+        plug_obj, channel, args.max_lines_rate, args.block_bytes, cursor)
+    replay.prepare()
+    live_fpaths = [
+        fpath.strip() for fpath in section_proxy['log_fpath'].split(',')]
+    replay.run(args.fpaths, {
+        fpath: file_label(live_fpaths, fpath) for fpath in args.fpaths})
+    stop_outputs(outputs, channel)
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim: ts=4:sw=4:et:fdm=indent:ff=unix
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+'''Central inputs scheduler module
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metricol.commons import ManageableThread
+
+
+LOG = logging.getLogger(__name__)
+
+
+def next_tick(now_ts, period):
+    '''Returns the first wall-clock aligned period boundary after now
+    '''
+    return (now_ts // period + 1) * period
+
+
+class Scheduler(ManageableThread):
+    '''Fires periodic inputs at wall-clock aligned period boundaries on
+    a bounded pool of worker threads
+    '''
+    LATE_SECS = 1.0
+
+    def __init__(self, workers=4):
+        super(Scheduler, self).__init__(name='scheduler')
+        self.workers = workers
+        self.executor = None
+        self.plugins = []
+        self._heap = []
+        self._seq = itertools.count()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stats = {
+            'ticks': 0,
+            'late': 0,
+            'skipped': 0,
+            'failed': 0,
+        }
+
+
+    def add(self, plugin):
+        '''Adds (not yet prepared) input plugin
+        '''
+        self.plugins.append(plugin)
+
+
+    def prepare_things(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        now_ts = time.time()
+        for plugin in self.plugins:
+            plugin.prepare_things()
+            heapq.heappush(self._heap, (
+                next_tick(now_ts, plugin.period), next(self._seq), plugin))
+        LOG.info(
+            'Scheduled inputs: %s, workers: %s',
+            len(self.plugins), self.workers)
+
+
+    def do_things(self):
+        '''Fires all due inputs and reschedules them
+        '''
+        now_ts = time.time()
+        while self._heap and self._heap[0][0] <= now_ts:
+            due_ts, _, plugin = heapq.heappop(self._heap)
+            self.fire(plugin, due_ts, now_ts)
+            missed = int((now_ts - due_ts) // plugin.period)
+            if missed:
+                with self._lock:
+                    self._stats['skipped'] += missed
+                LOG.warning('%s: skipped ticks: %s', plugin.getName(), missed)
+            heapq.heappush(self._heap, (
+                due_ts + (missed + 1) * plugin.period, next(self._seq), plugin))
+
+
+    def fire(self, plugin, due_ts, now_ts):
+        '''Submits input's tick to the workers pool
+        '''
+        with self._lock:
+            if plugin in self._running:
+                self._stats['skipped'] += 1
+                LOG.warning('%s: still running, tick skipped', plugin.getName())
+                return
+            self._running.add(plugin)
+            self._stats['ticks'] += 1
+            if now_ts - due_ts > self.LATE_SECS:
+                self._stats['late'] += 1
+                LOG.warning(
+                    '%s: late tick: %.3fs', plugin.getName(), now_ts - due_ts)
+
+        future = self.executor.submit(plugin.do_things, int(due_ts))
+        future.add_done_callback(lambda fut: self.finish(plugin, fut))
+
+
+    def finish(self, plugin, future):
+        '''Handles input's tick completion
+        '''
+        with self._lock:
+            self._running.discard(plugin)
+            if future.cancelled():
+                return
+            exc = future.exception()
+            if exc:
+                self._stats['failed'] += 1
+        if exc:
+            LOG.error('%s @ %s', repr(exc), plugin.getName())
+
+
+    def stop_things(self):
+        self._wakeup.set()
+        for plugin in self.plugins:
+            plugin.keep_running = False
+            plugin.stop_things()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+
+    def stats(self):
+        '''Returns scheduler counters
+        '''
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running'] = len(self._running)
+
+        return stats
+
+
+    def run(self):
+        self.prepare_things()
+        while self.keep_running:
+            self.do_things()
+            timeout = None
+            if self._heap:
+                timeout = max(0.0, self._heap[0][0] - time.time())
+            self._wakeup.wait(timeout)
+
+        LOG.info('%s thread exiting...', self.getName())
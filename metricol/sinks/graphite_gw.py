@@ -13,8 +13,9 @@ from __future__ import (
 
 import logging
 import sys
-from queue import Queue
 
+from metricol.channels import BatchChannel, MetricBatch
+from metricol.inputs import MetricInput
 from metricol.outputs.graphite_gw import GraphiteGateway as GraphiteGatewayOutput
 
 
@@ -24,16 +25,33 @@ LOG = logging.getLogger(__name__)
 class GraphiteGateway(GraphiteGatewayOutput):
     '''Graphite gateway sink class
     '''
-    def get_metrics(self):
-        '''Puts metrics on a queue
+    def get_metrics(self, channel):
+        '''Puts metrics on a channel
         '''
+        batches = {}
         for metric in sys.stdin.read().split('\n'):
-            if metric and metric.count('|') == 2:
-                self.queue.put(metric.split('|'))
-
-    def get_metric_line(self, metric_data):
-        _key, _val, _ts = metric_data
-        return ' '.join([self.cfg['prefix'] + _key, _val, _ts])
+            if not metric or metric.count('|') != 2:
+                continue
+            _key, _val, _ts = metric.split('|')
+            try:
+                _val = float(_val)
+            except ValueError:
+                LOG.warning('Not a number: %s', repr(metric))
+                continue
+            batch = batches.get(_ts)
+            if batch is None:
+                batch = batches[_ts] = MetricBatch(_ts)
+            batch.add(_key, _val, MetricInput.METRIC_TYPE_GAUGE)
+        for batch in batches.values():
+            channel.put(batch)
+
+    def get_metric_name(self, key, type_code):
+        name = self.names.get(key)
+        if name is None:
+            name = self.names.put(key, bytes(
+                self.cfg['prefix'] + key + ' ', encoding='utf-8'))
+
+        return name
 
 
 def main():
@@ -45,11 +63,11 @@ def main():
 
     section_name = 'sink:graphite_gw'
     section_proxy = cfg[section_name]
-    output_queue = Queue()
+    output_queue = BatchChannel()
 
-    plug_obj = GraphiteGateway(section_proxy, output_queue)
+    plug_obj = GraphiteGateway(section_proxy, output_queue.subscribe('sink'))
     plug_obj.daemon = False
-    plug_obj.get_metrics()
+    plug_obj.get_metrics(output_queue)
     plug_obj.start()
     plug_obj.stop()
 
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+'''Streaming quantile sketch module
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import logging
+import math
+
+
+LOG = logging.getLogger(__name__)
+
+
+class QuantileSketch(object):
+    '''Mergeable quantile sketch (DDSketch-like logarithmic buckets)
+
+    Values are counted in buckets growing by (1 + accuracy) / (1 - accuracy)
+    factor so any quantile is estimated within `accuracy` relative error;
+    the number of buckets is capped (the lowest buckets are collapsed) which
+    keeps memory constant regardless of the number of values.
+    '''
+    __slots__ = ('gamma', 'multiplier', 'min_value', 'max_buckets',
+                 'buckets', 'zero_count', 'count')
+
+    def __init__(self, accuracy=0.01, max_buckets=2048, min_value=1e-9):
+        self.gamma = (1.0 + accuracy) / (1.0 - accuracy)
+        self.multiplier = 1.0 / math.log(self.gamma)
+        self.min_value = min_value
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+
+    def add(self, val):
+        '''Adds a value
+        '''
+        self.count += 1
+        if val <= self.min_value:
+            self.zero_count += 1
+            return
+
+        idx = int(math.ceil(math.log(val) * self.multiplier))
+        buckets = self.buckets
+        buckets[idx] = buckets.get(idx, 0) + 1
+        if len(buckets) > self.max_buckets:
+            self.collapse()
+
+
+    def collapse(self):
+        '''Collapses the lowest buckets (keeps up to max_buckets)
+        '''
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self.max_buckets
+        if excess <= 0:
+            return
+        count = sum(self.buckets.pop(idx) for idx in indexes[:excess])
+        self.buckets[indexes[excess]] += count
+
+
+    def merge(self, other):
+        '''Merges other sketch (of the same accuracy) into this one
+        '''
+        for idx, count in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.collapse()
+
+
+    def quantiles(self, quantiles):
+        '''Returns estimated values of (ascending) quantiles (0.0 - 1.0)
+        '''
+        if not self.count:
+            return []
+
+        values = []
+        ranks = [quantile * (self.count - 1) for quantile in quantiles]
+        rank_idx = 0
+        seen = self.zero_count
+        while rank_idx < len(ranks) and ranks[rank_idx] < seen:
+            values.append(0.0)
+            rank_idx += 1
+        for idx in sorted(self.buckets):
+            if rank_idx >= len(ranks):
+                break
+            seen += self.buckets[idx]
+            while rank_idx < len(ranks) and ranks[rank_idx] < seen:
+                values.append(2.0 * self.gamma ** idx / (self.gamma + 1.0))
+                rank_idx += 1
+
+        return values
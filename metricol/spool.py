@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+'''On-disk spool module
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import logging
+import os
+import struct
+import threading
+from collections import deque
+
+
+LOG = logging.getLogger(__name__)
+
+RECORD_HDR = struct.Struct('>I')
+
+
+class Spool(object):
+    '''Bounded spool of records kept in segmented append-only files
+
+    Records are read (replayed) oldest first; when the spool grows over its
+    size cap the oldest segments are evicted.
+    '''
+    HEAD_FNAME = 'head'
+    SEGMENT_FMT = '%016d.spool'
+
+    def __init__(self, spool_dir, max_bytes=256 * 1024 * 1024,
+                 segment_bytes=4 * 1024 * 1024):
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.segments = deque()
+        self.total_bytes = 0
+        self.head_seq = self.head_offset = 0
+        self.tail_fd = None
+        self._next_offset = None
+        # segments are read by the self-stats thread too
+        self._lock = threading.Lock()
+        self._stats = {
+            'spooled': 0,
+            'replayed': 0,
+            'evicted': 0,
+            'evicted_bytes': 0,
+        }
+        os.makedirs(spool_dir, exist_ok=True)
+        self.load()
+
+
+    def segment_path(self, seq):
+        '''Returns segment file path
+        '''
+        return os.path.join(self.spool_dir, self.SEGMENT_FMT % seq)
+
+
+    def load(self):
+        '''Loads segments list and head (read position) checkpoint
+        '''
+        for fname in sorted(os.listdir(self.spool_dir)):
+            if fname.endswith('.spool') and fname[:-6].isdigit():
+                size = os.path.getsize(os.path.join(self.spool_dir, fname))
+                self.segments.append([int(fname[:-6]), size])
+                self.total_bytes += size
+        try:
+            fpath = os.path.join(self.spool_dir, self.HEAD_FNAME)
+            with open(fpath, 'r') as fd_obj:
+                self.head_seq, self.head_offset = [
+                    int(val) for val in fd_obj.read().split()]
+        except (IOError, OSError, ValueError):
+            self.head_seq = self.head_offset = 0
+
+        while self.segments and self.segments[0][0] < self.head_seq:
+            self.remove_segment()
+        if self.segments:
+            LOG.info(
+                'Spool %s: %s segment(s), %s bytes', self.spool_dir,
+                len(self.segments), self._depth())
+
+
+    def save_head(self):
+        '''Saves head (read position) checkpoint
+        '''
+        fpath = os.path.join(self.spool_dir, self.HEAD_FNAME)
+        with open(fpath + '.tmp', 'w') as fd_obj:
+            fd_obj.write('%d %d' % (self.head_seq, self.head_offset))
+        os.rename(fpath + '.tmp', fpath)
+
+
+    def remove_segment(self):
+        '''Removes the oldest segment
+        '''
+        seq, size = self.segments.popleft()
+        self.total_bytes -= size
+        if self.tail_fd and not self.segments:
+            self.tail_fd.close()
+            self.tail_fd = None
+        try:
+            os.unlink(self.segment_path(seq))
+        except OSError as exc:
+            LOG.warning('%s @ %s', repr(exc), repr(self.segment_path(seq)))
+        if seq == self.head_seq:
+            self.head_offset = 0
+
+
+    def _depth(self):
+        '''Returns spooled bytes (lock held)
+        '''
+        segments = self.segments
+        if segments and segments[0][0] == self.head_seq:
+            return self.total_bytes - self.head_offset
+
+        return self.total_bytes
+
+
+    def depth(self):
+        '''Returns number of spooled (not yet replayed) bytes
+        '''
+        with self._lock:
+            return self._depth()
+
+
+    def append(self, lines):
+        '''Spools a record made of lines
+        '''
+        data = b'\n'.join(lines)
+        if not data:
+            return
+
+        with self._lock:
+            self._append(data)
+
+
+    def _append(self, data):
+        '''Writes a record to the tail segment, evicts the oldest
+        segments over the size cap (lock held)
+        '''
+        if not self.tail_fd or self.segments[-1][1] >= self.segment_bytes:
+            if self.tail_fd:
+                self.tail_fd.close()
+            seq = self.head_seq + 1
+            if self.segments:
+                seq = self.segments[-1][0] + 1
+            self.tail_fd = open(self.segment_path(seq), 'ab')
+            self.segments.append([seq, 0])
+
+        self.tail_fd.write(RECORD_HDR.pack(len(data)) + data)
+        self.tail_fd.flush()
+        self.segments[-1][1] += RECORD_HDR.size + len(data)
+        self.total_bytes += RECORD_HDR.size + len(data)
+        self._stats['spooled'] += 1
+
+        while len(self.segments) > 1 and self._depth() > self.max_bytes:
+            self._stats['evicted'] += 1
+            self._stats['evicted_bytes'] += self.segments[0][1]
+            self.remove_segment()
+            LOG.warning('Spool %s: oldest segment evicted', self.spool_dir)
+
+
+    def read(self):
+        '''Returns the oldest spooled record (or None)
+        '''
+        with self._lock:
+            return self._read()
+
+
+    def _read(self):
+        '''Returns the oldest spooled record (lock held)
+        '''
+        while self.segments:
+            seq, size = self.segments[0]
+            if seq != self.head_seq:
+                self.head_seq, self.head_offset = seq, 0
+            if self.head_offset + RECORD_HDR.size <= size:
+                with open(self.segment_path(seq), 'rb') as fd_obj:
+                    fd_obj.seek(self.head_offset)
+                    length, = RECORD_HDR.unpack(fd_obj.read(RECORD_HDR.size))
+                    data = fd_obj.read(length)
+                if len(data) == length:
+                    self._next_offset = \
+                        self.head_offset + RECORD_HDR.size + length
+                    return data
+            # segment replayed (or truncated) completely
+            if len(self.segments) == 1 and self.tail_fd:
+                return None
+            self.remove_segment()
+            self.save_head()
+
+        return None
+
+
+    def commit(self):
+        '''Marks the last read record as replayed
+        '''
+        with self._lock:
+            if self._next_offset is None:
+                return
+            self.head_offset = self._next_offset
+            self._next_offset = None
+            self._stats['replayed'] += 1
+            self.save_head()
+
+
+    def close(self):
+        '''Closes the spool
+        '''
+        with self._lock:
+            if self.tail_fd:
+                self.tail_fd.close()
+                self.tail_fd = None
+
+
+    def stats(self):
+        '''Returns spool counters
+        '''
+        with self._lock:
+            stats = dict(self._stats)
+            stats['depth_bytes'] = self._depth()
+            stats['segments'] = len(self.segments)
+
+        return stats
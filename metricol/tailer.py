@@ -0,0 +1,729 @@
+# -*- coding: utf-8 -*-
+
+'''Log files follower module (inotify driven, polling as a fallback)
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import ctypes
+import ctypes.util
+import errno
+import glob
+import logging
+import os
+import re
+import select
+import struct
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+DIR_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+EVENT_HDR = struct.Struct('iIII')
+
+
+def split_lines(blocks):
+    '''Yields lines (memoryview slices, without newlines) of data blocks
+    '''
+    for block in blocks:
+        view = memoryview(block)
+        pos = 0
+        size = len(block)
+        while pos < size:
+            end = block.find(b'\n', pos)
+            if end < 0:
+                end = size
+            if end > pos:
+                yield view[pos:end]
+            pos = end + 1
+
+
+def split_chunks(blocks, chunk_bytes):
+    '''Yields chunks (of about chunk_bytes, ending with a newline) of data
+    blocks
+    '''
+    for block in blocks:
+        pos = 0
+        size = len(block)
+        while pos < size:
+            end = size
+            if pos + chunk_bytes < size:
+                end = block.find(b'\n', pos + chunk_bytes) + 1 or size
+            yield block if not pos and end == size else block[pos:end]
+            pos = end
+
+
+def glob_regex(pattern):
+    '''Returns compiled regex of a glob pattern (its wildcards are groups)
+    '''
+    regex = []
+    pos = 0
+    while pos < len(pattern):
+        char = pattern[pos]
+        pos += 1
+        if char == '*':
+            regex.append('([^/]*)')
+        elif char == '?':
+            regex.append('([^/])')
+        elif char == '[' and ']' in pattern[pos + 1:]:
+            end = pattern.index(']', pos + 1)
+            chars = pattern[pos:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex.append('([' + chars.replace('\\', '\\\\') + '])')
+            pos = end + 1
+        else:
+            regex.append(re.escape(char))
+
+    return re.compile(''.join(regex) + r'\Z')
+
+
+def glob_label(regex, fpath):
+    '''Returns label of a file matched by glob pattern's regex: its parts
+    matched by the wildcards (`*.access.log` gives `www_example_com` for
+    `www.example.com.access.log`) or None
+    '''
+    match = regex.match(fpath)
+    if match is None:
+        return None
+
+    return '_'.join(
+        part for part in match.groups() if part).replace('.', '_') or None
+
+
+def load_libc():
+    '''Returns libc with inotify functions (or None)
+    '''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        for func_name in [
+                'inotify_init1', 'inotify_add_watch', 'inotify_rm_watch']:
+            getattr(libc, func_name)
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+LIBC = load_libc()
+
+
+class Inotify(object):
+    '''Minimal (non-blocking) inotify instance
+    '''
+
+    def __init__(self):
+        if LIBC is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = LIBC.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+
+    def fileno(self):
+        '''Returns inotify file descriptor
+        '''
+        return self.fd
+
+
+    def add_watch(self, path, mask):
+        '''Adds (or updates) path's watch, returns watch descriptor
+        '''
+        wd = LIBC.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+
+        return wd
+
+
+    def read_events(self):
+        '''Returns a list of pending events: (wd, mask, name)
+        '''
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            pos = 0
+            while pos + EVENT_HDR.size <= len(data):
+                wd, mask, _, length = EVENT_HDR.unpack_from(data, pos)
+                pos += EVENT_HDR.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                events.append((wd, mask, name))
+
+        return events
+
+
+    def close(self):
+        '''Closes inotify instance
+        '''
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FileTailer(object):
+    '''Follows a file by its name (like `tail --follow=name --retry`)
+
+    Handles rename (the rest of the old file is read first) and truncate
+    rotations (also when the file was rewritten past the read offset since:
+    its first bytes are compared); the read offset can be checkpointed to a
+    file so following can be resumed (without rereading or skipping lines)
+    after a restart.
+    '''
+    HEAD_BYTES = 64
+
+    def __init__(self, fpath, checkpoint_fpath=None, start_at_end=True,
+                 block_size=1024 * 1024, max_read_bytes=16 * 1024 * 1024):
+        self.fpath = fpath
+        self.checkpoint_fpath = checkpoint_fpath
+        self.start_at_end = start_at_end
+        self.block_size = block_size
+        self.max_read_bytes = max_read_bytes
+        self.fd = None
+        self.file_id = None
+        # offset of the end of the last complete line read
+        self.offset = 0
+        # partial trailing line (read past the offset)
+        self.partial = b''
+        # the first bytes of the file (truncation detection)
+        self.head = b''
+        self.more = False
+        self._saved = None
+        self._stats = {
+            'lines': 0,
+            'bytes': 0,
+            'rotations': 0,
+            'truncations': 0,
+        }
+
+
+    def stat_file(self):
+        '''Returns followed file's stat (or None)
+        '''
+        try:
+            return os.stat(self.fpath)
+        except OSError:
+            return None
+
+
+    def load_checkpoint(self):
+        '''Returns checkpointed ((dev, inode), offset) (or None)
+        '''
+        if not self.checkpoint_fpath:
+            return None
+        try:
+            with open(self.checkpoint_fpath, 'r') as fd_obj:
+                dev, ino, offset = [int(val) for val in fd_obj.read().split()]
+        except (IOError, OSError, ValueError):
+            return None
+
+        return (dev, ino), offset
+
+
+    def position(self):
+        '''Returns current read position: ((dev, inode), offset) (or None)
+        '''
+        if self.fd is None:
+            return None
+
+        return self.file_id, self.offset
+
+
+    def save_checkpoint(self, state=None):
+        '''Saves read position (current one by default) checkpoint (if
+        changed)
+        '''
+        if state is None:
+            state = self.position()
+        if not self.checkpoint_fpath or state is None:
+            return
+        if state == self._saved:
+            return
+        try:
+            with open(self.checkpoint_fpath + '.tmp', 'w') as fd_obj:
+                fd_obj.write('%d %d %d' % (state[0] + (state[1],)))
+            os.rename(self.checkpoint_fpath + '.tmp', self.checkpoint_fpath)
+        except (IOError, OSError) as exc:
+            LOG.warning('%s @ %s', repr(exc), repr(self.checkpoint_fpath))
+            return
+        self._saved = state
+
+
+    def find_rotated(self, file_id):
+        '''Returns path of a (renamed) file with given id (or None)
+        '''
+        dpath, fname = os.path.split(self.fpath)
+        try:
+            names = os.listdir(dpath or '.')
+        except OSError:
+            return None
+        for name in sorted(names):
+            if not name.startswith(fname) or name == fname:
+                continue
+            fpath = os.path.join(dpath, name)
+            try:
+                stat = os.stat(fpath)
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) == file_id:
+                return fpath
+
+        return None
+
+
+    def open_file(self, fpath, offset):
+        '''Opens file for reading at given offset
+        '''
+        try:
+            fd_obj = open(fpath, 'rb', buffering=0)
+        except (IOError, OSError) as exc:
+            LOG.warning('%s @ %s', repr(exc), repr(fpath))
+            return False
+        stat = os.fstat(fd_obj.fileno())
+        if offset > stat.st_size:
+            offset = 0
+        fd_obj.seek(offset)
+        self.close()
+        self.fd = fd_obj
+        self.file_id = (stat.st_dev, stat.st_ino)
+        self.offset = offset
+        self.partial = b''
+        self.head = b''
+        LOG.info('Following: %s (from: %s)', fpath, offset)
+        return True
+
+
+    def open(self):
+        '''Starts following (resumes from checkpoint when possible)
+        '''
+        stat = self.stat_file()
+        checkpoint = self.load_checkpoint()
+        if checkpoint:
+            file_id, offset = checkpoint
+            if stat and (stat.st_dev, stat.st_ino) == file_id:
+                self.open_file(self.fpath, offset)
+                return
+            # file was rotated while not followed: the rest of it goes first
+            rotated_fpath = self.find_rotated(file_id)
+            if rotated_fpath:
+                self.open_file(rotated_fpath, offset)
+                return
+            if stat:
+                self.open_file(self.fpath, 0)
+            return
+
+        if stat:
+            self.open_file(self.fpath, stat.st_size if self.start_at_end else 0)
+
+
+    def read_block(self, final=False):
+        '''Returns a block of complete lines read (in bulk) from the opened
+        file; a partial trailing line is carried over to the next read
+        (or returned when final)
+        '''
+        self.more = False
+        if self.fd is None:
+            return b''
+
+        chunks = [self.partial]
+        size = 0
+        while size < self.max_read_bytes:
+            chunk = self.fd.read(self.block_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        else:
+            self.more = True
+        if not size and not final:
+            return b''
+
+        data = b''.join(chunks)
+        end = len(data) if final else data.rfind(b'\n') + 1
+        self.partial = data[end:]
+        if not end:
+            return b''
+
+        self.offset += end
+        self._stats['lines'] += data.count(b'\n', 0, end)
+        self._stats['bytes'] += end
+        return data[:end] if end < len(data) else data
+
+
+    def check_truncation(self):
+        '''Checks opened file for truncation (also when it was rewritten past
+        the read offset since: its first bytes differ), rewinds it
+        '''
+        if self.fd is None:
+            return
+        fileno = self.fd.fileno()
+        try:
+            truncated = \
+                os.fstat(fileno).st_size < self.offset + len(self.partial) or \
+                bool(self.head) and \
+                os.pread(fileno, len(self.head), 0) != self.head
+        except OSError as exc:
+            LOG.warning('%s @ %s', repr(exc), repr(self.fpath))
+            return
+
+        if truncated:
+            self._stats['truncations'] += 1
+            LOG.info('Truncated: %s', self.fpath)
+            self.fd.seek(0)
+            self.offset = 0
+            self.partial = b''
+            self.head = b''
+
+
+    def read_head(self):
+        '''Remembers the first bytes of opened file (once there are some)
+        '''
+        if self.fd is None or not self.offset or \
+                len(self.head) >= self.HEAD_BYTES:
+            return
+        try:
+            self.head = os.pread(self.fd.fileno(), self.HEAD_BYTES, 0)
+        except OSError as exc:
+            LOG.warning('%s @ %s', repr(exc), repr(self.fpath))
+
+
+    def check(self):
+        '''Checks file for rotation, returns lines read from the old file
+        when it was switched to a new one
+        '''
+        stat = self.stat_file()
+        if stat is None:
+            return b''
+
+        if (stat.st_dev, stat.st_ino) != self.file_id:
+            block = self.read_block(final=True)
+            if self.fd is not None:
+                self._stats['rotations'] += 1
+                LOG.info('Rotated: %s', self.fpath)
+            self.open_file(self.fpath, 0)
+            return block
+
+        return b''
+
+
+    def read(self):
+        '''Returns blocks of newly appended lines (following rotations)
+        '''
+        self.check_truncation()
+        blocks = [self.read_block()]
+        if not self.more:
+            blocks.append(self.check())
+            blocks.append(self.read_block())
+        self.read_head()
+
+        return [block for block in blocks if block]
+
+
+    def close(self):
+        '''Closes followed file
+        '''
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+
+    def stats(self):
+        '''Returns tailer counters
+        '''
+        stats = dict(self._stats)
+        stats['offset'] = self.offset
+
+        return stats
+
+
+class LogFollower(object):
+    '''Follows a set of files, woken up by inotify events on their
+    directories (or by a periodic scan when inotify is not available)
+
+    Paths can be glob patterns: files matching them are followed as they
+    appear (new ones from their start) and forgotten (once read up to their
+    ends) when they disappear.
+    '''
+
+    def __init__(self, fpaths, checkpoint_dir=None, name='', start_at_end=True,
+                 use_inotify=True, scan_secs=1.0, **tailer_kwargs):
+        self.scan_secs = scan_secs
+        self.checkpoint_dir = checkpoint_dir
+        self.name = name
+        self.start_at_end = start_at_end
+        self.tailer_kwargs = tailer_kwargs
+        self.tailers = {}
+        # glob patterns (compiled) and labels of files matched by them
+        self.patterns = {}
+        self.labels = {}
+        for fpath in fpaths:
+            if glob.has_magic(fpath):
+                self.patterns[fpath] = glob_regex(fpath)
+            else:
+                self.add_file(fpath)
+        self.inotify = None
+        self.watches = {}
+        self.sel_poll = select.poll()
+        self.scan_ts = 0.0
+        self.checkpoint_ts = 0.0
+        self.use_inotify = use_inotify
+
+
+    def add_file(self, fpath, pattern=None, start_at_end=None):
+        '''Adds a file to be followed, returns its tailer
+        '''
+        checkpoint_fpath = None
+        if self.checkpoint_dir:
+            checkpoint_fpath = os.path.join(self.checkpoint_dir, (
+                self.name + fpath).replace(os.sep, '_') + '.offset')
+        if start_at_end is None:
+            start_at_end = self.start_at_end
+        tailer = self.tailers[fpath] = FileTailer(
+            fpath, checkpoint_fpath, start_at_end, **self.tailer_kwargs)
+        if pattern:
+            self.labels[fpath] = glob_label(self.patterns[pattern], fpath)
+
+        return tailer
+
+
+    def watch_dir(self, dpath):
+        '''Watches directory for files' events (if not watched yet)
+        '''
+        if self.inotify is None or dpath in self.watches.values():
+            return
+        try:
+            wd = self.inotify.add_watch(dpath or '.', DIR_WATCH_MASK)
+        except OSError as exc:
+            LOG.warning('%s @ %s', repr(exc), repr(dpath))
+            return
+        self.watches[wd] = dpath
+
+
+    def match_pattern(self, fpath):
+        '''Returns glob pattern matching file path (or None)
+        '''
+        for pattern, regex in self.patterns.items():
+            if regex.match(fpath):
+                return pattern
+
+        return None
+
+
+    def discover(self, start_at_end=False):
+        '''Starts following new files matching glob patterns, returns their
+        tailers
+        '''
+        followed = set(
+            tailer.file_id for tailer in self.tailers.values()
+            if tailer.fd is not None)
+        tailers = []
+        for pattern in self.patterns:
+            for fpath in sorted(glob.glob(pattern)):
+                if fpath in self.tailers or not os.path.isfile(fpath):
+                    continue
+                stat = os.stat(fpath)
+                if (stat.st_dev, stat.st_ino) in followed:
+                    # renamed (rotated) file still read by its tailer
+                    continue
+                tailer = self.add_file(fpath, pattern, start_at_end)
+                self.watch_dir(os.path.dirname(fpath))
+                tailer.open()
+                tailers.append(tailer)
+
+        return tailers
+
+
+    def open(self):
+        '''Starts following files
+        '''
+        if self.checkpoint_dir:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+        if self.use_inotify:
+            try:
+                self.inotify = Inotify()
+                self.sel_poll.register(self.inotify, select.POLLIN)
+            except OSError as exc:
+                LOG.warning('%s (falling back to polling)', repr(exc))
+                self.close_inotify()
+        for dpath in set(os.path.dirname(fpath) for fpath in self.tailers):
+            self.watch_dir(dpath)
+        for pattern in self.patterns:
+            dpath = os.path.dirname(pattern)
+            if not glob.has_magic(dpath):
+                self.watch_dir(dpath)
+        for tailer in self.tailers.values():
+            tailer.open()
+        self.discover(self.start_at_end)
+
+
+    def close_inotify(self):
+        '''Closes inotify instance
+        '''
+        if self.inotify is None:
+            return
+        try:
+            self.sel_poll.unregister(self.inotify)
+        except KeyError:
+            pass
+        self.inotify.close()
+        self.inotify = None
+        self.watches = {}
+
+
+    def wait(self, timeout):
+        '''Waits (up to timeout secs) for files' changes, returns tailers
+        to be read
+        '''
+        # files not read up to their ends yet are read without waiting
+        behind = [tailer for tailer in self.tailers.values() if tailer.more]
+        if behind:
+            timeout = 0.0
+        now_ts = time.time()
+        if self.inotify is None:
+            time.sleep(max(0.0, min(timeout, self.scan_ts - now_ts)))
+            changed = behind
+        else:
+            changed = set(behind)
+            if self.sel_poll.poll(timeout * 1000):
+                for wd, mask, fname in self.inotify.read_events():
+                    if mask & IN_Q_OVERFLOW:
+                        return list(self.tailers.values())
+                    fpath = os.path.join(self.watches.get(wd, ''), fname)
+                    if fpath in self.tailers:
+                        changed.add(self.tailers[fpath])
+                    elif mask & (IN_CREATE | IN_MOVED_TO) and \
+                            self.match_pattern(fpath):
+                        changed.update(self.discover())
+            changed = list(changed)
+
+        now_ts = time.time()
+        if now_ts >= self.scan_ts:
+            # periodic full scan (safety net for missed events)
+            self.scan_ts = now_ts + self.scan_secs
+            self.discover()
+            return list(self.tailers.values())
+
+        return changed
+
+
+    def forget_gone(self, tailers):
+        '''Stops following disappeared files matched by glob patterns (read
+        up to their ends), returns their final blocks
+        '''
+        blocks = []
+        for tailer in tailers:
+            if tailer.fpath not in self.labels or tailer.more or \
+                    tailer.stat_file() is not None:
+                continue
+            block = tailer.read_block(final=True)
+            if block:
+                blocks.append(block)
+            tailer.save_checkpoint()
+            tailer.close()
+            del self.tailers[tailer.fpath]
+            del self.labels[tailer.fpath]
+            LOG.info('Forgotten: %s', tailer.fpath)
+
+        return blocks
+
+
+    def read(self, timeout):
+        '''Returns blocks of lines appended to followed files
+        '''
+        blocks = []
+        for _, file_blocks in self.read_files(timeout):
+            blocks.extend(file_blocks)
+
+        return blocks
+
+
+    def read_files(self, timeout):
+        '''Returns (path, blocks) pairs of lines appended to followed files
+        '''
+        files = []
+        tailers = self.wait(timeout)
+        for tailer in tailers:
+            blocks = tailer.read()
+            if self.labels:
+                blocks.extend(self.forget_gone([tailer]))
+            if blocks:
+                files.append((tailer.fpath, blocks))
+
+        return files
+
+
+    def label(self, fpath):
+        '''Returns label of a file (derived from its name by the glob pattern
+        it matched) or None
+        '''
+        return self.labels.get(fpath)
+
+
+    def positions(self):
+        '''Returns read positions of followed files
+        '''
+        return {
+            fpath: tailer.position() for fpath, tailer in self.tailers.items()}
+
+
+    def save_checkpoints(self, min_secs=0.0, positions=None):
+        '''Saves read positions (current ones by default) at most once per
+        min_secs
+        '''
+        now_ts = time.time()
+        if now_ts - self.checkpoint_ts < min_secs:
+            return
+        self.checkpoint_ts = now_ts
+        for fpath, tailer in self.tailers.items():
+            if positions is None:
+                tailer.save_checkpoint()
+            elif positions.get(fpath):
+                tailer.save_checkpoint(positions[fpath])
+
+
+    def close(self):
+        '''Stops following files
+        '''
+        self.close_inotify()
+        for tailer in self.tailers.values():
+            tailer.close()
+
+
+    def stats(self):
+        '''Returns follower counters
+        '''
+        # called from other threads: the followed files can change meanwhile
+        tailers = list(self.tailers.values())
+        stats = {
+            'files': len(tailers),
+            'inotify': int(self.inotify is not None),
+        }
+        for tailer in tailers:
+            for key, val in tailer.stats().items():
+                if key != 'offset':
+                    stats[key] = stats.get(key, 0) + val
+
+        return stats
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Benchmarks nginx access log parsing: pattern (regex) vs log_format
+tokenizer, on str lines and on bytes (memoryview) lines as read by log_watch
+with bytes_pattern
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import random
+import re
+import sys
+import time
+
+from metricol.commons import TimeDecoder
+from metricol.inputs.plugins.nginx_logs import parse_log_lines
+from metricol.tailer import split_lines
+
+
+PATTERN = (
+    r'\[(?P<time>[^\]]{25})\] "(?P<method>[A-Z]{1,7}) /(?P<uri>.*?) '
+    r'HTTP/(?P<http>[.0-2]{3})" (?P<status>[0-9]{3}) (?P<rbytes>[0-9]+)/'
+    r'(?P<bbytes>[0-9]+) (?P<uctim>[-.0-9]{1,5})/(?P<uhtim>[-.0-9]{1,5})/'
+    r'(?P<urtim>[-.0-9]{1,5})/(?P<rtime>[-.0-9]{1,5}) (?P<gzip>[-.0-9]{1,5}) '
+    r'(?P<pipe>[p.]) (?P<creqs>[0-9]+)')
+LOG_FORMAT = (
+    '$remote_addr - $remote_user [$time_iso8601] "$request" $status '
+    '$bytes_sent/$body_bytes_sent $upstream_connect_time/'
+    '$upstream_header_time/$upstream_response_time/$request_time '
+    '$gzip_ratio $pipe $connection_requests')
+LINE_FMT = (
+    '10.0.%d.%d - - [2026-10-17T10:%02d:%02d+00:00] "%s /%s HTTP/1.1" %s '
+    '%d/%d %s/%s/%s/%.3f %s %s %d')
+
+
+def make_lines(count):
+    '''Returns synthetic access log lines
+    '''
+    rnd = random.Random(count)
+    lines = []
+    for idx in range(count):
+        upstream = ['%.3f' % rnd.random(), '-'][idx % 7 == 0]
+        lines.append(LINE_FMT % (
+            idx % 256, idx % 199, idx // 6000 % 60, idx // 100 % 60,
+            rnd.choice(['GET', 'GET', 'POST', 'HEAD']),
+            rnd.choice(['api/v1/items', 'static/app.js', 'health', 'a/b/c']),
+            rnd.choice(['200', '200', '200', '304', '404', '502']),
+            rnd.randint(200, 90000), rnd.randint(0, 90000),
+            upstream, upstream, upstream, rnd.random(),
+            rnd.choice(['-', '2.51']), rnd.choice(['p', '.']),
+            rnd.randint(1, 100)))
+
+    return lines
+
+
+def bench(name, lines, pattern, **kwargs):
+    '''Parses lines, prints throughput, returns parsed data
+    '''
+    pattern_fn = re.compile(pattern).search
+    count = len(lines)
+    if isinstance(lines[0], bytes):
+        # memoryview slices of a single block
+        lines = list(split_lines([b'\n'.join(lines)]))
+    start_ts = time.time()
+    parsed = list(parse_log_lines(
+        lines, pattern_fn, decode_time=TimeDecoder('iso8601'), **kwargs))
+    elapsed = time.time() - start_ts
+    print('%-18s %8d lines %8.3fs %10.0f lines/s' % (
+        name, len(parsed), elapsed, count / elapsed))
+
+    return parsed
+
+
+def main():
+    '''Main method
+    '''
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    lines = make_lines(count)
+    bytes_lines = [bytes(line, encoding='utf-8') for line in lines]
+    bytes_pattern = bytes(PATTERN, encoding='utf-8')
+    results = [
+        bench('pattern', lines, PATTERN),
+        bench('log_format', lines, PATTERN, log_format=LOG_FORMAT),
+        bench('pattern (bytes)', bytes_lines, bytes_pattern),
+        bench('log_format (bytes)', bytes_lines, bytes_pattern,
+              log_format=LOG_FORMAT),
+    ]
+    if any(parsed != results[0] for parsed in results[1:]):
+        print('Parsed data differ!')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
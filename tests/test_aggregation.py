@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+'''Windowed metrics pre-aggregation tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+from metricol.aggregation import (
+    percentile_suffix, TimerFold, TimerSketch, WindowAggregator)
+from metricol.channels import TYPE_CODES
+
+
+def points(batches):
+    '''Returns (timestamp, key, value, type) tuples of batches
+    '''
+    return sorted(
+        (batch.tstamp, key, val, type_code)
+        for batch in batches for key, val, type_code in batch)
+
+
+def test_percentile_suffix():
+    assert percentile_suffix(99) == 'p99'
+    assert percentile_suffix(99.9) == 'p99_9'
+
+
+def test_timer_fold_merge():
+    fold, other = TimerFold(), TimerFold()
+    for val in (1, 5):
+        fold.add(val)
+    other.add(3)
+    fold.merge(other)
+    assert dict(fold.iter_values()) == {
+        'count': 3, 'sum': 9.0, 'min': 1, 'max': 5, 'mean': 3.0}
+    assert not list(TimerFold().iter_values())
+
+
+def test_timer_sketch_percentiles():
+    sketch = TimerSketch(percentiles=(50.0, 99.0), accuracy=0.01)
+    for val in range(1, 1001):
+        sketch.add(val)
+    values = dict(sketch.iter_values())
+    assert abs(values['p50'] - 500) <= 10
+    assert abs(values['p99'] - 990) <= 20
+    assert values['p99'] <= values['max'] == 1000
+
+
+def test_window_summaries_types():
+    aggregator = WindowAggregator(10, delay_secs=2, late_secs=30)
+    aggregator.extend([
+        ('c', 1, 'c', 100), ('c', 2, 'c', 105), ('g', 3, 'g', 101),
+        ('t', 5, 'ms', 101), ('t', 7, 'ms', 109)], 1000)
+    assert points(aggregator.flush(1000, force=True)) == sorted([
+        (100, 'c', 3.0, TYPE_CODES['c']),
+        (100, 'g', 3.0, TYPE_CODES['g']),
+        (100, 't.count', 2.0, TYPE_CODES['c']),
+        (100, 't.sum', 12.0, TYPE_CODES['g']),
+        (100, 't.min', 5.0, TYPE_CODES['g']),
+        (100, 't.max', 7.0, TYPE_CODES['g']),
+        (100, 't.mean', 6.0, TYPE_CODES['g']),
+    ])
+
+
+def test_window_closing_and_late_points():
+    aggregator = WindowAggregator(10, delay_secs=2, late_secs=30)
+    aggregator.extend([('c', 1, 'c', 100)], 1000)
+    assert not aggregator.flush(1000.5)
+    aggregator.extend([('c', 1, 'c', 112)], 1001)
+    assert points(aggregator.flush(1001.5)) == [
+        (100, 'c', 1.0, TYPE_CODES['c'])]
+
+    # late point: retained window is emitted again (counters' increments
+    # only), too late one dropped
+    aggregator.extend([('c', 10, 'c', 103), ('c', 1, 'c', 60)], 1002)
+    assert points(aggregator.flush(1002.5)) == [
+        (100, 'c', 10.0, TYPE_CODES['c'])]
+    stats = aggregator.stats()
+    assert stats['late_points'] == 2
+    assert stats['late_dropped'] == 1
+
+    # idle input: the wall-clock closes the window
+    assert points(aggregator.flush(1010)) == [
+        (110, 'c', 1.0, TYPE_CODES['c'])]
+
+
+def test_window_merge():
+    partial = WindowAggregator(10)
+    partial.extend([('c', 1, 'c', 100), ('t', 2, 'ms', 101)], 1000)
+    aggregator = WindowAggregator(10)
+    aggregator.extend([('c', 2, 'c', 100), ('t', 4, 'ms', 102)], 1000)
+    aggregator.merge(partial.windows, partial.max_ts, 2, 1000)
+    values = {
+        key: val for _, key, val, _ in points(
+            aggregator.flush(1000, force=True))}
+    assert values['c'] == 3.0
+    assert values['t.count'] == 2.0
+    assert values['t.mean'] == 3.0
+    assert aggregator.stats()['points_in'] == 4
+
+
+def test_late_timer_reemitted_as_increments():
+    aggregator = WindowAggregator(10, delay_secs=2, late_secs=30)
+    aggregator.extend([('t', 5, 'ms', 101), ('g', 1, 'g', 101)], 1000)
+    aggregator.extend([('c', 1, 'c', 112)], 1000)
+    assert len(points(aggregator.flush(1000))) == 6
+    aggregator.extend([('t', 1, 'ms', 102), ('c', 2, 'c', 102)], 1001)
+    assert points(aggregator.flush(1001)) == sorted([
+        (100, 'c', 2.0, TYPE_CODES['c']),
+        (100, 'g', 1.0, TYPE_CODES['g']),
+        (100, 't.count', 1.0, TYPE_CODES['c']),
+        (100, 't.sum', 6.0, TYPE_CODES['g']),
+        (100, 't.min', 1.0, TYPE_CODES['g']),
+        (100, 't.max', 5.0, TYPE_CODES['g']),
+        (100, 't.mean', 3.0, TYPE_CODES['g']),
+    ])
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+'''Metric series cardinality limiting tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+from metricol.cardinality import CardinalityLimiter, OTHER_VALUE
+
+
+def test_admits_frequent_values():
+    limiter = CardinalityLimiter(max_values=2, min_count=2)
+    assert limiter.limit('a') == OTHER_VALUE
+    assert limiter.limit('a') == 'a'
+    assert limiter.limit('b') == OTHER_VALUE
+    assert limiter.limit('b') == 'b'
+    assert limiter.limit('c') == OTHER_VALUE
+    assert limiter.limit('c') == OTHER_VALUE
+    stats = limiter.stats()
+    assert stats['admitted'] == 2
+    assert stats['values_in'] == 6
+    assert stats['values_other'] == 4
+
+
+def test_bulk_occurrences():
+    limiter = CardinalityLimiter(max_values=1, min_count=2)
+    assert limiter.limit('a', 5) == 'a'
+    assert limiter.limit('b', 5) == OTHER_VALUE
+    assert limiter.stats()['values_other'] == 5
+
+
+def test_bounded_summary():
+    limiter = CardinalityLimiter(max_values=2, tracked=4, min_count=1)
+    for idx in range(100):
+        limiter.limit('hot', 3)
+        limiter.limit('cold%d' % idx)
+    assert len(limiter.counts) <= 4
+    assert limiter.count('hot', 0) > 100
+
+
+def test_decay_reelects():
+    limiter = CardinalityLimiter(max_values=1, min_count=2, decay_secs=10)
+    limiter.limit('a', 4)
+    for _ in range(10):
+        limiter.limit('b')
+    assert limiter.limit('b') == OTHER_VALUE
+    limiter.decay(limiter.decay_ts)
+    assert limiter.limit('b') == 'b'
+    assert limiter.limit('a') == OTHER_VALUE
+    assert limiter.stats()['evicted'] == 1
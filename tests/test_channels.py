@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+'''Metrics channels tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import pytest
+
+from metricol.channels import (
+    BatchChannel, coalesce_batches, MetricBatch, TYPE_CODES)
+
+
+def points(batches):
+    '''Returns (timestamp, key, value, type) tuples of batches
+    '''
+    return [
+        (batch.tstamp, key, val, type_code)
+        for batch in batches for key, val, type_code in batch]
+
+
+def test_batch_columns():
+    batch = MetricBatch(10, [('a', 1, 'g'), ('b', 2.5, 'c'), ('c', 3, 'ms')])
+    batch.add('d', 'NaN?', 'g')
+    assert batch.points == len(batch) == 3
+    assert list(batch) == [
+        ('a', 1.0, TYPE_CODES['g']), ('b', 2.5, TYPE_CODES['c']),
+        ('c', 3.0, TYPE_CODES['ms'])]
+
+
+def test_batch_keys_interned():
+    key = ''.join(['a', '.b'])
+    first = MetricBatch(10, [(key, 1, 'g')])
+    second = MetricBatch(10, [(''.join(['a.', 'b']), 1, 'g')])
+    assert first.keys[0] is second.keys[0]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        BatchChannel(policy='spill')
+
+
+def test_broadcast():
+    channel = BatchChannel()
+    cursor_a = channel.subscribe('a')
+    cursor_b = channel.subscribe('b')
+    channel.put(MetricBatch(10, [('a', 1, 'g')]))
+    channel.put(MetricBatch(10))
+    assert points(cursor_a.get_batches()) == [(10, 'a', 1.0, 0)]
+    assert channel.stats()['batches_pending'] == 1
+    assert points(cursor_b.get_batches()) == [(10, 'a', 1.0, 0)]
+    assert channel.stats()['batches_pending'] == 0
+
+
+def test_read_max_points():
+    channel = BatchChannel()
+    cursor = channel.subscribe('a')
+    for tstamp in range(3):
+        channel.put(MetricBatch(tstamp, [('a', 1, 'c'), ('b', 1, 'c')]))
+    assert len(cursor.get_batches(max_points=3)) == 1
+    assert len(cursor.get_batches(max_points=1)) == 1
+    assert cursor.stats()['lag_points'] == 2
+
+
+def test_drop_newest():
+    channel = BatchChannel(capacity=2, policy='drop_newest')
+    cursor = channel.subscribe('a')
+    for tstamp in range(3):
+        channel.put(MetricBatch(tstamp, [('a', 1, 'c')]))
+    assert [batch.tstamp for batch in cursor.get_batches()] == [0, 1]
+    assert channel.stats()['points_dropped'] == 1
+
+
+def test_drop_oldest():
+    channel = BatchChannel(capacity=2, policy='drop_oldest')
+    cursor = channel.subscribe('a')
+    for tstamp in range(3):
+        channel.put(MetricBatch(tstamp, [('a', 1, 'c')]))
+    assert [batch.tstamp for batch in cursor.get_batches()] == [1, 2]
+    assert cursor.stats()['points_dropped'] == 1
+
+
+def test_max_lag():
+    channel = BatchChannel()
+    slow = channel.subscribe('slow', max_lag=2)
+    fast = channel.subscribe('fast')
+    for tstamp in range(4):
+        channel.put(MetricBatch(tstamp, [('a', 1, 'c')]))
+    assert [batch.tstamp for batch in slow.get_batches()] == [2, 3]
+    assert [batch.tstamp for batch in fast.get_batches()] == [0, 1, 2, 3]
+
+
+def test_coalesce_batches():
+    merged = coalesce_batches([
+        MetricBatch(10, [('c', 1, 'c'), ('g', 1, 'g'), ('t', 1, 'ms')]),
+        MetricBatch(20, [('c', 2, 'c'), ('g', 2, 'g'), ('t', 2, 'ms')]),
+    ])
+    assert sorted(points(merged)) == sorted([
+        (10, 't', 1.0, TYPE_CODES['ms']),
+        (20, 't', 2.0, TYPE_CODES['ms']),
+        (20, 'c', 3.0, TYPE_CODES['c']),
+        (20, 'g', 2.0, TYPE_CODES['g']),
+    ])
+
+
+def test_coalesce_behind_slowest_cursor():
+    channel = BatchChannel(capacity=4, policy='coalesce')
+    slow = channel.subscribe('slow')
+    fast = channel.subscribe('fast')
+    for tstamp in range(2):
+        channel.put(MetricBatch(tstamp, [('a', 1, 'c'), ('b', 1, 'g')]))
+    assert len(fast.get_batches()) == 2
+    channel.put(MetricBatch(2, [('a', 1, 'c'), ('b', 2, 'g')]))
+    stats = channel.stats()
+    assert stats['points_coalesced'] == 2
+    assert stats['points_dropped'] == 0
+
+    assert sorted(points(slow.get_batches())) == sorted([
+        (1, 'a', 2.0, TYPE_CODES['c']), (1, 'b', 1.0, TYPE_CODES['g']),
+        (2, 'a', 1.0, TYPE_CODES['c']), (2, 'b', 2.0, TYPE_CODES['g'])])
+    assert points(fast.get_batches()) == [
+        (2, 'a', 1.0, TYPE_CODES['c']), (2, 'b', 2.0, TYPE_CODES['g'])]
+    assert channel.stats()['points_pending'] == 0
+
+
+def test_coalesce_falls_back_to_drop_oldest():
+    channel = BatchChannel(capacity=2, policy='coalesce')
+    cursor = channel.subscribe('a')
+    for tstamp in range(3):
+        channel.put(MetricBatch(tstamp, [('t', tstamp, 'ms')]))
+    assert points(cursor.get_batches()) == [
+        (1, 't', 1.0, TYPE_CODES['ms']), (2, 't', 2.0, TYPE_CODES['ms'])]
+
+
+def test_closed_channel_does_not_block():
+    channel = BatchChannel(capacity=1)
+    cursor = channel.subscribe('a')
+    channel.put(MetricBatch(0, [('a', 1, 'c')]))
+    channel.close()
+    channel.put(MetricBatch(1, [('a', 1, 'c')]))
+    assert [batch.tstamp for batch in cursor.get_batches()] == [0, 1]
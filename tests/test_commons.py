@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+'''Common helpers tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import time
+
+import dateutil.parser as du_parser
+import pytest
+
+from metricol.commons import parse_syslog, TimeDecoder, UriClassifier
+
+
+@pytest.fixture(autouse=True)
+def local_tz(monkeypatch):
+    '''Sets non-UTC local time zone (with DST) for a test
+    '''
+    monkeypatch.setenv('TZ', 'Europe/Warsaw')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def expected(value):
+    '''Returns timestamp parsed by dateutil
+    '''
+    return int(du_parser.parse(value).timestamp())
+
+
+@pytest.mark.parametrize('value, du_value', [
+    ('17/Oct/2026:10:00:00 +0200', '17 Oct 2026 10:00:00 +0200'),
+    ('17/Oct/2026:10:00:00 -0530', '17 Oct 2026 10:00:00 -0530'),
+    ('01/Jan/2026:00:00:59 +0000', '01 Jan 2026 00:00:59 +0000'),
+])
+def test_time_local(value, du_value):
+    decode_time = TimeDecoder('time_local')
+    assert decode_time(value) == expected(du_value)
+    assert decode_time.fallbacks == 0
+
+
+@pytest.mark.parametrize('value', [
+    '2026-10-17T10:00:00+02:00',
+    '2026-10-17T10:00:00-05:30',
+    '2026-10-17T10:00:00Z',
+    '2026-10-17T10:00:00.987+02:00',
+    '2026-10-17T10:00:00,5Z',
+    '2026-10-17 10:00:00+0200',
+    '2026-10-17T10:00:00',
+    '2026-01-17T10:00:00.25',
+])
+def test_iso8601(value):
+    decode_time = TimeDecoder('iso8601')
+    assert decode_time(value) == expected(value)
+    assert decode_time(bytes(value, encoding='ascii')) == expected(value)
+    assert decode_time.fallbacks == 0
+
+
+@pytest.mark.parametrize('value', [
+    '2026/10/17 10:00:00',
+    '2026/01/05 23:59:59',
+])
+def test_nginx_error(value):
+    decode_time = TimeDecoder('nginx_error')
+    assert decode_time(value) == expected(value)
+    assert decode_time.fallbacks == 0
+
+
+def fake_now(monkeypatch, value):
+    '''Makes the current time a local time parsed by dateutil
+    '''
+    now_ts = expected(value)
+    localtime = time.localtime
+    monkeypatch.setattr(time, 'time', lambda: now_ts)
+    monkeypatch.setattr(
+        time, 'localtime', lambda *args: localtime(*(args or (now_ts,))))
+
+
+def test_syslog_space_padded_day(monkeypatch):
+    fake_now(monkeypatch, '2026-10-17 12:00:00')
+    decode_time = TimeDecoder('syslog')
+    assert decode_time('Oct  7 10:00:00') == expected('2026-10-07 10:00:00')
+    assert decode_time('Oct 17 10:00:00') == expected('2026-10-17 10:00:00')
+    assert decode_time.fallbacks == 0
+
+
+def test_syslog_year_rollover(monkeypatch):
+    fake_now(monkeypatch, '2027-01-01 00:10:00')
+    assert parse_syslog('Dec 31 23:59:00', None) == \
+        expected('2026-12-31 23:59:00')
+    assert parse_syslog('Jan  1 00:05:00', None) == \
+        expected('2027-01-01 00:05:00')
+
+
+def test_auto_detection():
+    decode_time = TimeDecoder()
+    assert decode_time('2026/10/17 10:00:00') == \
+        expected('2026-10-17 10:00:00')
+    assert decode_time.formats[0] == 'nginx_error'
+    assert decode_time.fallbacks == 0
+
+
+def test_fallbacks():
+    decode_time = TimeDecoder('iso8601')
+    assert decode_time('17 Oct 2026 10:00:00 +0200') == \
+        expected('2026-10-17T10:00:00+02:00')
+    assert decode_time('garbage') is None
+    assert decode_time.fallbacks == 2
+    with pytest.raises(ValueError):
+        TimeDecoder('rfc2822')
+
+
+@pytest.mark.parametrize('routes', [
+    ['/users/<id>', '/users/me'],
+    ['/users/me', '/users/<id>'],
+])
+def test_uri_literal_precedence(routes):
+    classify_uri = UriClassifier(routes)
+    assert classify_uri('/users/me') == 'users_me'
+    assert classify_uri('/users/42') == 'users_id'
+    assert classify_uri('/users/42/posts') == '_other'
+
+
+def test_uri_backtracking():
+    classify_uri = UriClassifier(['/a/b/c', '/a/<x>/d', '/a/*'])
+    assert classify_uri('/a/b/c') == 'a_b_c'
+    assert classify_uri('/a/b/d') == 'a_x_d'
+    assert classify_uri('/a/b/e') == 'a'
+
+
+def test_uri_trailing_rest():
+    classify_uri = UriClassifier(['/static/*', '/api/v1/items'])
+    assert classify_uri('/static') == 'static'
+    assert classify_uri('/static/css/x.css') == 'static'
+    assert classify_uri('/api/v1') == '_other'
+    with pytest.raises(ValueError):
+        UriClassifier(['/a/*/b'])
+
+
+def test_uri_route_labels():
+    classify_uri = UriClassifier(
+        ['/x/<id> = things', '', ' /y.json ', '/ = home'], default='none')
+    assert classify_uri.routes == 3
+    assert classify_uri('/x/1?q=2') == 'things'
+    assert classify_uri('/y.json/') == 'y_json'
+    assert classify_uri('/') == 'home'
+    assert classify_uri('/z') == 'none'
+
+
+def test_uri_cache_lru():
+    classify_uri = UriClassifier(['/<name>'], cache_size=2)
+    for uri in ('/a', '/b', '/a?q=1', '/c', '/b'):
+        assert classify_uri(uri) == 'name'
+    stats = classify_uri.stats()
+    assert stats['size'] == 2
+    assert stats['hits'] == 1
+    assert stats['misses'] == 4
+    assert stats['evictions'] == 2
+    assert stats['hit_ratio'] == 0.2
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+'''nginx log line plugin tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import re
+
+import pytest
+
+from metricol.commons import TimeDecoder
+from metricol.inputs.plugins.nginx_logs import (
+    compile_log_format, parse_log_lines)
+
+
+PATTERN = (
+    r'\[(?P<time>[^\]]{25})\] "(?P<method>[A-Z]{1,7}) /(?P<uri>.*?) '
+    r'HTTP/(?P<http>[.0-2]{3})" (?P<status>[0-9]{3}) (?P<rbytes>[0-9]+)/'
+    r'(?P<bbytes>[0-9]+) (?P<rtime>[-.0-9]{1,5}) (?P<pipe>[p.])')
+LOG_FORMAT = (
+    '$remote_addr - $remote_user [$time_iso8601] "$request" $status '
+    '$bytes_sent/$body_bytes_sent $request_time $pipe')
+FREE_TEXT_FORMAT = (
+    '[$time_iso8601] "$request" $status $bytes_sent/$body_bytes_sent '
+    '$request_time $pipe "$http_user_agent"')
+LINES = [
+    '10.0.0.1 - - [2026-10-17T10:00:00+00:00] "GET /api/v1/items HTTP/1.1" 200 '
+    '512/100 0.005 p',
+    '10.0.0.2 - - [2026-10-17T10:00:01+00:00] "POST /x HTTP/2.0" 502 '
+    '300/0 - .',
+]
+EXPECTED = [
+    (0, (1792231200, {
+        'method': 'GET', 'uri': 'v1', 'http': '1_1', 'status': '200',
+        'rbytes': 512, 'bbytes': 100, 'rtime': 0.005, 'pipe': 'p'})),
+    (1, (1792231201, {
+        'method': 'POST', 'uri': '_other', 'http': '2_0', 'status': '502',
+        'rbytes': 300, 'bbytes': 0})),
+]
+
+
+def parse(lines, pattern=PATTERN, **kwargs):
+    '''Returns parsed lines
+    '''
+    return list(parse_log_lines(
+        lines, re.compile(pattern).search, decode_time=TimeDecoder('iso8601'),
+        **kwargs))
+
+
+def test_pattern():
+    assert parse(LINES) == EXPECTED
+
+
+@pytest.mark.parametrize('as_bytes', [False, True])
+def test_log_format(as_bytes):
+    # pattern matching nothing: all lines have to be tokenized
+    lines = LINES
+    pattern = r'\Z.'
+    if as_bytes:
+        lines = [memoryview(bytes(line, encoding='utf-8')) for line in LINES]
+        pattern = b'\\Z.'
+    assert parse(lines, pattern, log_format=LOG_FORMAT) == EXPECTED
+
+
+@pytest.mark.parametrize('as_bytes', [False, True])
+def test_free_text_format(as_bytes):
+    tokenize = compile_log_format(FREE_TEXT_FORMAT, as_bytes)
+    line = '[2026-10-17T10:00:00+00:00] "GET /a/b/c HTTP/1.0" 404 1/2 0.1 . ' \
+        '"Mozilla/5.0 (X11; Linux)"'
+    if as_bytes:
+        line = bytes(line, encoding='utf-8')
+    assert tokenize(line, TimeDecoder('iso8601')) == {
+        'time': 1792231200, 'method': 'GET', 'uri': 'b', 'http': '1_0',
+        'status': '404', 'rbytes': 1, 'bbytes': 2, 'rtime': 0.1}
+
+
+def test_log_format_fallback_to_pattern():
+    lines = [LINES[0].replace('200 512/100', '200 512 100')]
+    assert parse(lines, log_format=LOG_FORMAT) == []
+    assert parse(lines, r'\[(?P<time>[^\]]{25})\] "(?P<method>[A-Z]+)',
+                 log_format=LOG_FORMAT) == [
+                     (0, (1792231200, {'method': 'GET'}))]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+'''Collector's own metrics input tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import configparser
+
+from metricol.commons import STATS_PROVIDERS
+from metricol.inputs.self_stats import SelfStats
+
+
+def failing_stats():
+    '''Raises like a provider iterating a dict being changed
+    '''
+    raise RuntimeError('dictionary changed size during iteration')
+
+
+def test_failing_provider_skipped(monkeypatch):
+    for name in list(STATS_PROVIDERS):
+        monkeypatch.delitem(STATS_PROVIDERS, name)
+    parser = configparser.ConfigParser()
+    parser.read_dict({'input:self_stats': {'prefix': 'self.'}})
+    plugin = SelfStats(parser['input:self_stats'], None)
+    monkeypatch.setitem(STATS_PROVIDERS, 'broken', failing_stats)
+    monkeypatch.setitem(STATS_PROVIDERS, 'fine', lambda: {'a': 1})
+    assert plugin.fetch_data() == {'fine.a': 1}
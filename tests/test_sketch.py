@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+'''Quantile sketch tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import random
+
+from metricol.sketch import QuantileSketch
+
+
+QUANTILES = [0.0, 0.5, 0.9, 0.99, 1.0]
+
+
+def exact_quantiles(values, quantiles):
+    '''Returns exact (nearest rank) quantiles of values
+    '''
+    values = sorted(values)
+    return [values[int(quantile * (len(values) - 1))] for quantile in quantiles]
+
+
+def assert_within(estimates, exact, accuracy):
+    '''Checks relative error of estimates
+    '''
+    for estimate, val in zip(estimates, exact):
+        assert abs(estimate - val) <= accuracy * val + 1e-9
+
+
+def test_empty():
+    assert QuantileSketch().quantiles(QUANTILES) == []
+
+
+def test_relative_accuracy():
+    rnd = random.Random(1)
+    values = [rnd.lognormvariate(0.0, 2.0) for _ in range(10000)]
+    sketch = QuantileSketch(accuracy=0.01)
+    for val in values:
+        sketch.add(val)
+    assert_within(
+        sketch.quantiles(QUANTILES), exact_quantiles(values, QUANTILES), 0.01)
+
+
+def test_zero_values():
+    sketch = QuantileSketch()
+    for val in [0.0, 0.0, 0.0, 5.0]:
+        sketch.add(val)
+    assert sketch.quantiles([0.5])[0] == 0.0
+
+
+def test_merge():
+    rnd = random.Random(2)
+    values = [rnd.uniform(1.0, 1000.0) for _ in range(4000)]
+    first, second = QuantileSketch(), QuantileSketch()
+    for idx, val in enumerate(values):
+        (first if idx % 2 else second).add(val)
+    first.merge(second)
+    assert first.count == len(values)
+    assert_within(
+        first.quantiles(QUANTILES), exact_quantiles(values, QUANTILES), 0.01)
+
+
+def test_bounded_buckets():
+    sketch = QuantileSketch(accuracy=0.01, max_buckets=64)
+    for exp in range(-20, 20):
+        sketch.add(10.0 ** exp)
+    assert len(sketch.buckets) <= 64
+    assert sketch.count == 40
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+'''On-disk spool tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+from metricol.spool import Spool
+
+
+def test_replay_order(tmpdir):
+    spool = Spool(str(tmpdir), segment_bytes=16)
+    for idx in range(5):
+        spool.append([b'a %d' % idx, b'b %d' % idx])
+    assert spool.stats()['segments'] > 1
+    records = []
+    while True:
+        record = spool.read()
+        if record is None:
+            break
+        records.append(record)
+        spool.commit()
+    assert records == [b'a %d\nb %d' % (idx, idx) for idx in range(5)]
+    assert spool.depth() == 0
+    assert spool.stats()['replayed'] == 5
+
+
+def test_uncommitted_record_is_read_again(tmpdir):
+    spool = Spool(str(tmpdir))
+    spool.append([b'a'])
+    spool.append([b'b'])
+    assert spool.read() == b'a'
+    assert spool.read() == b'a'
+    spool.commit()
+    assert spool.read() == b'b'
+
+
+def test_resume_after_restart(tmpdir):
+    spool = Spool(str(tmpdir), segment_bytes=16)
+    for idx in range(4):
+        spool.append([b'record %d' % idx])
+    assert spool.read() == b'record 0'
+    spool.commit()
+    spool.close()
+
+    spool = Spool(str(tmpdir), segment_bytes=16)
+    assert spool.read() == b'record 1'
+    assert spool.depth() > 0
+
+
+def test_size_cap_evicts_oldest(tmpdir):
+    spool = Spool(str(tmpdir), max_bytes=64, segment_bytes=16)
+    for idx in range(20):
+        spool.append([b'record %02d' % idx])
+    stats = spool.stats()
+    assert stats['evicted'] > 0
+    assert stats['depth_bytes'] <= 64
+    assert spool.read() != b'record 00'
+
+
+def test_empty_record_is_not_spooled(tmpdir):
+    spool = Spool(str(tmpdir))
+    spool.append([])
+    assert spool.read() is None
+    assert spool.stats()['spooled'] == 0
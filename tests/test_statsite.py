@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+'''Statsite output tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import configparser
+
+from metricol.channels import BatchChannel, MetricBatch
+from metricol.outputs.statsite import Statsite
+
+
+class FakeSocket(object):
+    '''Socket collecting sent datagrams
+    '''
+
+    def __init__(self):
+        self.sent = []
+
+
+    def sendto(self, payload, addr):
+        '''Stores the payload
+        '''
+        self.sent.append(payload)
+
+
+def make_statsite(max_datagram_size):
+    '''Returns statsite output with a fake socket
+    '''
+    parser = configparser.ConfigParser()
+    parser.read_dict({'output:statsite': {
+        'host': '127.0.0.1', 'port': '8125',
+        'max_datagram_size': str(max_datagram_size)}})
+    channel = BatchChannel()
+    output = Statsite(parser['output:statsite'], channel.subscribe('statsite'))
+    output.prepare_things()
+    output.sock.close()
+    output.sock = FakeSocket()
+    return channel, output
+
+
+def test_negative_gauge_reset_in_same_datagram():
+    channel, output = make_statsite(12)
+    channel.put(MetricBatch(10, [('a', 1, 'c'), ('b', -2, 'g')]))
+    output.do_things()
+    assert output.sock.sent == [b'a:1|c', b'b:0|g\nb:-2|g']
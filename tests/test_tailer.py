@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+'''Log files following tests
+'''
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+    with_statement,
+)
+
+import os
+
+from metricol.tailer import (
+    FileTailer, glob_label, glob_regex, split_chunks, split_lines)
+
+
+def write(fpath, data, mode='ab'):
+    '''Writes data to a file
+    '''
+    with open(fpath, mode) as fd_obj:
+        fd_obj.write(data)
+
+
+def read_lines(tailer):
+    '''Returns lines read by tailer
+    '''
+    return [bytes(line) for line in split_lines(tailer.read())]
+
+
+def test_split_lines():
+    assert [bytes(line) for line in split_lines([b'a\n\nb\nc', b'd\n'])] == [
+        b'a', b'b', b'c', b'd']
+
+
+def test_split_chunks():
+    chunks = list(split_chunks([b'aa\nbb\ncc\n'], 4))
+    assert b''.join(chunks) == b'aa\nbb\ncc\n'
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+
+
+def test_glob_label():
+    regex = glob_regex('/var/log/nginx/*.access.log')
+    assert glob_label(regex, '/var/log/nginx/a.example.com.access.log') == \
+        'a_example_com'
+    assert glob_label(regex, '/var/log/nginx/error.log') is None
+
+
+def test_partial_lines(tmpdir):
+    fpath = str(tmpdir.join('x.log'))
+    write(fpath, b'')
+    tailer = FileTailer(fpath, start_at_end=False)
+    tailer.open()
+    write(fpath, b'1\n2')
+    assert read_lines(tailer) == [b'1']
+    write(fpath, b'\n')
+    assert read_lines(tailer) == [b'2']
+
+
+def test_missing_file(tmpdir):
+    fpath = str(tmpdir.join('x.log'))
+    tailer = FileTailer(fpath, start_at_end=False)
+    tailer.open()
+    assert tailer.check() == b''
+    assert tailer.read() == []
+    write(fpath, b'1\n')
+    assert read_lines(tailer) == [b'1']
+
+
+def test_rename_rotation(tmpdir):
+    fpath = str(tmpdir.join('x.log'))
+    write(fpath, b'1\n')
+    tailer = FileTailer(fpath, start_at_end=False)
+    tailer.open()
+    assert read_lines(tailer) == [b'1']
+    write(fpath, b'2\n')
+    os.rename(fpath, fpath + '.1')
+    write(fpath, b'3\n')
+    assert read_lines(tailer) == [b'2', b'3']
+    assert tailer.stats()['rotations'] == 1
+
+
+def test_copytruncate(tmpdir):
+    fpath = str(tmpdir.join('x.log'))
+    write(fpath, b'line 1\nline 2\n')
+    tailer = FileTailer(fpath, start_at_end=False)
+    tailer.open()
+    assert read_lines(tailer) == [b'line 1', b'line 2']
+    write(fpath, b'new 1\n', 'wb')
+    assert read_lines(tailer) == [b'new 1']
+    assert tailer.stats()['truncations'] == 1
+
+
+def test_copytruncate_rewritten_past_offset(tmpdir):
+    fpath = str(tmpdir.join('x.log'))
+    write(fpath, b'line 1\nline 2\n')
+    tailer = FileTailer(fpath, start_at_end=False)
+    tailer.open()
+    assert read_lines(tailer) == [b'line 1', b'line 2']
+    # truncated and rewritten (to the old size at least) between reads
+    write(fpath, b'next 1\nnext 2\nnext 3\n', 'wb')
+    assert read_lines(tailer) == [b'next 1', b'next 2', b'next 3']
+    assert tailer.stats()['truncations'] == 1
+
+
+def test_checkpoint_resume(tmpdir):
+    fpath = str(tmpdir.join('x.log'))
+    checkpoint_fpath = str(tmpdir.join('x.offset'))
+    write(fpath, b'1\n')
+    tailer = FileTailer(fpath, checkpoint_fpath, start_at_end=False)
+    tailer.open()
+    assert read_lines(tailer) == [b'1']
+    tailer.save_checkpoint()
+    tailer.close()
+    write(fpath, b'2\n')
+    tailer = FileTailer(fpath, checkpoint_fpath)
+    tailer.open()
+    assert read_lines(tailer) == [b'2']